@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from executors import run_inference, INFERENCE_THREADS
+from inference import to_float_input
+
+logger = logging.getLogger(__name__)
+
+# Batching settings, overridable via environment variables.
+# PREDICT_MAX_BATCH_SIZE=1 effectively disables batching.
+MAX_BATCH_SIZE = int(os.environ.get("PREDICT_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.environ.get("PREDICT_MAX_WAIT_MS", "5"))
+MAX_QUEUE_DEPTH = int(os.environ.get("PREDICT_QUEUE_DEPTH", "256"))
+
+
+class BatchQueueFull(Exception):
+    """Raised when the batching queue is at capacity and cannot accept more work."""
+
+
+class BatcherClosed(Exception):
+    """Raised when submitting to a batcher that has been closed (its model version was switched out)."""
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-image inference requests and runs them through
+    the model as one batch.
+
+    A batch is dispatched as soon as either `max_batch_size` inputs are queued
+    or `max_wait_ms` has elapsed since the first input of the batch arrived.
+    Each caller gets back its own row of the batched output.
+
+    Forward passes run on the inference executor, with at most
+    `max_inflight_batches` in flight; inputs that arrive meanwhile simply
+    accumulate into the next batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+        max_queue_depth: int = MAX_QUEUE_DEPTH,
+        max_inflight_batches: int = INFERENCE_THREADS
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        if max_queue_depth < 1:
+            raise ValueError("max_queue_depth must be >= 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_depth = max_queue_depth
+        self.max_inflight_batches = max(1, max_inflight_batches)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self._pending = 0
+        self._closed = False
+
+        self._batch_sizes: Counter = Counter()
+        self._items_total = 0
+        self._batches_total = 0
+        self._rejected_total = 0
+
+    def _ensure_started(self) -> None:
+        """Start the collector task on the running loop (restarting it if the loop changed)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._slots = asyncio.Semaphore(self.max_inflight_batches)
+        self._worker = loop.create_task(self._collect())
+
+    async def submit(self, image_array: np.ndarray) -> np.ndarray:
+        """
+        Queue a single preprocessed image and wait for its prediction row.
+
+        Args:
+            image_array: Model input of shape (1, H, W, C) or (H, W, C)
+
+        Returns:
+            1-D array of class probabilities for this image
+
+        Raises:
+            BatchQueueFull: the queue is at max_queue_depth
+            BatcherClosed: close() was called and reopen() was not
+        """
+        if self._closed:
+            raise BatcherClosed("This batcher has been closed; submit to the current one")
+        self._ensure_started()
+        if image_array.ndim == 3:
+            image_array = image_array[np.newaxis, ...]
+        if image_array.shape[0] != 1:
+            raise ValueError("submit() expects a single image; use run_batch() for batches")
+
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((image_array, future))
+        except asyncio.QueueFull:
+            self._rejected_total += 1
+            raise BatchQueueFull(f"Prediction queue is full ({self.max_queue_depth} pending requests)")
+        metrics.QUEUE_DEPTH.set(self._queue.qsize())
+        self._pending += 1
+        try:
+            return await future
+        finally:
+            self._pending -= 1
+
+    def close(self) -> None:
+        """Refuse new inputs: submit() raises BatcherClosed until reopen()."""
+        self._closed = True
+
+    def reopen(self) -> None:
+        """Accept inputs again after close(); the next submit() starts a fresh collector."""
+        self._closed = False
+
+    async def drain(self, poll_s: float = 0.01) -> None:
+        """After close(), wait until every submitted input has its result, then stop the collector task."""
+        while self._pending:
+            await asyncio.sleep(poll_s)
+        # Reopened meanwhile (switched back to): keep collecting
+        if self._closed and self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        max_wait = self.max_wait_ms / 1000.0
+        while True:
+            # Wait for a free inference slot first so the batch keeps filling meanwhile
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + max_wait
+            while len(batch) < self.max_batch_size:
+                # Drain whatever is already queued before paying for a timed wait
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            metrics.QUEUE_DEPTH.set(self._queue.qsize())
+            task = loop.create_task(self._dispatch(batch))
+            # Keep a reference so the task is not garbage-collected mid-flight
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        """Run one forward pass for the batch and fan the rows back to the waiters."""
+        try:
+            await self._run(batch)
+        finally:
+            self._slots.release()
+
+    async def _run(self, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        # Skip requests whose callers already went away
+        batch = [(arr, fut) for arr, fut in batch if not fut.cancelled()]
+        if not batch:
+            return
+
+        self._batch_sizes[len(batch)] += 1
+        self._batches_total += 1
+        self._items_total += len(batch)
+
+        try:
+            arrays = [arr for arr, _ in batch]
+            if any(arr.dtype != arrays[0].dtype for arr in arrays):
+                # uint8 pixels next to float32 input (e.g. UINT8_INPUT differs
+                # between callers): scale to float rather than let numpy upcast
+                arrays = [to_float_input(arr) for arr in arrays]
+            inputs = np.concatenate(arrays, axis=0)
+            outputs = await run_inference(self.run_batch, inputs)
+        except Exception as e:
+            logger.error(f"Batched inference failed: {str(e)}")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for row, (_, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(outputs[row])
+
+    def stats(self) -> Dict[str, Any]:
+        """Return batching settings and the realized batch-size distribution."""
+        return {
+            "settings": {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "max_queue_depth": self.max_queue_depth
+            },
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_total": self._batches_total,
+            "items_total": self._items_total,
+            "rejected_total": self._rejected_total,
+            "mean_batch_size": round(self._items_total / self._batches_total, 3) if self._batches_total else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())}
+        }
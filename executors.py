@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Executor settings, overridable via environment variables.
+# Inference defaults to one thread: TensorFlow already parallelizes a single
+# forward pass across cores, and the micro-batcher fills batches while it runs.
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "1"))
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# PIL releases the GIL for decode/resize/filter, so threads are the default.
+# Set PREPROCESS_USE_PROCESSES=1 to run preprocessing in separate processes instead.
+PREPROCESS_USE_PROCESSES = os.environ.get("PREPROCESS_USE_PROCESSES") == "1"
+
+_inference_executor: Optional[ThreadPoolExecutor] = None
+_preprocess_executor: Optional[Executor] = None
+_shadow_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """Return the thread pool that runs model forward passes."""
+    global _inference_executor
+    if _inference_executor is None:
+        _inference_executor = ThreadPoolExecutor(
+            max_workers=INFERENCE_THREADS, thread_name_prefix="inference"
+        )
+    return _inference_executor
+
+
+def get_preprocess_executor() -> Executor:
+    """Return the pool that runs image decoding, resizing and enhancement."""
+    global _preprocess_executor
+    if _preprocess_executor is None:
+        if PREPROCESS_USE_PROCESSES:
+            # Spawn rather than fork: forking after TensorFlow has started threads is unsafe
+            _preprocess_executor = ProcessPoolExecutor(
+                max_workers=PREPROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            _preprocess_executor = ThreadPoolExecutor(
+                max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess"
+            )
+    return _preprocess_executor
+
+
+def get_shadow_executor() -> ThreadPoolExecutor:
+    """Return the thread that runs shadow model forward passes (see shadow.py)."""
+    global _shadow_executor
+    if _shadow_executor is None:
+        # One thread of its own, so shadow batches never queue ahead of production ones
+        _shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+    return _shadow_executor
+
+
+async def run_inference(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a model call on the inference executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_preprocessing(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a CPU-bound preprocessing step on the preprocessing executor.
+
+    When the process pool is enabled, `fn` and its arguments must be picklable
+    (module-level functions or methods of picklable objects).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_preprocess_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_shadow(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a shadow model call on the shadow thread without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_shadow_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def executor_info() -> Dict[str, Any]:
+    """Describe the configured executors."""
+    return {
+        "inference_threads": INFERENCE_THREADS,
+        "preprocess_workers": PREPROCESS_WORKERS,
+        "preprocess_mode": "process" if PREPROCESS_USE_PROCESSES else "thread"
+    }
+
+
+def shutdown(wait: bool = True) -> None:
+    """Shut down every executor (they are recreated lazily on next use)."""
+    global _inference_executor, _preprocess_executor, _shadow_executor
+    for executor in (_inference_executor, _preprocess_executor, _shadow_executor):
+        if executor is not None:
+            executor.shutdown(wait=wait)
+    _inference_executor = None
+    _preprocess_executor = None
+    _shadow_executor = None
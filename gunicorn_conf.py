@@ -1,4 +1,31 @@
 # Gunicorn production configuration
+import os
+
+# Workers share disease info and medicines through SQLite so CRUD writes are
+# visible to all of them (see knowledge_base.py); an explicit setting wins.
+# The JSON files only seed an empty database: later edits to them need
+# `tools/knowledge_base_io.py import` (workers log a warning until then).
+os.environ.setdefault("KNOWLEDGE_BASE_BACKEND", "sqlite")
+
+# INFERENCE_SHARED=1: one inference process holds the model and the workers
+# send it batches through shared memory (see inference_server.py). Each
+# deployment gets its own socket and auth key; workers inherit both.
+INFERENCE_SHARED = os.environ.get("INFERENCE_SHARED") == "1"
+if INFERENCE_SHARED:
+    import secrets
+    import tempfile
+
+    os.environ.setdefault("INFERENCE_SERVER_SOCKET", os.path.join(tempfile.gettempdir(), f"paddy-inference-{os.getpid()}.sock"))
+    os.environ.setdefault("INFERENCE_SERVER_AUTHKEY", secrets.token_hex(16))
+
+# Workers write their Prometheus samples to files in this directory and
+# /metrics merges them (see metrics.py). Stale files from an earlier run
+# would be merged too, so each deployment starts from an empty directory.
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    import tempfile
+
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="paddy-metrics-")
+
 bind = "0.0.0.0:8000"
 workers = 4
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -10,3 +37,27 @@ preload_app = True
 accesslog = '-'  # stdout
 errorlog = '-'   # stdout
 loglevel = 'info'
+
+
+_inference_process = None
+
+
+def on_starting(server):
+    global _inference_process
+    if INFERENCE_SHARED:
+        import inference_server
+
+        _inference_process = inference_server.start_server_process()
+        server.log.info(f"Started shared inference process (pid {_inference_process.pid})")
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if _inference_process is not None and _inference_process.is_alive():
+        _inference_process.terminate()
+        _inference_process.join(10)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+# Cache-Control sent with cacheable read-only responses. The default makes
+# clients revalidate every time, which costs a 304 with no body.
+READ_CACHE_CONTROL = os.environ.get("READ_CACHE_CONTROL", "no-cache")
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: str
+
+
+def _default(value: Any) -> Any:
+    # orjson handles dict subclasses (FrozenDict) but not tuple subclasses (FrozenMedicines)
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def serialize(content: Any) -> bytes:
+    """Same bytes FastJSONResponse produces for `content` (compact UTF-8 JSON)."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+class FastJSONResponse(JSONResponse):
+    """The app's default response class: JSONResponse rendered by orjson, several times faster than the stdlib encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return serialize(content)
+
+
+def body_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+class ResponseCache:
+    """
+    Serialized JSON bodies memoized per content version.
+
+    Each entry is keyed by endpoint and arguments and remembers the version
+    token it was built from (an immutable knowledge-base snapshot, or the
+    class name list), compared by identity. Until that token changes, repeat
+    requests reuse the same bytes and ETag without rebuilding or
+    re-encoding the payload.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: Hashable,
+        version: Any,
+        build: Callable[[], Any],
+        last_modified: float,
+        etag: Optional[str] = None,
+    ) -> CachedBody:
+        """
+        Return the cached body for `key`, rebuilding it if `version` changed.
+
+        `etag` defaults to a digest of the body; per-disease endpoints pass the
+        record ETag instead so it also works with If-Match on the CRUD API.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is version:
+            return entry[1]
+        body = serialize(build())
+        cached = CachedBody(body, etag or body_etag(body), formatdate(last_modified, usegmt=True))
+        with self._lock:
+            self._entries[key] = (version, cached)
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _etag_listed(header: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag in candidates or ("W/" + etag) in candidates
+
+
+def conditional_response(request: Request, cached: CachedBody, cache_control: str = READ_CACHE_CONTROL) -> Response:
+    """200 with the cached body, or 304 if the client's validators still match."""
+    headers = {"ETag": cached.etag, "Last-Modified": cached.last_modified, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_listed(if_none_match, cached.etag)
+    else:
+        not_modified = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                not_modified = parsedate_to_datetime(cached.last_modified) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                pass
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
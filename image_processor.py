@@ -1,15 +1,84 @@
+import functools
 import io
 import os
-from typing import Tuple, Optional, Union
+from typing import Tuple, Optional, Union, BinaryIO
 from PIL import Image, ImageOps
 import numpy as np
 from fastapi import UploadFile, HTTPException
 import logging
+from executors import PREPROCESS_USE_PROCESSES, run_preprocessing
+import metrics
+from uploads import enforce_upload_size
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Decode straight to a reduced resolution (JPEG DCT scaling / integer reduce)
+# instead of fully decoding large photos. Set SCALED_DECODE=0 to disable.
+SCALED_DECODE = os.environ.get("SCALED_DECODE", "1") != "0"
+
+# Hand the model uint8 pixels: the scaling to [0, 1] happens once per batch in
+# the inference backend (or inside the graph with the tf_uint8 backend), so a
+# request never allocates a float32 image. Set UINT8_INPUT=0 for float32
+# model input scaled here.
+UINT8_INPUT = os.environ.get("UINT8_INPUT", "1") != "0"
+
+# Magic prefix of .npy files (accepted by /predict/raw besides raw bytes)
+NPY_MAGIC = b"\x93NUMPY"
+
+
+def decode_tensor(contents: bytes, shape: Tuple[int, int, int] = (224, 224, 3)) -> Tuple[np.ndarray, str]:
+    """
+    Validate a pre-resized uint8 RGB tensor and return a zero-copy view of it.
+    
+    `contents` is either exactly H*W*3 raw bytes in row-major HWC order or a
+    .npy file of that shape (optionally with a leading batch dimension of 1)
+    and dtype uint8. Only the .npy header is parsed; the pixel data is
+    neither copied nor scanned.
+    
+    Returns:
+        Tuple of (read-only uint8 array of `shape`, "raw" or "npy")
+    """
+    data = contents
+    input_format = "raw"
+    if contents[:len(NPY_MAGIC)] == NPY_MAGIC:
+        input_format = "npy"
+        stream = io.BytesIO(contents)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            array_shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        elif version == (2, 0):
+            array_shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+        else:
+            raise ValueError(f"Unsupported .npy format version {version[0]}.{version[1]}")
+        if dtype != np.uint8:
+            raise ValueError(f"Tensor dtype must be uint8, got {dtype}")
+        if array_shape not in (shape, (1, *shape)):
+            raise ValueError(f"Tensor shape must be {shape}, got {array_shape}")
+        if fortran_order:
+            raise ValueError("Tensor must be in C (row-major) order")
+        data = memoryview(contents)[stream.tell():]
+    
+    expected = shape[0] * shape[1] * shape[2]
+    if len(data) != expected:
+        raise ValueError(f"Expected {expected} bytes of uint8 pixels ({shape[0]}x{shape[1]}x{shape[2]}), got {len(data)}")
+    return np.frombuffer(data, dtype=np.uint8).reshape(shape), input_format
+
+
+def read_image_size(contents: Union[bytes, BinaryIO]) -> Tuple[int, int]:
+    """(width, height) of an encoded image, from its header alone (no pixels are decoded)."""
+    if isinstance(contents, (bytes, bytearray)):
+        contents = io.BytesIO(contents)
+    else:
+        contents.seek(0)
+    try:
+        with Image.open(contents) as image:
+            return image.size
+    except Exception as e:
+        raise ValueError(f"Failed to load image: {str(e)}")
+
+
 class ImageProcessor:
     """
     Handles image processing for rice disease detection model.
@@ -21,12 +90,18 @@ class ImageProcessor:
         target_size: Tuple[int, int] = (224, 224),
         max_file_size: int = 50 * 1024 * 1024,  # 50MB default
         quality: int = 85,
-        supported_formats: Tuple[str, ...] = ('JPEG', 'PNG', 'WEBP', 'BMP', 'TIFF')
+        supported_formats: Tuple[str, ...] = ('JPEG', 'PNG', 'WEBP', 'BMP', 'TIFF'),
+        scaled_decode: bool = SCALED_DECODE,
+        uint8_input: bool = UINT8_INPUT
     ):
         self.target_size = target_size
         self.max_file_size = max_file_size
         self.quality = quality
         self.supported_formats = supported_formats
+        self.scaled_decode = scaled_decode
+        # Box-reduce to within 3x of the target before LANCZOS (thumbnail-style)
+        self.reducing_gap = 3.0 if scaled_decode else None
+        self.model_dtype = np.uint8 if uint8_input else np.float32
     
     async def process_uploaded_image(
         self, 
@@ -38,6 +113,10 @@ class ImageProcessor:
         """
         Process an uploaded image file with rice disease-specific optimizations.
         
+        The upload has already been spooled by the multipart parser; its size
+        is checked without reading it, and the decoder then reads the spooled
+        file directly on the preprocessing executor.
+        
         Args:
             file: FastAPI UploadFile object
             maintain_aspect_ratio: Whether to maintain aspect ratio during resizing
@@ -48,72 +127,200 @@ class ImageProcessor:
             Tuple of (processed_image_array, metadata_dict)
         """
         try:
-            # Validate file size
-            await self._validate_file_size(file)
-            
-            # Read and validate image
-            image = await self._load_image(file)
-            
-            # Get original metadata
-            metadata = self._extract_metadata(image, file)
+            with metrics.stage("upload_read"):
+                # Validate file size
+                file_size = await self._validate_file_size(file)
+                
+                await file.seek(0)
+                if PREPROCESS_USE_PROCESSES:
+                    # Worker processes need the bytes themselves
+                    source = await file.read()
+                else:
+                    # Threads decode straight from the spooled upload, no extra copy
+                    source = file.file
             
-            # Process the image
-            processed_image = self._process_image(
-                image, 
+            return await run_preprocessing(
+                self.process_image_bytes,
+                source,
+                filename=file.filename,
+                content_type=file.content_type,
                 maintain_aspect_ratio=maintain_aspect_ratio,
                 fill_color=fill_color,
-                enhance_features=enhance_features
+                enhance_features=enhance_features,
+                file_size=file_size
             )
             
-            # Convert to numpy array for model input
-            image_array = self._to_model_format(processed_image)
-            
-            return image_array, metadata
-            
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Image processing failed: {str(e)}")
             raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
     
-    async def _validate_file_size(self, file: UploadFile) -> None:
-        """Validate that the uploaded file size is within limits."""
-        # For now, skip file size validation to avoid seek issues
-        # File size will be checked during processing
-        pass
+    def process_image_bytes(
+        self,
+        contents: Union[bytes, BinaryIO],
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        maintain_aspect_ratio: bool = True,
+        fill_color: Tuple[int, int, int] = (255, 255, 255),
+        enhance_features: bool = True,
+        file_size: Optional[int] = None
+    ) -> Tuple[np.ndarray, dict]:
+        """
+        Synchronously decode, resize and enhance raw image bytes.
+        
+        This is the CPU-bound part of the pipeline. It only raises plain
+        exceptions so that it can run in a worker process.
+        
+        Args:
+            contents: Encoded image as bytes, or a binary file object to decode from
+            file_size: Size of the encoded image in bytes, if already known
+        
+        Returns:
+            Tuple of (processed_image_array, metadata_dict)
+        """
+        if file_size is None and isinstance(contents, (bytes, bytearray)):
+            file_size = len(contents)
+        
+        # Read and validate image
+        with metrics.stage("decode"):
+            image, source = self._load_image(contents, content_type)
+        
+        # Get original metadata
+        metadata = self._extract_metadata(source, filename, content_type, file_size)
+        metrics.observe_upload(file_size, source["size"])
+        
+        # Process the image
+        processed_image = self._process_image(
+            image, 
+            maintain_aspect_ratio=maintain_aspect_ratio,
+            fill_color=fill_color,
+            enhance_features=enhance_features
+        )
+        
+        # Convert to numpy array for model input
+        with metrics.stage("to_model_format"):
+            image_array = self._to_model_format(processed_image)
+        
+        return image_array, metadata
     
-    async def _load_image(self, file: UploadFile) -> Image.Image:
-        """Load and validate the uploaded image."""
+    def process_tensor(self, pixels: np.ndarray, enhance_features: bool = True) -> np.ndarray:
+        """
+        Turn a pre-resized (H, W, 3) uint8 tensor into model input, skipping decode and resize.
+        
+        With enhance_features the rice enhancement chain runs as in
+        process_image_bytes; without it uint8 model input is a zero-copy view
+        of `pixels`, and float32 input is scaled to [0, 1] straight into the
+        model buffer.
+        
+        Returns:
+            uint8 (or float32 with UINT8_INPUT=0) array of shape (1, H, W, 3)
+        """
+        if not enhance_features and self.model_dtype == np.uint8:
+            return pixels[np.newaxis]
+        if not enhance_features:
+            image_array = np.empty((1, *pixels.shape), dtype=np.float32)
+            with metrics.stage("to_model_format"):
+                # Same float32 arithmetic as _to_model_format, without the intermediate array
+                np.divide(pixels, np.float32(255.0), out=image_array[0], dtype=np.float32)
+            return image_array
+        
+        with metrics.stage("enhance"):
+            enhanced_image = self._enhance_image(Image.fromarray(pixels), rice_specific=True)
+        with metrics.stage("to_model_format"):
+            return self._to_model_format(enhanced_image)
+
+    def decode_pixels(
+        self,
+        contents: Union[bytes, BinaryIO],
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        file_size: Optional[int] = None
+    ) -> Tuple[np.ndarray, dict]:
+        """
+        Decode an image to one (H, W, 3) uint8 array, without resizing or enhancing it.
+
+        Used for tiled prediction, which cuts model inputs out of the decoded
+        pixels; create the processor with scaled_decode=False to keep the
+        full resolution.
+
+        Returns:
+            Tuple of (pixels, metadata_dict)
+        """
+        if file_size is None and isinstance(contents, (bytes, bytearray)):
+            file_size = len(contents)
+        with metrics.stage("decode"):
+            image, source = self._load_image(contents, content_type)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            pixels = np.asarray(image)
+        metrics.observe_upload(file_size, source["size"])
+        return pixels, self._extract_metadata(source, filename, content_type, file_size)
+
+    async def _validate_file_size(self, file: UploadFile) -> int:
+        """Validate that the uploaded file size is within limits and return it."""
+        return enforce_upload_size(file, self.max_file_size)
+    
+    def _load_image(self, contents: Union[bytes, BinaryIO], content_type: Optional[str]) -> Tuple[Image.Image, dict]:
+        """
+        Load and validate the uploaded image.
+        
+        Returns:
+            Tuple of (decoded image, source info with the original size, format and mode).
+            With scaled decoding a JPEG may be decoded smaller than the original,
+            but never smaller than the target size. Other formats are decoded in
+            full and shrunk with a cheap box reduction during resizing instead.
+        """
         try:
-            contents = await file.read()
-            
             # Validate content type
-            if not file.content_type.startswith("image/"):
+            if not content_type or not content_type.startswith("image/"):
                 raise ValueError("Invalid file type. Please upload an image.")
             
-            # Open image with PIL
-            image = Image.open(io.BytesIO(contents))
+            # Open image with PIL (this only parses the header)
+            if isinstance(contents, (bytes, bytearray)):
+                contents = io.BytesIO(contents)
+            else:
+                contents.seek(0)
+            image = Image.open(contents)
+            
+            # Validate image format before any conversion drops it
+            if image.format not in self.supported_formats:
+                raise ValueError(f"Unsupported image format. Supported formats: {', '.join(self.supported_formats)}")
+            
+            source = {"size": image.size, "format": image.format, "mode": image.mode}
+            
+            if self.scaled_decode and image.format == 'JPEG':
+                # DCT scaling: decode at 1/2, 1/4 or 1/8 scale, never below target size
+                image.draft('RGB' if image.mode not in ('RGB', 'L') else image.mode, self.target_size)
+            
+            # Decode the pixels here (PIL defers it) so truncated files fail
+            # as load errors and decode time is not attributed to resizing
+            image.load()
             
             # Convert to RGB if necessary
             if image.mode not in ('RGB', 'L'):
                 image = image.convert('RGB')
             
-            # Validate image format
-            if image.format not in self.supported_formats:
-                raise ValueError(f"Unsupported image format. Supported formats: {', '.join(self.supported_formats)}")
-            
-            return image
+            return image, source
             
         except Exception as e:
             raise ValueError(f"Failed to load image: {str(e)}")
     
-    def _extract_metadata(self, image: Image.Image, file: UploadFile) -> dict:
+    def _extract_metadata(
+        self,
+        source: dict,
+        filename: Optional[str],
+        content_type: Optional[str],
+        file_size: Optional[int] = None
+    ) -> dict:
         """Extract metadata from the original image."""
         return {
-            "original_size": image.size,
-            "original_format": image.format,
-            "original_mode": image.mode,
-            "file_name": file.filename,
-            "content_type": file.content_type,
-            "file_size_bytes": None  # Skip file size for now
+            "original_size": source["size"],
+            "original_format": source["format"],
+            "original_mode": source["mode"],
+            "file_name": filename,
+            "content_type": content_type,
+            "file_size_bytes": file_size
         }
     
     def _process_image(
@@ -136,16 +343,26 @@ class ImageProcessor:
             Processed PIL Image
         """
         # Step 1: Resize image
-        if maintain_aspect_ratio:
-            resized_image = self._resize_with_aspect_ratio(image, fill_color)
-        else:
-            resized_image = image.resize(self.target_size, Image.Resampling.LANCZOS)
+        with metrics.stage("resize"):
+            resized_image = self._resize(image, maintain_aspect_ratio, fill_color)
         
         # Step 2: Apply image enhancements for better model performance
-        enhanced_image = self._enhance_image(resized_image, rice_specific=enhance_features)
+        with metrics.stage("enhance"):
+            enhanced_image = self._enhance_image(resized_image, rice_specific=enhance_features)
         
         return enhanced_image
     
+    def _resize(
+        self,
+        image: Image.Image,
+        maintain_aspect_ratio: bool,
+        fill_color: Tuple[int, int, int]
+    ) -> Image.Image:
+        """Resize to the target size, padding with fill color when keeping the aspect ratio."""
+        if maintain_aspect_ratio:
+            return self._resize_with_aspect_ratio(image, fill_color)
+        return image.resize(self.target_size, Image.Resampling.LANCZOS, reducing_gap=self.reducing_gap)
+    
     def _resize_with_aspect_ratio(
         self, 
         image: Image.Image, 
@@ -168,7 +385,7 @@ class ImageProcessor:
             new_width = int(self.target_size[1] * image_aspect)
         
         # Resize image
-        resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=self.reducing_gap)
         
         # Create new image with target size and fill color
         result = Image.new('RGB', self.target_size, fill_color)
@@ -250,6 +467,10 @@ class ImageProcessor:
         Convert PIL image to numpy array format suitable for the model.
         Applies proper normalization for TensorFlow/Keras models.
         """
+        if self.model_dtype == np.uint8:
+            # Pixels as they are; the backend scales the whole batch at once
+            return np.expand_dims(np.asarray(image, dtype=np.uint8), axis=0)
+        
         # Convert to numpy array
         image_array = np.array(image, dtype=np.float32)
         
@@ -259,7 +480,8 @@ class ImageProcessor:
         image_array = image_array / 255.0
         
         # Option 1: Simple [0,1] normalization (already done above)
-        # Option 2: ImageNet mean/std normalization (uncomment if model was trained this way)
+        # Option 2: ImageNet mean/std normalization (uncomment if model was trained this way,
+        # or build the tf_uint8 model with `tools/convert_model.py uint8 --normalize imagenet`)
         # mean = np.array([0.485, 0.456, 0.406])
         # std = np.array([0.229, 0.224, 0.225])
         # image_array = (image_array - mean) / std
@@ -351,7 +573,8 @@ async def validate_and_process_image(
     max_size_mb: int = 10,
     target_size: Tuple[int, int] = (224, 224),
     compression_quality: int = 85,
-    enhance_features: bool = True
+    enhance_features: bool = True,
+    maintain_aspect_ratio: bool = True
 ) -> Tuple[np.ndarray, dict]:
     """
     Validate and process image with custom settings optimized for rice disease detection.
@@ -362,6 +585,7 @@ async def validate_and_process_image(
         target_size: Target size for the model
         compression_quality: JPEG compression quality (1-100)
         enhance_features: Whether to apply rice disease-specific enhancements
+        maintain_aspect_ratio: Whether to maintain aspect ratio during resizing
         
     Returns:
         Tuple of (processed_image_array, metadata_dict)
@@ -373,10 +597,31 @@ async def validate_and_process_image(
     )
     
     # Process the image with rice-specific enhancements if requested
-    image_array, metadata = await processor.process_uploaded_image(file, enhance_features=enhance_features)
+    image_array, metadata = await processor.process_uploaded_image(
+        file,
+        maintain_aspect_ratio=maintain_aspect_ratio,
+        enhance_features=enhance_features
+    )
     
     # Add processing information to metadata
-    metadata["processing_info"] = {
+    metadata["processing_info"] = build_processing_info(target_size, compression_quality, enhance_features)
+    
+    return image_array, metadata
+
+
+@functools.lru_cache(maxsize=None)
+def build_processing_info(
+    target_size: Tuple[int, int] = (224, 224),
+    compression_quality: int = 85,
+    enhance_features: bool = True
+) -> dict:
+    """
+    Describe the preprocessing applied to an image, for inclusion in response metadata.
+    
+    Built once per combination of settings; the returned dict is shared
+    between responses and must not be modified.
+    """
+    return {
         "target_size": target_size,
         "compression_applied": True,
         "compression_quality": compression_quality,
@@ -393,5 +638,3 @@ async def validate_and_process_image(
         "optimization_target": "Rice disease detection",
         "enhancement_mode": "rice_optimized" if enhance_features else "standard"
     }
-    
-    return image_array, metadata
@@ -0,0 +1,412 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# Inference settings, overridable via environment variables.
+# INFERENCE_BACKEND: "tf" (the SavedModel through TensorFlow, default),
+# "tf_uint8" (the SavedModel wrapped to take uint8 pixels and scale them in
+# the graph), "tflite" or "onnx" (converted copies of the SavedModel run by a
+# lightweight CPU runtime) or "quantized" (a dynamic-range or INT8 TFLite
+# model); tools/convert_model.py creates all of them. Only the selected
+# backend's runtime is imported, so the other backends never import
+# TensorFlow.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "tf").lower()
+UINT8_MODEL_PATH = os.environ.get("UINT8_MODEL_PATH", "mymodel_uint8")
+TFLITE_MODEL_PATH = os.environ.get("TFLITE_MODEL_PATH", "mymodel.tflite")
+QUANTIZED_MODEL_PATH = os.environ.get("QUANTIZED_MODEL_PATH", "mymodel.quant.tflite")
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "mymodel.onnx")
+# Run the model in one shared inference process instead of in every HTTP
+# worker (see inference_server.py; started by gunicorn_conf.py)
+INFERENCE_SHARED = os.environ.get("INFERENCE_SHARED") == "1"
+# Threads the tflite/onnx runtimes use inside one forward pass (0 = runtime default)
+INFERENCE_INTRA_OP_THREADS = int(os.environ.get("INFERENCE_INTRA_OP_THREADS", "0"))
+
+# Run a dummy forward pass at every batch size before reporting ready
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") == "1"
+MODEL_INPUT_SHAPE = (224, 224, 3)
+
+logger = logging.getLogger(__name__)
+
+# Maximum absolute probability difference a converted model may show against
+# the SavedModel (top-1 must match exactly)
+PARITY_ATOL = 1e-3
+
+
+def to_float_input(batch: np.ndarray) -> np.ndarray:
+    """A model input batch as float32 in [0, 1]; uint8 pixels are scaled here, once per batch."""
+    if batch.dtype == np.uint8:
+        # Same float32 arithmetic as ImageProcessor with UINT8_INPUT=0
+        return np.divide(batch, np.float32(255.0), dtype=np.float32)
+    return batch.astype(np.float32, copy=False)
+
+
+def to_uint8_input(batch: np.ndarray) -> np.ndarray:
+    """A model input batch as uint8 pixels (exact for float input that came from uint8 / 255)."""
+    if batch.dtype == np.uint8:
+        return batch
+    return np.clip(np.rint(batch * np.float32(255.0)), 0, 255).astype(np.uint8)
+
+
+class InferenceBackend:
+    """
+    A loaded classifier.
+
+    `predict` takes a (batch, 224, 224, 3) array as produced by
+    ImageProcessor (uint8 pixels, or float32 in [0, 1] with UINT8_INPUT=0)
+    and returns the (batch, num_classes) probability matrix. It may be
+    called from several inference threads at once.
+    """
+
+    name = "base"
+    # dtype the model itself consumes; `prepare` converts to it right before the call
+    input_dtype = np.float32
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def import_runtime() -> None:
+        """Import the runtime library (the slow part of startup for TensorFlow)."""
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def prepare(self, batch: np.ndarray) -> np.ndarray:
+        return to_uint8_input(batch) if self.input_dtype == np.uint8 else to_float_input(batch)
+
+    @property
+    def input_shape(self) -> Optional[Tuple[Optional[int], ...]]:
+        return None
+
+    @property
+    def output_shape(self) -> Optional[Tuple[Optional[int], ...]]:
+        return None
+
+    def info(self) -> Dict[str, Any]:
+        return {"backend": self.name, "path": self.path}
+
+
+def _shape(dims: Any) -> Optional[Tuple[Optional[int], ...]]:
+    # Unknown dimensions (-1, None or symbolic names) are reported as None
+    if dims is None:
+        return None
+    return tuple(int(d) if isinstance(d, (int, np.integer)) and d >= 0 else None for d in dims)
+
+
+class TFSavedModelBackend(InferenceBackend):
+    """The SavedModel's serving_default signature run eagerly through TensorFlow."""
+
+    name = "tf"
+
+    @staticmethod
+    def import_runtime():
+        import tensorflow  # noqa: F401
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        import tensorflow as tf
+
+        self._model = tf.keras.layers.TFSMLayer(path, call_endpoint="serving_default")
+
+    def predict(self, batch):
+        output_dict = self._model(self.prepare(batch))
+        return next(iter(output_dict.values())).numpy()
+
+    @property
+    def input_shape(self):
+        return _shape(getattr(self._model, "input_shape", None))
+
+    @property
+    def output_shape(self):
+        return _shape(getattr(self._model, "output_shape", None))
+
+
+class TFUint8SavedModelBackend(TFSavedModelBackend):
+    """
+    The SavedModel wrapped by `tools/convert_model.py uint8`: its serving
+    signature takes uint8 NHWC pixels and does the scaling to [0, 1] in the
+    graph, so the batch stays uint8 all the way into TensorFlow.
+    """
+
+    name = "tf_uint8"
+    input_dtype = np.uint8
+
+    def __init__(self, path: str):
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"{path} not found; create it with `python tools/convert_model.py uint8`")
+        super().__init__(path)
+
+
+def _tflite_interpreter_class():
+    # The standalone runtimes are a few MB; full TensorFlow is the last resort
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    A TFLite flatbuffer run by the TFLite interpreter.
+
+    Interpreters are not thread-safe, so each inference thread gets its own.
+    The input tensor is resized when the batch size changes; with a steady
+    batch-size mix each interpreter keeps its tensors allocated. Models with
+    integer input or output (full INT8 quantization) are fed and read through
+    the tensors' scale and zero point, so callers always see float32; uint8
+    pixels go in unchanged when the input tensor is quantized as pixel / 255.
+    """
+
+    name = "tflite"
+    convert_command = "tflite"
+
+    @staticmethod
+    def import_runtime():
+        _tflite_interpreter_class()
+
+    def __init__(self, path: str, num_threads: int = INFERENCE_INTRA_OP_THREADS):
+        super().__init__(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found; create it with `python tools/convert_model.py {self.convert_command}`")
+        self._interpreter_class = _tflite_interpreter_class()
+        self._num_threads = num_threads or None
+        self._local = threading.local()
+        # Build one interpreter up front so a broken model fails at startup
+        self._interpreter()
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            interpreter = self._interpreter_class(model_path=self.path, num_threads=self._num_threads)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+        return interpreter
+
+    def predict(self, batch):
+        interpreter = self._interpreter()
+        input_details = interpreter.get_input_details()[0]
+        if tuple(input_details["shape"]) != batch.shape:
+            interpreter.resize_tensor_input(input_details["index"], batch.shape)
+            interpreter.allocate_tensors()
+        dtype = input_details["dtype"]
+        if np.issubdtype(dtype, np.integer):
+            scale, zero_point = input_details["quantization"]
+            if scale == 0:
+                # Unquantized integer input: the model takes raw pixels
+                batch = to_uint8_input(batch)
+            elif not (batch.dtype == dtype == np.uint8 and zero_point == 0 and np.isclose(scale, 1 / 255)):
+                info = np.iinfo(dtype)
+                batch = np.clip(np.round(to_float_input(batch) / scale + zero_point), info.min, info.max)
+        else:
+            batch = to_float_input(batch)
+        interpreter.set_tensor(input_details["index"], batch.astype(dtype, copy=False))
+        interpreter.invoke()
+        output_details = interpreter.get_output_details()[0]
+        output = interpreter.get_tensor(output_details["index"])
+        if np.issubdtype(output.dtype, np.integer):
+            scale, zero_point = output_details["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    @property
+    def input_shape(self):
+        details = self._interpreter().get_input_details()[0]
+        return _shape(details.get("shape_signature", details["shape"]))
+
+    @property
+    def output_shape(self):
+        details = self._interpreter().get_output_details()[0]
+        return _shape(details.get("shape_signature", details["shape"]))
+
+
+class QuantizedTFLiteBackend(TFLiteBackend):
+    """A quantized TFLite model (see `tools/convert_model.py tflite --quantize`)."""
+
+    name = "quantized"
+    convert_command = "tflite --quantize int8"
+
+
+class OnnxBackend(InferenceBackend):
+    """An ONNX export of the SavedModel run by ONNX Runtime on the CPU."""
+
+    name = "onnx"
+
+    @staticmethod
+    def import_runtime():
+        import onnxruntime  # noqa: F401
+
+    def __init__(self, path: str, num_threads: int = INFERENCE_INTRA_OP_THREADS):
+        super().__init__(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found; create it with `python tools/convert_model.py onnx`")
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        # InferenceSession.run is thread-safe, so one session serves every thread
+        self._session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input = self._session.get_inputs()[0]
+        self._output = self._session.get_outputs()[0]
+        if self._input.type == "tensor(uint8)":
+            self.input_dtype = np.uint8
+
+    def predict(self, batch):
+        return self._session.run([self._output.name], {self._input.name: self.prepare(batch)})[0]
+
+    @property
+    def input_shape(self):
+        return _shape(self._input.shape)
+
+    @property
+    def output_shape(self):
+        return _shape(self._output.shape)
+
+
+BACKENDS = {
+    "tf": TFSavedModelBackend,
+    "tf_uint8": TFUint8SavedModelBackend,
+    "tflite": TFLiteBackend,
+    "quantized": QuantizedTFLiteBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def backend_class(backend: str = INFERENCE_BACKEND) -> type:
+    if backend == "remote":
+        # Client of the shared inference process; imported only where it is used
+        from inference_server import RemoteBackend
+
+        return RemoteBackend
+    if backend not in BACKENDS:
+        raise RuntimeError(f"Unknown INFERENCE_BACKEND '{backend}'. Use tf, tf_uint8, tflite, quantized or onnx.")
+    return BACKENDS[backend]
+
+
+def backend_model_path(saved_model_path: str, backend: str = INFERENCE_BACKEND) -> str:
+    """The model file or directory `backend` loads (known before loading it)."""
+    if backend == "remote":
+        from inference_server import INFERENCE_SERVER_SOCKET
+
+        return INFERENCE_SERVER_SOCKET
+    return {
+        "tf_uint8": UINT8_MODEL_PATH,
+        "tflite": TFLITE_MODEL_PATH,
+        "quantized": QUANTIZED_MODEL_PATH,
+        "onnx": ONNX_MODEL_PATH,
+    }.get(backend, saved_model_path)
+
+
+def create_inference_backend(saved_model_path: str, backend: str = INFERENCE_BACKEND) -> InferenceBackend:
+    """Load the model with the backend selected by INFERENCE_BACKEND."""
+    return backend_class(backend)(backend_model_path(saved_model_path, backend))
+
+
+class ModelLoader:
+    """
+    Startup lifecycle of the model: import the runtime, load, warm up.
+
+    `load()` runs the phases in order and times each one. Warm-up runs a
+    dummy batch at every batch size the micro-batcher can produce, so graph
+    tracing, tensor allocation and kernel selection happen before the first
+    request rather than during it. `state` moves from "pending" through
+    "importing", "loading" and "warming" to "ready" (or "failed").
+    """
+
+    def __init__(
+        self,
+        saved_model_path: str,
+        batch_sizes: Iterable[int],
+        backend: str = INFERENCE_BACKEND,
+        warmup: bool = MODEL_WARMUP,
+        model_path: Optional[str] = None,
+    ):
+        self.saved_model_path = saved_model_path
+        # The file or directory the backend loads (a model registry version, say)
+        self.model_path = model_path or backend_model_path(saved_model_path, backend)
+        self.batch_sizes = sorted(set(batch_sizes)) if warmup else []
+        self.backend = backend
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.phases_ms: Dict[str, float] = {}
+        self.warmup_ms: Dict[int, float] = {}
+        self.model: Optional[InferenceBackend] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _phase(self, name: str, fn):
+        self.state = name
+        start = time.perf_counter()
+        result = fn()
+        self.phases_ms[name] = (time.perf_counter() - start) * 1000
+        return result
+
+    def _warm_up(self) -> None:
+        for size in self.batch_sizes:
+            start = time.perf_counter()
+            self.model.predict(np.zeros((size,) + MODEL_INPUT_SHAPE, dtype=np.uint8))
+            self.warmup_ms[size] = (time.perf_counter() - start) * 1000
+
+    def load(self) -> InferenceBackend:
+        """Run every phase; returns the warmed-up model or raises (leaving state "failed")."""
+        start = time.perf_counter()
+        try:
+            cls = backend_class(self.backend)
+            self._phase("importing", cls.import_runtime)
+            self.model = self._phase("loading", lambda: cls(self.model_path))
+            self._phase("warming", self._warm_up)
+        except Exception as e:
+            # state still names the phase that failed
+            self.error = f"{self.state}: {e}"
+            self.state = "failed"
+            logger.error(f"Model startup failed ({self.backend} backend) while {self.error}")
+            raise
+        self.state = "ready"
+        self.phases_ms["total"] = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"Model ready ({self.backend} backend) in {self.phases_ms['total']:.0f} ms: "
+            + ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.phases_ms.items() if name != "total")
+            + (f"; warm-up per batch size {self._format_warmup()}" if self.warmup_ms else "")
+        )
+        return self.model
+
+    def _format_warmup(self) -> str:
+        return " ".join(f"{size}:{ms:.0f}" for size, ms in self.warmup_ms.items())
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "backend": self.backend,
+            "phases_ms": {name: round(ms, 1) for name, ms in self.phases_ms.items()},
+            "warmup_ms": {str(size): round(ms, 1) for size, ms in self.warmup_ms.items()},
+            "error": self.error,
+        }
+
+
+def parity_report(reference: np.ndarray, candidate: np.ndarray, atol: float = PARITY_ATOL) -> Dict[str, Any]:
+    """Compare two (samples, num_classes) probability matrices from different backends."""
+    if reference.shape != candidate.shape:
+        raise ValueError(f"output shapes differ: {reference.shape} vs {candidate.shape}")
+    diff = np.abs(reference.astype(np.float64) - candidate.astype(np.float64))
+    top1_agreement = float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1)))
+    max_abs_diff = float(diff.max()) if diff.size else 0.0
+    return {
+        "samples": int(reference.shape[0]),
+        "top1_agreement": top1_agreement,
+        "max_abs_diff": max_abs_diff,
+        "mean_abs_diff": float(diff.mean()) if diff.size else 0.0,
+        "atol": atol,
+        "ok": top1_agreement == 1.0 and max_abs_diff <= atol,
+    }
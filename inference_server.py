@@ -0,0 +1,252 @@
+"""
+Shared inference process for multi-worker deployments.
+
+With INFERENCE_SHARED=1, gunicorn (see gunicorn_conf.py) starts one
+inference process that imports the runtime and holds the only copy of the
+model, and every HTTP worker uses RemoteBackend instead of loading its own.
+Workers write each batch into a shared-memory block they own and send only
+its name, shape and dtype over a Unix socket; the server runs the forward pass on
+a zero-copy view of that block and sends back the (small) probability
+matrix. HTTP workers therefore never import TensorFlow, and the model is
+loaded once, after the fork, in a process started with spawn.
+
+The server can also be run on its own:
+
+    python inference_server.py [--socket PATH]
+"""
+import argparse
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+import executors
+from batching import MAX_BATCH_SIZE
+from inference import INFERENCE_BACKEND, InferenceBackend, ModelLoader
+
+logger = logging.getLogger(__name__)
+
+# Shared inference settings, overridable via environment variables.
+# gunicorn_conf.py gives each deployment its own socket path and auth key.
+INFERENCE_SERVER_SOCKET = os.environ.get(
+    "INFERENCE_SERVER_SOCKET", os.path.join(tempfile.gettempdir(), "paddy-inference.sock")
+)
+# How long a worker waits for the inference process to finish loading
+INFERENCE_SERVER_TIMEOUT = float(os.environ.get("INFERENCE_SERVER_TIMEOUT", "300"))
+
+
+def _authkey() -> Optional[bytes]:
+    # Read at connect time: gunicorn_conf.py sets it before workers are forked
+    key = os.environ.get("INFERENCE_SERVER_AUTHKEY")
+    return key.encode() if key else None
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Open a client's block without taking ownership (the client unlinks it)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 registers every attached block for cleanup
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class InferenceServer:
+    """Serves one loaded model to RemoteBackend clients over a Unix socket."""
+
+    def __init__(self, model: InferenceBackend, socket_path: str = INFERENCE_SERVER_SOCKET, info: Optional[Dict[str, Any]] = None):
+        self.model = model
+        self.socket_path = socket_path
+        self.info = {
+            "backend": model.name,
+            "path": model.path,
+            "input_shape": model.input_shape,
+            "output_shape": model.output_shape,
+            "pid": os.getpid(),
+            **(info or {}),
+        }
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self._listener = Listener(socket_path, family="AF_UNIX", authkey=_authkey())
+
+    def serve_forever(self) -> None:
+        """Accept clients until close(); each connection gets its own thread."""
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return  # listener closed
+            except Exception as e:  # failed authentication and the like
+                logger.warning(f"Rejected inference client: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True, name="inference-client").start()
+
+    def _handle(self, conn) -> None:
+        shm: Optional[shared_memory.SharedMemory] = None
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if message[0] == "predict":
+                        _, name, shape, dtype = message
+                        if shm is None or shm.name != name:
+                            # The client grew its buffer; drop the old one
+                            if shm is not None:
+                                shm.close()
+                            shm = _attach(name)
+                        batch = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                        # Forward passes share the process's inference threads
+                        output = executors.get_inference_executor().submit(self.model.predict, batch).result()
+                        del batch
+                        conn.send(("ok", np.ascontiguousarray(output, dtype=np.float32)))
+                    elif message[0] == "info":
+                        conn.send(("ok", self.info))
+                    else:
+                        conn.send(("error", f"unknown request {message[0]!r}"))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            conn.close()
+            if shm is not None:
+                shm.close()
+
+    def close(self) -> None:
+        self._listener.close()
+
+
+def serve(
+    saved_model_path: str = "mymodel",
+    socket_path: str = INFERENCE_SERVER_SOCKET,
+    backend: str = INFERENCE_BACKEND,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> None:
+    """Entry point of the inference process: load and warm up the model, then serve."""
+    logging.basicConfig(level=logging.INFO)
+    loader = ModelLoader(saved_model_path, range(1, max_batch_size + 1), backend=backend)
+    model = executors.get_inference_executor().submit(loader.load).result()
+    server = InferenceServer(model, socket_path, info={"startup": loader.report()})
+    logger.info(f"Inference server (pid {os.getpid()}) listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    Client side of the shared inference process.
+
+    Each calling thread keeps its own connection and shared-memory input
+    buffer (grown when a larger batch arrives), so the per-request traffic
+    is a memcpy into shared memory plus a few hundred bytes on the socket.
+    """
+
+    name = "remote"
+
+    def __init__(self, path: str = INFERENCE_SERVER_SOCKET, timeout: float = INFERENCE_SERVER_TIMEOUT):
+        super().__init__(path)
+        self._local = threading.local()
+        self._buffers_lock = threading.Lock()
+        self._buffers: list = []
+        atexit.register(self.close)
+        # The server only listens once its model is warm, so this also waits for that
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.info = self._call(("info",))
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"inference server at {path} did not come up within {timeout:.0f}s")
+                time.sleep(0.2)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.path, family="AF_UNIX", authkey=_authkey())
+            self._local.conn = conn
+        return conn
+
+    def _call(self, message: Tuple) -> Any:
+        conn = self._connection()
+        try:
+            conn.send(message)
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            # Server went away; reconnect on the next call
+            self._local.conn = None
+            conn.close()
+            raise
+        if status != "ok":
+            raise RuntimeError(f"inference server: {payload}")
+        return payload
+
+    def _buffer(self, nbytes: int) -> shared_memory.SharedMemory:
+        shm = getattr(self._local, "shm", None)
+        if shm is None or shm.size < nbytes:
+            new = shared_memory.SharedMemory(create=True, size=nbytes)
+            with self._buffers_lock:
+                self._buffers.append(new)
+                if shm is not None:
+                    self._buffers.remove(shm)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = self._local.shm = new
+        return shm
+
+    def predict(self, batch):
+        # uint8 batches go across as they are (a quarter of the float32 bytes);
+        # the server's backend scales them
+        batch = np.ascontiguousarray(batch)
+        shm = self._buffer(batch.nbytes)
+        np.ndarray(batch.shape, dtype=batch.dtype, buffer=shm.buf)[...] = batch
+        return self._call(("predict", shm.name, batch.shape, batch.dtype.str))
+
+    @property
+    def input_shape(self):
+        return self.info.get("input_shape")
+
+    @property
+    def output_shape(self):
+        return self.info.get("output_shape")
+
+    def close(self) -> None:
+        """Unlink this process's shared-memory buffers."""
+        with self._buffers_lock:
+            buffers, self._buffers = self._buffers, []
+        for shm in buffers:
+            try:
+                shm.close()
+                shm.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+
+
+def start_server_process(saved_model_path: str = "mymodel", socket_path: str = INFERENCE_SERVER_SOCKET):
+    """Spawn the inference process (a fresh interpreter, so nothing TF-related is forked)."""
+    import multiprocessing
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(saved_model_path, socket_path), name="inference-server", daemon=True
+    )
+    process.start()
+    return process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=INFERENCE_SERVER_SOCKET)
+    parser.add_argument("--model", default="mymodel", help="SavedModel directory (tf backend)")
+    args = parser.parse_args()
+    serve(args.model, args.socket)
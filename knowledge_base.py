@@ -0,0 +1,1092 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Storage settings, overridable via environment variables.
+# KNOWLEDGE_BASE_BACKEND: "json" (the JSON files are the store, default) or
+# "sqlite" (WAL database shared by all workers, seeded from the JSON files).
+KNOWLEDGE_BASE_BACKEND = os.environ.get("KNOWLEDGE_BASE_BACKEND", "json").lower()
+KNOWLEDGE_BASE_PATH = os.environ.get("KNOWLEDGE_BASE_PATH", "knowledge_base.sqlite3")
+# json backend: append record updates to `<file>.journal` instead of rewriting
+# the file, and fold the journal back into the file once it reaches
+# KNOWLEDGE_BASE_JOURNAL_MAX_BYTES (see JournaledDocumentStore). Has no effect
+# with sqlite, which gunicorn_conf.py makes the default for the Docker image.
+KNOWLEDGE_BASE_JOURNAL = os.environ.get("KNOWLEDGE_BASE_JOURNAL", "1") == "1"
+KNOWLEDGE_BASE_JOURNAL_MAX_BYTES = int(os.environ.get("KNOWLEDGE_BASE_JOURNAL_MAX_BYTES", str(1024 * 1024)))
+DISEASE_INFO_FILE = "disease_info.json"
+DISEASE_MEDICINES_FILE = "disease_medicines.json"
+
+T = TypeVar("T")
+
+
+class FrozenDict(dict):
+    """Read-only dict used for shared knowledge-base snapshots (still serializes as a dict)."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("knowledge base snapshots are read-only; use mutable_copy() to edit")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return id(self)
+
+
+def freeze(value: Any) -> Any:
+    """Recursively convert parsed JSON into FrozenDict / tuple structures."""
+    if isinstance(value, (FrozenDict, FrozenMedicines)):
+        # Already frozen all the way down
+        return value
+    if isinstance(value, MedicineIndex):
+        return value.freeze()
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Recursively convert a frozen snapshot back into plain dicts and lists."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, MedicineIndex)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def _priority(medicine: Mapping[str, Any]) -> int:
+    priority = medicine.get("priority")
+    return 999 if priority is None else priority
+
+
+def _name_key(medicine: Mapping[str, Any]) -> str:
+    return (medicine.get("name") or "").lower()
+
+
+def _count_names(medicines: Iterable[Mapping[str, Any]]) -> Dict[str, int]:
+    names: Dict[str, int] = {}
+    for medicine in medicines:
+        key = _name_key(medicine)
+        names[key] = names.get(key, 0) + 1
+    return names
+
+
+class FrozenMedicines(tuple):
+    """
+    Read-only medicine list of one disease, in priority order.
+
+    Priorities are always 1..n in list order, so readers return the tuple as
+    is. `names` counts medicines per lower-cased name for O(1) lookups.
+    """
+
+    def __new__(cls, medicines: Iterable[Mapping[str, Any]] = (), names: Optional[Dict[str, int]] = None):
+        self = super().__new__(cls, medicines)
+        self.names = _count_names(self) if names is None else names
+        return self
+
+    def has_name(self, name: str) -> bool:
+        return name.lower() in self.names
+
+
+def medicine_catalog(medicines: Iterable[Mapping[str, Any]]) -> FrozenMedicines:
+    """Freeze a loaded medicine list: stable sort by priority, then number priorities 1..n."""
+    if isinstance(medicines, FrozenMedicines):
+        return medicines
+    ordered = sorted(medicines, key=_priority)
+    return FrozenMedicines(
+        freeze(m if m.get("priority") == i else {**m, "priority": i})
+        for i, m in enumerate(ordered, start=1)
+    )
+
+
+def freeze_catalog(data: Mapping[str, Any]) -> FrozenDict:
+    """Freeze a whole medicines document ({disease: [medicine, ...]})."""
+    return FrozenDict((disease, medicine_catalog(items)) for disease, items in data.items())
+
+
+class MedicineIndex:
+    """
+    Editable medicine list of one disease, kept in priority order.
+
+    Built from a FrozenMedicines snapshot without copying its items: insert,
+    move and delete only replace the items whose priority actually changes
+    (the range between the old and new position), and the name index is
+    updated in place. Positions `dirty_from` up to `dirty_to` changed (up to
+    the end when `resized`), so storage backends can rewrite just that range.
+
+    A medicine's priority is its 1-based position: inserting at priority p
+    puts it before the current p-th item, priority 0 means first and
+    anything past the end appends.
+    """
+
+    def __init__(self, medicines: Iterable[Mapping[str, Any]] = ()):
+        if not isinstance(medicines, FrozenMedicines):
+            medicines = medicine_catalog(medicines)
+        self.items: List[Mapping[str, Any]] = list(medicines)
+        self.names = dict(medicines.names)
+        self.dirty_from: Optional[int] = None
+        self.dirty_to = 0
+        self.resized = False
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx: int) -> Mapping[str, Any]:
+        return self.items[idx]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def has_name(self, name: str) -> bool:
+        return name.lower() in self.names
+
+    def _add_name(self, medicine: Mapping[str, Any]) -> None:
+        key = _name_key(medicine)
+        self.names[key] = self.names.get(key, 0) + 1
+
+    def _remove_name(self, medicine: Mapping[str, Any]) -> None:
+        key = _name_key(medicine)
+        if self.names.get(key, 0) > 1:
+            self.names[key] -= 1
+        else:
+            self.names.pop(key, None)
+
+    def _position_for(self, medicine: Mapping[str, Any]) -> int:
+        return min(max(_priority(medicine) - 1, 0), len(self.items))
+
+    def _renumber(self, start: int, stop: int, resized: bool) -> None:
+        items = self.items
+        for i in range(start, stop):
+            if items[i].get("priority") != i + 1:
+                items[i] = {**items[i], "priority": i + 1}
+        self.dirty_from = start if self.dirty_from is None else min(self.dirty_from, start)
+        self.dirty_to = max(self.dirty_to, stop)
+        self.resized = self.resized or resized
+
+    def insert(self, medicine: Dict[str, Any]) -> int:
+        """Insert at the medicine's priority, shifting later items down; returns the position."""
+        position = self._position_for(medicine)
+        self.items.insert(position, medicine)
+        self._add_name(medicine)
+        self._renumber(position, len(self.items), resized=True)
+        return position
+
+    def replace(self, idx: int, medicine: Dict[str, Any]) -> int:
+        """Replace the item at idx and move it to the new medicine's priority; returns the position."""
+        self._remove_name(self.items.pop(idx))
+        position = self._position_for(medicine)
+        self.items.insert(position, medicine)
+        self._add_name(medicine)
+        self._renumber(min(idx, position), max(idx, position) + 1, resized=False)
+        return position
+
+    def pop(self, idx: int) -> Mapping[str, Any]:
+        """Remove the item at idx; later items move up one priority."""
+        removed = self.items.pop(idx)
+        self._remove_name(removed)
+        self._renumber(idx, len(self.items), resized=True)
+        return removed
+
+    def freeze(self) -> FrozenMedicines:
+        return FrozenMedicines((freeze(m) for m in self.items), dict(self.names))
+
+
+@contextmanager
+def _interprocess_lock(path: str):
+    """Exclusive advisory lock on `path` shared by every worker process on the host."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class JsonDocumentStore:
+    """
+    In-memory cache of a JSON document on disk.
+
+    Readers get an immutable snapshot without taking a lock. Each read only
+    stats the file; the document is re-parsed when its mtime, size or inode
+    changes (e.g. another worker replaced it), or when this process wrote it.
+    Writes hold a thread lock plus an flock on `<path>.lock`, so a
+    read-modify-write in one worker cannot overwrite another worker's change.
+    """
+
+    def __init__(self, path: str, normalize: Callable[[Any], Any] = freeze):
+        self.path = path
+        self.lock_path = path + ".lock"
+        # Turns parsed JSON into the frozen snapshot (e.g. freeze_catalog for medicines)
+        self.normalize = normalize
+        # Serializes reloads and writes; readers of an unchanged file never take it
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._snapshot: Any = FrozenDict()
+        self.version = 0
+
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def snapshot(self) -> Any:
+        """
+        Return the current parsed document as an immutable snapshot.
+
+        Raises:
+            json.JSONDecodeError: If the file on disk is malformed
+        """
+        signature = self._stat_signature()
+        if signature == self._signature and self.version:
+            return self._snapshot
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> Any:
+        # Caller holds self._lock; another thread may have reloaded while we waited
+        signature = self._stat_signature()
+        if signature != self._signature or not self.version:
+            if signature is None:
+                data = {}
+            else:
+                with open(self.path, "r", encoding="utf8") as f:
+                    data = json.load(f)
+            self._snapshot = self.normalize(data)
+            self._signature = signature
+            self.version += 1
+        return self._snapshot
+
+    @property
+    def mtime(self) -> float:
+        """Modification time of the loaded document (0 if the file is missing)."""
+        return self._signature[0] / 1e9 if self._signature else 0.0
+
+    def mutable_copy(self) -> Any:
+        """Return a deep, editable copy of the current document."""
+        return thaw(self.snapshot())
+
+    @contextmanager
+    def locked(self):
+        """Hold the write lock (thread lock + flock) and yield the latest snapshot."""
+        with self._lock, _interprocess_lock(self.lock_path):
+            yield self._refresh()
+
+    def write(self, data: Any) -> None:
+        """Atomically replace the document on disk and refresh the cache."""
+        with self.locked():
+            self._write(data)
+
+    def _write(self, data: Any) -> None:
+        # Caller holds locked(); write to temp + fsync + atomic replace
+        directory = os.path.dirname(self.path) or "."
+        tmp_fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf8") as tmp:
+                json.dump(data, tmp, indent=4, ensure_ascii=False)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            # Clean up temp file if something goes wrong
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._snapshot = self.normalize(data)
+        self._signature = self._stat_signature()
+        self.version += 1
+
+    def put(self, key: str, value: Any) -> None:
+        """Set one top-level key of the document; caller holds locked()."""
+        data = dict(self._snapshot)
+        data[key] = value
+        self._write(data)
+
+    def sync(self) -> None:
+        """Wait until this process's writes are durable (already true for whole-file writes)."""
+
+    def compact(self) -> None:
+        """Fold pending changes into the document file (nothing to do without a journal)."""
+
+
+def _fsync_directory(path: str) -> None:
+    """Make a rename or file creation in the directory of `path` durable."""
+    if os.name != "posix":  # pragma: no cover - directories cannot be opened elsewhere
+        return
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _encode_journal_record(key: str, value: Any) -> bytes:
+    payload = json.dumps({"k": key, "v": value}, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def _decode_journal(chunk: bytes) -> Tuple[List[Tuple[str, Any]], int]:
+    """Parse journal records from `chunk`; returns (records, bytes consumed) up to the first torn or corrupt one."""
+    records, offset = [], 0
+    while True:
+        end = chunk.find(b"\n", offset)
+        if end < 0:
+            break
+        try:
+            crc, payload = chunk[offset:end].split(b" ", 1)
+            if int(crc, 16) != zlib.crc32(payload):
+                break
+            record = json.loads(payload)
+            records.append((record["k"], record["v"]))
+        except (ValueError, KeyError, TypeError):
+            break
+        offset = end + 1
+    return records, offset
+
+
+class JournaledDocumentStore(JsonDocumentStore):
+    """
+    JsonDocumentStore that logs updates to an append-only journal.
+
+    `put` appends one compact line (`<crc32> {"k": key, "v": value}`) to
+    `<path>.journal` instead of rewriting the pretty-printed document, so a
+    write costs the size of the record rather than of the file. Other workers
+    notice the journal growing and apply only the new records. Once the
+    journal passes `max_journal_bytes` (and on `compact()`, e.g. at
+    shutdown) it is folded back into the document file and started afresh.
+    On startup the first snapshot replays the journal on top of the file.
+
+    Group commit: appends happen under the write lock but the fsync does not.
+    `sync()` waits until this process's records are on disk; while one thread
+    runs fsync, writers that append in the meantime queue up and are covered
+    by the next single fsync instead of one each.
+
+    Crash durability:
+      - A write is durable once `sync()` returns (KnowledgeBase updates call
+        it before returning, so before the HTTP response is sent). A write
+        that had not returned may or may not survive a crash.
+      - Other workers can read a record before it is durable.
+      - A record torn by a crash fails its checksum; replay stops there and
+        the next writer truncates the journal to the last intact record.
+      - Records set whole values, so replaying them more than once is
+        harmless. Compaction fsyncs the new document file and its directory
+        before it replaces the journal with an empty one, so a crash at any
+        point during compaction leaves either the old file plus the full
+        journal or the new file plus a journal it already contains.
+    """
+
+    def __init__(self, path: str, normalize: Callable[[Any], Any] = freeze, max_journal_bytes: int = KNOWLEDGE_BASE_JOURNAL_MAX_BYTES):
+        super().__init__(path, normalize)
+        self.journal_path = path + ".journal"
+        self.max_journal_bytes = max_journal_bytes
+        # Journal file (inode) and byte offset already applied to the snapshot
+        self._journal_inode: Optional[int] = None
+        self._journal_offset = 0
+        # Append handle, reopened when another worker compacts the journal
+        self._journal_fd: Optional[int] = None
+        # Group commit state: records appended / known durable in this process
+        self._sync_cond = threading.Condition()
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.journal_path)
+            journal = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            journal = None
+        return (super()._stat_signature(), journal)
+
+    @property
+    def mtime(self) -> float:
+        stamps = [sig[0] for sig in self._signature or () if sig is not None]
+        return max(stamps) / 1e9 if stamps else 0.0
+
+    def _refresh(self) -> Any:
+        # Caller holds self._lock
+        signature = self._stat_signature()
+        if signature == self._signature and self.version:
+            return self._snapshot
+        base, journal = signature
+        records = None
+        if (
+            self.version
+            and self._signature is not None
+            and base == self._signature[0]
+            and journal is not None
+            # The journal grew, or was created since the last load
+            and journal[2] == (self._journal_inode or journal[2])
+            and journal[1] >= self._journal_offset
+        ):
+            # Apply just the new records (unless the journal was replaced
+            # since the stat, which needs a full reload)
+            try:
+                with open(self.journal_path, "rb") as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    if inode == (self._journal_inode or journal[2]):
+                        f.seek(self._journal_offset)
+                        records, consumed = _decode_journal(f.read())
+            except FileNotFoundError:
+                pass
+        if records is not None:
+            data = dict(self._snapshot)
+            self._journal_inode = inode
+            self._journal_offset += consumed
+        else:
+            # Open the journal before the document: compaction replaces the
+            # document first, so the pair read is never missing records
+            try:
+                journal_file = open(self.journal_path, "rb")
+            except FileNotFoundError:
+                journal_file = None
+            try:
+                try:
+                    with open(self.path, "r", encoding="utf8") as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    data = {}
+                if journal_file is None:
+                    records, consumed, inode = [], 0, None
+                else:
+                    records, consumed = _decode_journal(journal_file.read())
+                    inode = os.fstat(journal_file.fileno()).st_ino
+            finally:
+                if journal_file is not None:
+                    journal_file.close()
+            self._journal_inode, self._journal_offset = inode, consumed
+        for key, value in records:
+            data[key] = value
+        self._snapshot = self.normalize(data)
+        self._signature = signature
+        self.version += 1
+        return self._snapshot
+
+    @contextmanager
+    def locked(self):
+        with self._lock, _interprocess_lock(self.lock_path):
+            snapshot = self._refresh()
+            self._discard_torn_tail()
+            yield snapshot
+
+    def _discard_torn_tail(self) -> None:
+        # Caller holds locked(), so every intact record has been applied;
+        # anything after them is the remains of an append cut short by a crash
+        journal = self._signature[1]
+        if journal is not None and journal[2] == self._journal_inode and journal[1] > self._journal_offset:
+            os.truncate(self.journal_path, self._journal_offset)
+            self._signature = self._stat_signature()
+
+    def _journal_handle(self) -> int:
+        # Caller holds locked()
+        inode = self._signature[1][2] if self._signature[1] is not None else None
+        if self._journal_fd is None or os.fstat(self._journal_fd).st_ino != inode:
+            self._close_journal()
+            self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if inode is None:
+                _fsync_directory(self.journal_path)
+            self._journal_inode = os.fstat(self._journal_fd).st_ino
+        return self._journal_fd
+
+    def _close_journal(self) -> None:
+        # Wait for an in-flight fsync on the old handle before closing it
+        with self._sync_cond:
+            while self._syncing:
+                self._sync_cond.wait()
+            if self._journal_fd is not None:
+                os.close(self._journal_fd)
+                self._journal_fd = None
+
+    def put(self, key: str, value: Any) -> None:
+        """Append one record to the journal; caller holds locked() and calls sync() after releasing it."""
+        line = _encode_journal_record(key, value)
+        os.write(self._journal_handle(), line)
+        with self._sync_cond:
+            self._appended += 1
+        data = dict(self._snapshot)
+        data[key] = value
+        self._snapshot = self.normalize(data)
+        self._signature = self._stat_signature()
+        self._journal_offset = self._signature[1][1]
+        self.version += 1
+        if self._journal_offset >= self.max_journal_bytes:
+            self._write(data)
+
+    def sync(self) -> None:
+        """Block until every record this process has appended so far is on disk."""
+        with self._sync_cond:
+            target = self._appended
+            while self._synced < target:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                # Become the leader: one fsync covers everything appended so far
+                self._syncing = True
+                batch, fd = self._appended, self._journal_fd
+                self._sync_cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self._synced = max(self._synced, batch)
+
+    def _write(self, data: Any) -> None:
+        # Caller holds locked(); the whole document supersedes the journal
+        super()._write(data)
+        _fsync_directory(self.path)
+        if self._signature[1] is not None:
+            directory = os.path.dirname(self.journal_path) or "."
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+            os.fsync(fd)
+            os.close(fd)
+            os.replace(tmp_path, self.journal_path)
+            _fsync_directory(self.journal_path)
+            self._signature = self._stat_signature()
+        self._journal_inode = self._signature[1][2] if self._signature[1] is not None else None
+        self._journal_offset = 0
+        # Everything appended so far is now in the fsynced document
+        self._close_journal()
+        with self._sync_cond:
+            self._synced = self._appended
+            self._sync_cond.notify_all()
+
+    def compact(self) -> None:
+        """Fold the journal into the document file if it holds any records."""
+        with self.locked() as snapshot:
+            if self._journal_offset:
+                self._write(snapshot)
+
+
+class PreconditionFailed(Exception):
+    """An If-Match precondition did not hold; `etag` is the record's current ETag (None if missing)."""
+
+    def __init__(self, etag: Optional[str]):
+        super().__init__(f"record changed (current ETag {etag})")
+        self.etag = etag
+
+
+def record_etag(record: Any) -> str:
+    """Strong ETag for one disease record, derived from its canonical JSON (memoized on frozen records)."""
+    etag = getattr(record, "_etag", None)
+    if etag is None:
+        canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        etag = '"' + hashlib.sha1(canonical.encode("utf8")).hexdigest()[:20] + '"'
+        if isinstance(record, (FrozenDict, FrozenMedicines)):
+            record._etag = etag
+    return etag
+
+
+def etag_matches(if_match: str, etag: Optional[str]) -> bool:
+    """Evaluate an If-Match header value (strong comparison, `*` or a list of ETags)."""
+    if etag is None:
+        return False
+    candidates = [c.strip() for c in if_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+MEDICINES = "medicines"
+DISEASE_INFO = "disease_info"
+
+
+class KnowledgeBase:
+    """
+    Storage interface for disease info and per-disease medicine lists.
+
+    Reads return immutable snapshots (FrozenDict / tuples) that are cheap to
+    call on every request. Every disease record (its info, or its medicine
+    list) has a content-derived ETag.
+
+    Updates are optimistic: the mutation callback runs on an editable copy of
+    one record (a MedicineIndex for medicine lists, a plain dict for disease
+    info) without holding any lock, and the write lock is only taken to
+    check that the record is unchanged and store the result. Writes to
+    different diseases therefore never wait on each other's validation or
+    reordering, and never fail each other's If-Match.
+
+    The store step itself is not per disease: the write lock covers a whole
+    document (one flock per JSON file; SQLite admits one writer at a time),
+    so stores to unrelated diseases still take turns. They are kept short
+    instead: SQLite rewrites only the changed rows, and the journaled JSON
+    store appends one record and fsyncs after the lock is released
+    (`_commit`). Only JsonDocumentStore without a journal
+    (KNOWLEDGE_BASE_JOURNAL=0) rewrites and fsyncs the whole file under the
+    lock. A caller-supplied If-Match that no longer holds raises
+    PreconditionFailed; without one, a lost race is retried and finally run
+    under the lock. The callback may run more than once and must only touch
+    its argument; if it raises, nothing is stored. An update returns once
+    the backend reports the change durable (`_commit`).
+
+    Backends implement `_write_lock`, `_locked_snapshot` and `_store_record`.
+    """
+
+    backend = "base"
+    optimistic_attempts = 3
+
+    def disease_info(self) -> Mapping[str, Mapping[str, Any]]:
+        """All disease info records keyed by disease."""
+        raise NotImplementedError
+
+    def medicines(self) -> Mapping[str, FrozenMedicines]:
+        """All medicine lists keyed by disease, in priority order."""
+        raise NotImplementedError
+
+    def _snapshot(self, kind: str) -> Mapping[str, Any]:
+        return self.medicines() if kind == MEDICINES else self.disease_info()
+
+    def last_modified(self, kind: str) -> float:
+        """Unix time of the last change to the `kind` document, as of the latest snapshot."""
+        raise NotImplementedError
+
+    def etag(self, kind: str, disease: str) -> Optional[str]:
+        """Current ETag of one record (`kind` is MEDICINES or DISEASE_INFO), None if it does not exist."""
+        record = self._snapshot(kind).get(disease)
+        return None if record is None else record_etag(record)
+
+    def update_medicines(
+        self,
+        disease: str,
+        mutate: Callable[[MedicineIndex], T],
+        create: bool = False,
+        if_match: Optional[str] = None,
+    ) -> Tuple[T, str]:
+        """
+        Edit one disease's medicine list; returns (callback result, new ETag).
+
+        Raises:
+            KeyError: If the disease has no medicine list and `create` is False
+            PreconditionFailed: If `if_match` does not match the current list
+        """
+        return self._update(MEDICINES, disease, mutate, create, if_match)
+
+    def update_disease_info(
+        self,
+        disease: str,
+        mutate: Callable[[Dict[str, Any]], T],
+        if_match: Optional[str] = None,
+    ) -> Tuple[T, str]:
+        """
+        Edit one disease info record; returns (callback result, new ETag).
+
+        Raises:
+            KeyError: If the disease does not exist
+            PreconditionFailed: If `if_match` does not match the current record
+        """
+        return self._update(DISEASE_INFO, disease, mutate, False, if_match)
+
+    @staticmethod
+    def _prepare(kind: str, disease: str, record: Any, create: bool, if_match: Optional[str]) -> Any:
+        if if_match is not None and not etag_matches(if_match, None if record is None else record_etag(record)):
+            raise PreconditionFailed(None if record is None else record_etag(record))
+        if record is None and not create:
+            raise KeyError(disease)
+        if kind == MEDICINES:
+            return MedicineIndex(FrozenMedicines() if record is None else record)
+        return {} if record is None else thaw(record)
+
+    def _update(self, kind: str, disease: str, mutate: Callable[[Any], T], create: bool, if_match: Optional[str]) -> Tuple[T, str]:
+        for _ in range(self.optimistic_attempts):
+            record = self._snapshot(kind).get(disease)
+            value = self._prepare(kind, disease, record, create, if_match)
+            result = mutate(value)
+            etag = None
+            with self._write_lock(kind) as tx:
+                current = self._locked_snapshot(tx, kind).get(disease)
+                # Unchanged records keep their frozen object, so identity is the usual fast check
+                if current is record or (
+                    current is not None and record is not None and record_etag(current) == record_etag(record)
+                ):
+                    etag = self._store_record(tx, kind, disease, value)
+            if etag is not None:
+                self._commit(kind)
+                return result, etag
+            if if_match is not None:
+                raise PreconditionFailed(None if current is None else record_etag(current))
+        # Contended record: run the callback under the write lock
+        with self._write_lock(kind) as tx:
+            value = self._prepare(kind, disease, self._locked_snapshot(tx, kind).get(disease), create, if_match)
+            result = mutate(value)
+            etag = self._store_record(tx, kind, disease, value)
+        self._commit(kind)
+        return result, etag
+
+    def _write_lock(self, kind: str):
+        """Context manager excluding other writers of `kind`; yields a handle for the calls below."""
+        raise NotImplementedError
+
+    def _locked_snapshot(self, tx: Any, kind: str) -> Mapping[str, Any]:
+        """Latest snapshot of `kind`, read under the write lock."""
+        raise NotImplementedError
+
+    def _store_record(self, tx: Any, kind: str, disease: str, value: Any) -> str:
+        """Store one record under the write lock (creating it if needed); returns its new ETag."""
+        raise NotImplementedError
+
+    def _commit(self, kind: str) -> None:
+        """Called after the write lock is released; returns once stored records are durable."""
+
+    def compact(self) -> None:
+        """Fold any pending change log into the primary storage (e.g. on shutdown)."""
+
+    def import_documents(self, disease_info: Dict[str, Any], medicines: Dict[str, Any]) -> None:
+        """Replace the whole knowledge base with the given documents."""
+        raise NotImplementedError
+
+    def export_documents(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Return (disease_info, medicines) as plain JSON-compatible documents."""
+        return thaw(self.disease_info()), thaw(self.medicines())
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend}
+
+
+class JsonKnowledgeBase(KnowledgeBase):
+    """
+    Knowledge base stored in disease_info.json and disease_medicines.json.
+
+    With `journal` (KNOWLEDGE_BASE_JOURNAL, the default) each update is
+    appended to `<file>.journal` and group-committed, and the files are
+    rewritten only on compaction; otherwise every update rewrites the file.
+    """
+
+    backend = "json"
+
+    def __init__(
+        self,
+        disease_info_path: str = DISEASE_INFO_FILE,
+        medicines_path: str = DISEASE_MEDICINES_FILE,
+        journal: bool = KNOWLEDGE_BASE_JOURNAL,
+    ):
+        store = JournaledDocumentStore if journal else JsonDocumentStore
+        self.disease_info_store = store(disease_info_path)
+        self.medicines_store = store(medicines_path, normalize=freeze_catalog)
+
+    def disease_info(self):
+        return self.disease_info_store.snapshot()
+
+    def medicines(self):
+        return self.medicines_store.snapshot()
+
+    def _store(self, kind: str) -> JsonDocumentStore:
+        return self.medicines_store if kind == MEDICINES else self.disease_info_store
+
+    def last_modified(self, kind):
+        return self._store(kind).mtime
+
+    @contextmanager
+    def _write_lock(self, kind):
+        store = self._store(kind)
+        with store.locked() as snapshot:
+            yield store, snapshot
+
+    def _locked_snapshot(self, tx, kind):
+        return tx[1]
+
+    def _store_record(self, tx, kind, disease, value):
+        store, _ = tx
+        # The other records keep their frozen objects
+        store.put(disease, freeze(value))
+        return record_etag(store._snapshot[disease])
+
+    def _commit(self, kind):
+        self._store(kind).sync()
+
+    def compact(self):
+        self.disease_info_store.compact()
+        self.medicines_store.compact()
+
+    def import_documents(self, disease_info, medicines):
+        self.disease_info_store.write(disease_info)
+        self.medicines_store.write(medicines)
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "disease_info_path": self.disease_info_store.path,
+            "medicines_path": self.medicines_store.path,
+            "journal": isinstance(self.medicines_store, JournaledDocumentStore),
+        }
+
+
+class SQLiteKnowledgeBase(KnowledgeBase):
+    """
+    Knowledge base in an SQLite database in WAL mode, shared by all workers.
+
+    Readers never block the writer and vice versa; each mutation commits in
+    one short `BEGIN IMMEDIATE` transaction that rewrites only the changed
+    rows of one disease and bumps a global version counter. Every worker
+    keeps a frozen snapshot and, when that counter moves, reloads just the
+    diseases whose row version changed, so a write in one worker is visible
+    to the next request in every other worker.
+
+    An empty database is seeded from the JSON files on first open. After
+    that the files are not read again: an edit to them only takes effect
+    through `tools/knowledge_base_io.py import`, and a warning is logged on
+    open while a file is newer than the database and differs from it.
+    """
+
+    backend = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS kb_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS diseases (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS medicine_categories (disease TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS medicines (
+            disease TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            priority INTEGER,
+            data TEXT NOT NULL,
+            PRIMARY KEY (disease, position)
+        );
+        CREATE INDEX IF NOT EXISTS medicines_by_name ON medicines (disease, name COLLATE NOCASE);
+    """
+    # Columns added after the first schema; ALTER TABLE brings older databases up to date
+    _MIGRATIONS = (
+        "ALTER TABLE diseases ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE medicine_categories ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+    )
+
+    def __init__(
+        self,
+        path: str = KNOWLEDGE_BASE_PATH,
+        seed_disease_info_path: Optional[str] = DISEASE_INFO_FILE,
+        seed_medicines_path: Optional[str] = DISEASE_MEDICINES_FILE,
+    ):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._modified = 0.0
+        self._disease_info: Any = FrozenDict()
+        self._medicines: Any = FrozenDict()
+        # Row version each cached record was loaded at
+        self._row_versions: Dict[Tuple[str, str], int] = {}
+        self._connect().executescript(self._SCHEMA)
+        with self._transaction() as conn:
+            for statement in self._MIGRATIONS:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass  # column already exists
+            # Only the first worker to get here seeds an empty database
+            seeded = conn.execute("SELECT value FROM kb_meta WHERE key = 'version'").fetchone()
+            if seeded is None:
+                self._import(conn, self._read_seed(seed_disease_info_path), self._read_seed(seed_medicines_path))
+        if seeded is not None:
+            self._warn_if_seed_changed(seed_disease_info_path, seed_medicines_path)
+
+    def _warn_if_seed_changed(self, disease_info_path: Optional[str], medicines_path: Optional[str]) -> None:
+        """Warn about JSON files edited after the database's last write; the database ignores them."""
+        documents = self.export_documents()
+        for path, document in zip((disease_info_path, medicines_path), documents):
+            # Files written by an export match the database and are not reported
+            if not path or not os.path.exists(path) or os.path.getmtime(path) <= self._modified:
+                continue
+            if self._read_seed(path) != document:
+                logger.warning(
+                    f"{path} changed after the last write to {self.path} and is ignored by the sqlite "
+                    f"knowledge base; run `python tools/knowledge_base_io.py import` to load it"
+                )
+
+    @staticmethod
+    def _read_seed(path: Optional[str]) -> Dict[str, Any]:
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf8") as f:
+            return json.load(f)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> int:
+        conn.execute(
+            "INSERT INTO kb_meta (key, value) VALUES ('version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        conn.execute(
+            "INSERT INTO kb_meta (key, value) VALUES ('modified', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (int(time.time()),)
+        )
+        return conn.execute("SELECT value FROM kb_meta WHERE key = 'version'").fetchone()[0]
+
+    def _current(self) -> Tuple[Any, Any]:
+        conn = self._connect()
+        version = conn.execute("SELECT value FROM kb_meta WHERE key = 'version'").fetchone()
+        if version is not None and version[0] == self._version:
+            return self._disease_info, self._medicines
+        # Read the counter and the tables in one read transaction for a consistent snapshot
+        conn.execute("BEGIN")
+        try:
+            return self._refresh(conn)
+        finally:
+            conn.execute("COMMIT")
+
+    def _refresh(self, conn: sqlite3.Connection) -> Tuple[Any, Any]:
+        # Caller holds a transaction on conn
+        with self._lock:
+            row = conn.execute("SELECT value FROM kb_meta WHERE key = 'version'").fetchone()
+            version = row[0] if row else 0
+            if version == self._version:
+                return self._disease_info, self._medicines
+            row_versions: Dict[Tuple[str, str], int] = {}
+
+            disease_info = {}
+            for key, row_version in conn.execute("SELECT key, version FROM diseases ORDER BY rowid").fetchall():
+                row_versions[(DISEASE_INFO, key)] = row_version
+                if self._row_versions.get((DISEASE_INFO, key)) == row_version and key in self._disease_info:
+                    disease_info[key] = self._disease_info[key]
+                else:
+                    (data,) = conn.execute("SELECT data FROM diseases WHERE key = ?", (key,)).fetchone()
+                    disease_info[key] = freeze(json.loads(data))
+
+            medicines = {}
+            for disease, row_version in conn.execute("SELECT disease, version FROM medicine_categories ORDER BY rowid").fetchall():
+                row_versions[(MEDICINES, disease)] = row_version
+                if self._row_versions.get((MEDICINES, disease)) == row_version and disease in self._medicines:
+                    medicines[disease] = self._medicines[disease]
+                else:
+                    medicines[disease] = medicine_catalog(
+                        json.loads(data)
+                        for (data,) in conn.execute("SELECT data FROM medicines WHERE disease = ? ORDER BY position", (disease,))
+                    )
+
+            self._disease_info = FrozenDict(disease_info)
+            self._medicines = FrozenDict(medicines)
+            self._row_versions = row_versions
+            self._version = version
+            modified = conn.execute("SELECT value FROM kb_meta WHERE key = 'modified'").fetchone()
+            self._modified = float(modified[0]) if modified else 0.0
+            return self._disease_info, self._medicines
+
+    def disease_info(self):
+        return self._current()[0]
+
+    def medicines(self):
+        return self._current()[1]
+
+    def last_modified(self, kind):
+        self._current()
+        return self._modified
+
+    def _write_lock(self, kind):
+        return self._transaction()
+
+    def _locked_snapshot(self, conn, kind):
+        disease_info, medicines = self._refresh(conn)
+        return medicines if kind == MEDICINES else disease_info
+
+    def _store_record(self, conn, kind, disease, value):
+        version = self._bump_version(conn)
+        if kind == MEDICINES:
+            conn.execute("INSERT OR IGNORE INTO medicine_categories (disease) VALUES (?)", (disease,))
+            conn.execute("UPDATE medicine_categories SET version = ? WHERE disease = ?", (version, disease))
+            if value.dirty_from is not None:
+                # Only positions the index touched are rewritten
+                self._store_medicines(conn, disease, value.items, value.dirty_from, None if value.resized else value.dirty_to)
+        else:
+            conn.execute(
+                "INSERT INTO diseases (key, data, version) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, version = excluded.version",
+                (disease, json.dumps(value, ensure_ascii=False), version)
+            )
+        return record_etag(freeze(value))
+
+    @staticmethod
+    def _store_medicines(
+        conn: sqlite3.Connection,
+        disease: str,
+        medicines: List[Mapping[str, Any]],
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> None:
+        """Replace rows start..stop (to the end when stop is None) with the corresponding items."""
+        if stop is None:
+            conn.execute("DELETE FROM medicines WHERE disease = ? AND position >= ?", (disease, start))
+            stop = len(medicines)
+        else:
+            conn.execute("DELETE FROM medicines WHERE disease = ? AND position >= ? AND position < ?", (disease, start, stop))
+        conn.executemany(
+            "INSERT INTO medicines (disease, position, name, priority, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (disease, position, medicines[position].get("name", ""), medicines[position].get("priority"),
+                 json.dumps(medicines[position], ensure_ascii=False))
+                for position in range(start, stop)
+            ]
+        )
+
+    def _import(self, conn: sqlite3.Connection, disease_info: Dict[str, Any], medicines: Dict[str, Any]) -> None:
+        version = self._bump_version(conn)
+        conn.execute("DELETE FROM diseases")
+        conn.execute("DELETE FROM medicine_categories")
+        conn.execute("DELETE FROM medicines")
+        conn.executemany(
+            "INSERT INTO diseases (key, data, version) VALUES (?, ?, ?)",
+            [(key, json.dumps(record, ensure_ascii=False), version) for key, record in disease_info.items()]
+        )
+        conn.executemany(
+            "INSERT INTO medicine_categories (disease, version) VALUES (?, ?)",
+            [(key, version) for key in medicines]
+        )
+        for disease, items in medicines.items():
+            self._store_medicines(conn, disease, list(medicine_catalog(items)))
+
+    def import_documents(self, disease_info, medicines):
+        with self._transaction() as conn:
+            self._import(conn, disease_info, medicines)
+
+    def stats(self):
+        return {"backend": self.backend, "path": self.path, "version": self._version}
+
+
+def create_knowledge_base() -> KnowledgeBase:
+    """Build the knowledge base selected by KNOWLEDGE_BASE_BACKEND."""
+    if KNOWLEDGE_BASE_BACKEND == "sqlite":
+        return SQLiteKnowledgeBase()
+    if KNOWLEDGE_BASE_BACKEND == "json":
+        return JsonKnowledgeBase()
+    raise RuntimeError(f"Unknown KNOWLEDGE_BASE_BACKEND '{KNOWLEDGE_BASE_BACKEND}'. Use json or sqlite.")
@@ -1,33 +1,116 @@
 
 
-from fastapi import FastAPI, UploadFile, File, Query, Path, HTTPException, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Query, Path, Header, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field, validator
 from auth import get_api_key
 import os
 
 # Allow skipping heavy TensorFlow/model load for local/dev runs by setting SKIP_MODEL_LOAD=1
 SKIP_MODEL = os.environ.get("SKIP_MODEL_LOAD") == "1"
-tf = None
-if not SKIP_MODEL:
-    try:
-        import tensorflow as tf
-    except Exception as e:
-        raise RuntimeError(f"TensorFlow import failed: {e}")
 import numpy as np
 from PIL import Image
 import io
 import json
-import threading
-import tempfile
+import hashlib
+import time
+import asyncio
+import mimetypes
+import zipfile
+import zlib
 import os
-from typing import List, Dict, Any, Optional
-from image_processor import process_image_for_model, validate_and_process_image, ImageProcessor
+import functools
+import logging
+from typing import BinaryIO, List, Dict, Any, Literal, NamedTuple, Optional, Tuple
+from image_processor import process_image_for_model, validate_and_process_image, ImageProcessor, build_processing_info, decode_tensor, read_image_size
+from batching import BatcherClosed, MicroBatcher, BatchQueueFull
+from prediction_cache import create_prediction_cache, make_cache_key
+from uploads import UploadLimitMiddleware, MAX_UPLOAD_MB, MULTIPART_OVERHEAD_BYTES, digest_upload, enforce_upload_size, upload_size
+from urllib.parse import parse_qs
+import executors
+import metrics
+from inference import INFERENCE_BACKEND, INFERENCE_SHARED, ModelLoader, backend_model_path, to_uint8_input
+from model_registry import MODEL_REGISTRY_POLL_S, LoadedModel, ModelRegistry, read_labels
+from shadow import SHADOW_MODEL_VERSION, ShadowEvaluator
+from tiling import TILE_MAX_TILES, TILE_SIZE, TILE_STRIDE, TileGrid, TileSlots, TilingBusy, predict_tiles, summarize
+from knowledge_base import DISEASE_INFO, MEDICINES, MedicineIndex, PreconditionFailed, create_knowledge_base
+from http_cache import FastJSONResponse, ResponseCache, conditional_response, serialize
+
+logger = logging.getLogger(__name__)
+
+
+async def _load_model() -> None:
+    """Import, load and warm up the model on the inference thread, then publish it"""
+    global model
+    try:
+        model = await executors.run_inference(model_loader.load)
+    except Exception:
+        # Reported by /ready and /health; the worker keeps serving non-model endpoints
+        return
+    metrics.set_active_model(MODEL_VERSION)
+    # Kept loaded so a later rollback to it is only a switch
+    model_registry.adopt(LoadedModel(MODEL_VERSION, model, class_names, batcher, startup=model_loader.report()))
+
+
+async def _follow_registry() -> None:
+    """Switch to the version ACTIVE names once another worker (or an operator) has changed it"""
+    failed = None
+    while True:
+        await asyncio.sleep(MODEL_REGISTRY_POLL_S)
+        version = model_registry.active_version()
+        if model is None or version in (MODEL_VERSION, failed) or _activation_lock.locked():
+            continue
+        try:
+            await _activate(version)
+            logger.info(f"Switched to model version {version}")
+        except Exception as e:
+            # Keep serving the current version; retried once ACTIVE changes again
+            failed = version
+            logger.error(f"Could not switch to model version {version}: {e}")
 
 
-app = FastAPI()
+async def _start_shadow(loading: asyncio.Future) -> None:
+    """Once the served model is up, load the SHADOW_MODEL_VERSION candidate and start sampling"""
+    global shadow, shadow_error
+    await loading
+    if model is None:
+        shadow_error = "the served model did not load"
+        return
+    try:
+        # Off the inference threads, which keep serving meanwhile
+        loaded = await asyncio.to_thread(model_registry.load, SHADOW_MODEL_VERSION, False)
+    except Exception as e:
+        shadow_error = f"Failed to load model version '{SHADOW_MODEL_VERSION}': {str(e)}"
+        logger.error(f"Shadow evaluation disabled: {shadow_error}")
+        return
+    shadow = ShadowEvaluator(loaded.version, loaded.model, loaded.class_names)
+    logger.info(f"Shadow evaluation of model version {loaded.version} started")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The model loads in the background so the worker starts serving (and
+    # answering /health and /ready) immediately; /ready turns 200 once warm
+    loading = None if SKIP_MODEL else asyncio.ensure_future(_load_model())
+    following = asyncio.ensure_future(_follow_registry()) if REGISTRY_ENABLED and not SKIP_MODEL else None
+    shadowing = asyncio.ensure_future(_start_shadow(loading)) if SHADOW_ENABLED and loading is not None else None
+    yield
+    for task in (loading, following, shadowing):
+        if task is not None:
+            task.cancel()
+    if shadow is not None:
+        shadow.stop()
+    # Release the inference/preprocessing pools on shutdown
+    executors.shutdown()
+    # Fold the knowledge base change journal back into the JSON files
+    knowledge_base.compact()
+
+
+# orjson serializes responses several times faster than the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Mount static files for serving the web interface
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -42,6 +125,27 @@ if origins_env:
 else:
     origins = ["*"]  # Keep "*" for development, but change for production
 
+def _upload_limit(scope: Dict[str, Any]) -> Optional[int]:
+    """Maximum request body size for an incoming request, enforced while it streams in"""
+    path = scope["path"]
+    if path == "/predict":
+        # Honour the per-request max_size_mb (same bounds as the query parameter)
+        values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("max_size_mb")
+        try:
+            max_size_mb = min(max(int(values[0]), 1), 100) if values else 10
+        except ValueError:
+            max_size_mb = 10
+        return max_size_mb * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES
+    if path == "/predict/batch":
+        return BATCH_MAX_TOTAL_MB * 1024 * 1024 + BATCH_MAX_FILES * MULTIPART_OVERHEAD_BYTES
+    if path == "/predict/raw":
+        # One tensor plus room for a .npy header
+        return RAW_TENSOR_BYTES + 4096
+    return MAX_UPLOAD_MB * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES
+
+
+app.add_middleware(UploadLimitMiddleware, limit_for=_upload_limit)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -63,11 +167,14 @@ async def favicon():
 
 MODEL_PATH = "mymodel"
 LABELS_FILE = "labels.txt"
-DISEASE_INFO_FILE = "disease_info.json"
-DISEASE_MEDICINES_FILE = "disease_medicines.json"
 
-# Thread-level lock for atomic file operations
-_file_lock = threading.Lock()
+# Pre-resized uint8 RGB input accepted by /predict/raw
+RAW_TENSOR_SHAPE = (224, 224, 3)
+RAW_TENSOR_BYTES = RAW_TENSOR_SHAPE[0] * RAW_TENSOR_SHAPE[1] * RAW_TENSOR_SHAPE[2]
+
+# Per-request limits for /predict/batch
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "64"))
+BATCH_MAX_TOTAL_MB = int(os.environ.get("BATCH_MAX_TOTAL_MB", "200"))
 
 # Pydantic model for Medicine validation
 class Medicine(BaseModel):
@@ -105,113 +212,244 @@ class DiseaseInfo(BaseModel):
     care: Optional[List[str]] = None
     note: Optional[str] = None
 
-def _read_medicines_json():
-    """Thread-safe read of medicines JSON file"""
-    with _file_lock:
-        try:
-            with open(DISEASE_MEDICINES_FILE, "r", encoding="utf8") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=500, detail="Malformed JSON in medicines file")
-
-def _write_medicines_json(data: dict):
-    """Safe write: write to temp + atomic replace"""
-    with _file_lock:
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(DISEASE_MEDICINES_FILE))
-        try:
-            with os.fdopen(tmp_fd, "w", encoding="utf8") as tmp:
-                json.dump(data, tmp, indent=4, ensure_ascii=False)
-                tmp.flush()
-                os.fsync(tmp.fileno())
-            os.replace(tmp_path, DISEASE_MEDICINES_FILE)
-        except Exception as e:
-            # Clean up temp file if something goes wrong
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-            raise HTTPException(status_code=500, detail=f"Failed to write medicines file: {str(e)}")
+def _read_medicines():
+    """Current medicines snapshot (read-only) from the knowledge base"""
+    try:
+        return knowledge_base.medicines()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=500, detail="Malformed JSON in medicines file")
 
+def _update_record(kind: str, key: str, mutate, response: Response, if_match: Optional[str], create: bool = False):
+    """
+    Apply `mutate` to one disease record (see KnowledgeBase.update_medicines).
 
-def _read_disease_info_json():
-    """Thread-safe read of disease info JSON file"""
-    with _file_lock:
-        try:
-            with open(DISEASE_INFO_FILE, "r", encoding="utf8") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=500, detail="Malformed JSON in disease info file")
-
-def _write_disease_info_json(data: dict):
-    """Safe write: write to temp + atomic replace"""
-    with _file_lock:
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(DISEASE_INFO_FILE))
-        try:
-            with os.fdopen(tmp_fd, "w", encoding="utf8") as tmp:
-                json.dump(data, tmp, indent=4, ensure_ascii=False)
-                tmp.flush()
-                os.fsync(tmp.fileno())
-            os.replace(tmp_path, DISEASE_INFO_FILE)
-        except Exception as e:
-            # Clean up temp file if something goes wrong
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-            raise HTTPException(status_code=500, detail=f"Failed to write disease info file: {str(e)}")
+    Sets the record's new ETag on the response; a stale If-Match gives 412.
+    """
+    try:
+        if kind == MEDICINES:
+            result, etag = knowledge_base.update_medicines(key, mutate, create=create, if_match=if_match)
+        else:
+            result, etag = knowledge_base.update_disease_info(key, mutate, if_match=if_match)
+    except HTTPException:
+        raise
+    except PreconditionFailed as e:
+        raise HTTPException(
+            status_code=412,
+            detail=f"'{key}' was modified by another request; reload it and retry",
+            headers={"ETag": e.etag} if e.etag else None
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Disease '{key}' not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to write {kind}: {str(e)}")
+    response.headers["ETag"] = etag
+    return result
 
 
+def _read_disease_info():
+    """Current disease info snapshot (read-only) from the knowledge base"""
+    try:
+        return knowledge_base.disease_info()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=500, detail="Malformed JSON in disease info file")
+
 model = None
 class_names = []
-disease_info = {}
-disease_medicines = {}
-
-if not SKIP_MODEL:
-    try:
-        model = tf.keras.layers.TFSMLayer(MODEL_PATH, call_endpoint='serving_default')
-    except Exception as e:
-        raise RuntimeError(f"Failed to load model from {MODEL_PATH}: {e}")
+labels_mtime = 0.0
+# Disease info and medicines, shared by every worker (see knowledge_base.py)
+knowledge_base = create_knowledge_base()
+# Serialized bodies of the cacheable read-only endpoints, per content version
+response_cache = ResponseCache()
 
 try:
-    with open(LABELS_FILE, "r") as f:
-        class_names = [line.strip().split(maxsplit=1)[-1] for line in f if line.strip()]
+    knowledge_base.disease_info()
+    knowledge_base.medicines()
 except Exception as e:
     if not SKIP_MODEL:
-        raise RuntimeError(f"Failed to load labels from {LABELS_FILE}: {e}")
-    class_names = []
+        raise RuntimeError(f"Failed to load knowledge base ({knowledge_base.backend}): {e}")
 
-try:
-    with open(DISEASE_INFO_FILE, "r") as f:
-        disease_info = json.load(f)
-except Exception as e:
-    if not SKIP_MODEL:
-        raise RuntimeError(f"Failed to load disease info from {DISEASE_INFO_FILE}: {e}")
-    disease_info = {}
+
+def _run_model(batch: np.ndarray, served_model: Optional[Any] = None) -> np.ndarray:
+    """Run one forward pass (of the active model by default) and return the (batch, num_classes) probability matrix"""
+    metrics.BATCH_SIZE.observe(len(batch))
+    with metrics.stage("model"):
+        return (model if served_model is None else served_model).predict(batch)
+
+
+def _model_fingerprint(path: str) -> str:
+    """Cheap version tag for the model on disk (file sizes and mtimes of a file or directory)"""
+    try:
+        stamp = []
+        if os.path.isfile(path):
+            st = os.stat(path)
+            stamp.append(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}")
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                st = os.stat(os.path.join(root, name))
+                stamp.append(f"{name}:{st.st_size}:{int(st.st_mtime)}")
+        return hashlib.sha1("|".join(stamp).encode()).hexdigest()[:12]
+    except OSError:
+        return "unknown"
+
+
+# Version tag of the MODEL_PATH model; override with MODEL_VERSION
+BASE_MODEL_VERSION = os.environ.get("MODEL_VERSION") or _model_fingerprint(backend_model_path(MODEL_PATH))
+
+# Coalesces concurrent /predict calls into batched forward passes
+batcher = MicroBatcher(_run_model)
+
+# Versioned models under MODEL_REGISTRY_DIR (see model_registry.py); each
+# version gets its own batcher. The shared inference process loads MODEL_PATH
+# itself, so with INFERENCE_SHARED=1 the registry is not used.
+model_registry = ModelRegistry(
+    lambda served_model: MicroBatcher(functools.partial(_run_model, served_model=served_model)),
+    range(1, batcher.max_batch_size + 1),
+    base_model_path=MODEL_PATH,
+    base_labels_file=LABELS_FILE,
+    base_version=BASE_MODEL_VERSION,
+)
+REGISTRY_ENABLED = model_registry.enabled and not INFERENCE_SHARED
+# The version this worker serves, carried in responses, metrics and prediction cache keys
+MODEL_VERSION = model_registry.active_version() if REGISTRY_ENABLED else BASE_MODEL_VERSION
+previous_version: Optional[str] = None
+# One load/switch at a time per worker
+_activation_lock = asyncio.Lock()
+
+# Candidate version run on sampled traffic next to the served one (see shadow.py);
+# like the registry it lives in, not available with INFERENCE_SHARED=1
+SHADOW_ENABLED = bool(SHADOW_MODEL_VERSION) and REGISTRY_ENABLED
+shadow: Optional[ShadowEvaluator] = None
+shadow_error: Optional[str] = None
 
 try:
-    with open(DISEASE_MEDICINES_FILE, "r") as f:
-        disease_medicines = json.load(f)
+    labels_file = model_registry.labels_file(MODEL_VERSION)
+    class_names = read_labels(labels_file)
+    labels_mtime = os.path.getmtime(labels_file)
 except Exception as e:
     if not SKIP_MODEL:
-        raise RuntimeError(f"Failed to load medicine data from {DISEASE_MEDICINES_FILE}: {e}")
-    disease_medicines = {}
+        raise RuntimeError(f"Failed to load labels for model version {MODEL_VERSION}: {e}")
+    class_names = []
+
+# Loads the INFERENCE_BACKEND model at startup (see lifespan), warming up
+# every batch size the batcher can produce. With INFERENCE_SHARED=1 the
+# worker connects to the shared inference process instead.
+model_loader = ModelLoader(
+    MODEL_PATH,
+    range(1, batcher.max_batch_size + 1),
+    backend="remote" if INFERENCE_SHARED else INFERENCE_BACKEND,
+    model_path=model_registry.model_path(MODEL_VERSION) if REGISTRY_ENABLED else None,
+)
+
+
+class ServedVersion(NamedTuple):
+    """The model version a request runs on (see _submit for when it changes mid-request)"""
+    version: str
+    class_names: List[str]
+    batcher: MicroBatcher
+
+
+def _serving() -> ServedVersion:
+    return ServedVersion(MODEL_VERSION, class_names, batcher)
+
+
+async def _submit(image_array: np.ndarray, served: ServedVersion) -> Tuple[np.ndarray, ServedVersion]:
+    """
+    Run one image on the request's version and return its prediction row and the version that answered.
 
+    A request that was still preprocessing when its version was switched out
+    finds that batcher closed, and runs on the current version instead.
+    """
+    try:
+        return await served.batcher.submit(image_array), served
+    except BatcherClosed:
+        served = _serving()
+        return await served.batcher.submit(image_array), served
+
+
+def _switch_to(loaded: LoadedModel) -> None:
+    """Make `loaded` the active version; requests holding the previous one finish on it"""
+    global model, class_names, labels_mtime, batcher, MODEL_VERSION, previous_version
+    outgoing = batcher
+    # Bind the outgoing batcher to its own model before `model` changes
+    outgoing.run_batch = functools.partial(_run_model, served_model=model)
+    # A version kept loaded may come back (rollback) with the batcher closed on it
+    loaded.batcher.reopen()
+    previous_version = MODEL_VERSION
+    model, class_names, batcher, MODEL_VERSION = loaded.model, loaded.class_names, loaded.batcher, loaded.version
+    labels_mtime = time.time()
+    model_registry.touch(loaded.version)
+    metrics.set_active_model(loaded.version, previous_version)
+    if outgoing is not batcher:
+        # Late submits move to the new version; the collector stops once the
+        # requests already queued are answered
+        outgoing.close()
+        asyncio.ensure_future(outgoing.drain())
+
+
+async def _activate(version: str) -> LoadedModel:
+    """
+    Load and warm up `version` unless it is still loaded, then switch this worker to it.
+
+    The load runs on asyncio's default executor, not the inference pool, so
+    it overlaps the current version's batches rather than queueing them.
+    """
+    async with _activation_lock:
+        loaded = model_registry.loaded(version)
+        if loaded is None:
+            # Not through executors.run_inference: that would hold up live batches for the whole load
+            loaded = await asyncio.to_thread(model_registry.load, version)
+        if loaded.version != MODEL_VERSION:
+            _switch_to(loaded)
+        return loaded
+
+
+def _shadow_sample(image_array: np.ndarray, predictions: np.ndarray, served: ServedVersion) -> None:
+    """Hand an answered image to the shadow candidate, if any; never waits, may drop it"""
+    if shadow is not None:
+        shadow.offer(image_array, predictions, served.class_names, served.version)
 
+# Content-addressed cache of /predict results (None when disabled)
+prediction_cache = create_prediction_cache()
+
+# Admission control for /predict/tiled (TILE_MAX_CONCURRENT per worker)
+tile_slots = TileSlots()
+
+# Metadata fields that depend on the individual request rather than the image bytes
+_REQUEST_METADATA_FIELDS = ("file_name", "content_type", "processing_info")
 
 
 @app.get("/health", tags=["Health"])
 def health_check():
+    """Liveness: the process is serving; 503 only if the model failed to load"""
+    if model_loader.state == "failed":
+        return JSONResponse(status_code=503, content={"status": "error", "message": f"Model failed to load: {model_loader.error}"})
     return {"status": "ok", "message": "Service is up and running"}
 
 
+@app.get("/ready", tags=["Health"])
+def readiness_check():
+    """Readiness: 200 once the model is loaded and warmed up, 503 until then"""
+    if SKIP_MODEL:
+        return {"status": "ready", "model_loaded": False}
+    report = model_loader.report()
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **report})
+    return {"status": "ready", "model_loaded": True, **report}
+
+
+def _require_model() -> None:
+    if model is not None:
+        return
+    if SKIP_MODEL:
+        raise HTTPException(status_code=503, detail="Model not loaded in this runtime (SKIP_MODEL_LOAD=1).")
+    raise HTTPException(status_code=503, detail=f"Model not ready ({model_loader.state}); see /ready.")
+
+
 
 @app.get("/classes", tags=["Model"])
-def get_classes() -> Dict[str, List[str]]:
-    return {"classes": class_names}
+def get_classes(request: Request) -> Dict[str, List[str]]:
+    cached = response_cache.get(("classes",), class_names, lambda: {"classes": class_names}, labels_mtime)
+    return conditional_response(request, cached)
 
 
 
@@ -226,12 +464,233 @@ def model_info() -> Dict[str, Any]:
             "input_shape": input_shape,
             "output_shape": output_shape,
             "num_classes": len(class_names),
-            "model_loaded": True
+            "model_loaded": True,
+            "backend": model.name,
+            "model_version": MODEL_VERSION
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving model info: {str(e)}")
 
 
+@app.get("/batching/stats", tags=["Model"])
+def batching_stats() -> Dict[str, Any]:
+    """Batching settings, current queue depth and realized batch-size distribution, and /predict/tiled admission"""
+    return {**batcher.stats(), "model_version": MODEL_VERSION, "tiled": tile_slots.stats(), "executors": executors.executor_info()}
+
+
+@app.get("/metrics", tags=["Model"], include_in_schema=False)
+def prometheus_metrics() -> Response:
+    """Per-stage latency histograms and prediction counters in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/cache/stats", tags=["Model"])
+def cache_stats() -> Dict[str, Any]:
+    """Prediction cache size, hit/miss counters and evictions"""
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "model_version": MODEL_VERSION, **prediction_cache.stats()}
+
+
+def _require_registry() -> None:
+    if INFERENCE_SHARED:
+        raise HTTPException(
+            status_code=409,
+            detail="The shared inference process serves MODEL_PATH; with INFERENCE_SHARED=1, switch models by restarting it"
+        )
+    if not model_registry.enabled:
+        raise HTTPException(status_code=404, detail=f"No model registry at '{model_registry.root}' (set MODEL_REGISTRY_DIR)")
+
+
+async def _switch_version(version: str) -> Dict[str, Any]:
+    """Activate a version in this worker and record it in ACTIVE for the other workers"""
+    _require_registry()
+    _require_model()
+    try:
+        found = model_registry.exists(version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail=f"Model version '{version}' not found in '{model_registry.root}'")
+    previous = MODEL_VERSION
+    start = time.perf_counter()
+    try:
+        loaded = await _activate(version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load model version '{version}': {str(e)}")
+    model_registry.set_active(loaded.version)
+    return {
+        "active": loaded.version,
+        "previous": previous,
+        "switch_ms": round((time.perf_counter() - start) * 1000, 1),
+        "startup": loaded.startup,
+        "metadata": loaded.metadata
+    }
+
+
+@app.get("/admin/models", tags=["Admin"])
+def list_model_versions(api_key: str = Depends(get_api_key)) -> Dict[str, Any]:
+    """Model versions in the registry, the one this worker serves and the ones it keeps loaded"""
+    _require_registry()
+    versions = model_registry.versions()
+    if model_registry.base_version not in versions:
+        versions.insert(0, model_registry.base_version)
+    loaded = model_registry.loaded_versions()
+    return {
+        "active": MODEL_VERSION,
+        "previous": previous_version,
+        "loaded": loaded,
+        "versions": [
+            {"version": v, "active": v == MODEL_VERSION, "loaded": v in loaded, "metadata": model_registry.metadata(v)}
+            for v in versions
+        ]
+    }
+
+
+@app.post("/admin/models/rollback", tags=["Admin"])
+async def rollback_model_version(api_key: str = Depends(get_api_key)) -> Dict[str, Any]:
+    """Switch back to the previously active version (still loaded, so there is nothing to load)"""
+    _require_registry()
+    if previous_version is None:
+        raise HTTPException(status_code=409, detail="No previous model version to roll back to")
+    return await _switch_version(previous_version)
+
+
+@app.post("/admin/models/{version}/activate", tags=["Admin"])
+async def activate_model_version(
+    version: str = Path(..., description="Version directory name in the model registry"),
+    api_key: str = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Load and warm up a model version, then switch this worker to it.
+    
+    The current version keeps serving until the new one is warm, and requests
+    already in flight finish on it. The switch is written to the registry's
+    ACTIVE file, which the other workers follow within MODEL_REGISTRY_POLL_S
+    seconds. Activating a version that is still loaded (see
+    `/admin/models/rollback`) takes no load at all.
+    """
+    return await _switch_version(version)
+
+
+@app.get("/admin/shadow", tags=["Admin"])
+def shadow_stats(api_key: str = Depends(get_api_key)) -> Dict[str, Any]:
+    """
+    How the shadow candidate (SHADOW_MODEL_VERSION) compares with the served model.
+    
+    Counts are for this worker since it started: samples taken and dropped
+    (the queue was full), the agreement rate on the predicted class overall
+    and per served-model class, the mean candidate-minus-served top-1
+    confidence delta, and the most frequent disagreements.
+    """
+    if shadow is not None:
+        return {"enabled": True, "served_version": MODEL_VERSION, **shadow.stats()}
+    if not SHADOW_MODEL_VERSION:
+        return {"enabled": False}
+    if not SHADOW_ENABLED:
+        status = "needs the model registry (MODEL_REGISTRY_DIR) and INFERENCE_SHARED=0"
+    elif SKIP_MODEL:
+        status = "no model in this runtime (SKIP_MODEL_LOAD=1)"
+    else:
+        status = shadow_error or "loading"
+    return {"enabled": False, "candidate_version": SHADOW_MODEL_VERSION, "status": status}
+
+
+
+# Top-level fields of a prediction response, and the subset each verbosity returns
+# (every response also names the model version in the X-Model-Version header)
+RESPONSE_FIELDS = (
+    "predicted_class", "confidence", "all_confidences", "disease_info", "image_metadata", "prediction_quality", "model_version"
+)
+VERBOSITY_FIELDS = {
+    "minimal": ("predicted_class", "confidence"),
+    "standard": ("predicted_class", "confidence", "all_confidences", "disease_info", "prediction_quality", "model_version"),
+    "full": RESPONSE_FIELDS,
+}
+
+_NORMAL_DISEASE_INFO = {"name": "normal", "description": "No disease detected"}
+# Per-class disease_info blocks for the current knowledge base snapshot
+_disease_blocks: Tuple[Any, Dict[str, Dict[str, Any]]] = (None, {})
+
+
+def _response_fields(verbosity: str, fields: Optional[str], top_k: Optional[int]) -> Tuple[str, ...]:
+    """Resolve the verbosity/fields/top_k query parameters to the fields to return"""
+    if fields:
+        selected = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [f for f in selected if f not in RESPONSE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown response fields {unknown}. Choose from {list(RESPONSE_FIELDS)}")
+    else:
+        selected = VERBOSITY_FIELDS[verbosity]
+    if top_k is not None and "all_confidences" not in selected:
+        selected += ("all_confidences",)
+    return selected
+
+
+def _disease_block(predicted_class: str) -> Dict[str, Any]:
+    """The (shared, read-only) disease_info block for a class, rebuilt when the knowledge base changes"""
+    global _disease_blocks
+    if predicted_class == "normal":
+        return _NORMAL_DISEASE_INFO
+    snapshot = knowledge_base.disease_info()
+    cached_snapshot, blocks = _disease_blocks
+    if cached_snapshot is not snapshot:
+        blocks = {}
+        _disease_blocks = (snapshot, blocks)
+    block = blocks.get(predicted_class)
+    if block is None:
+        details = snapshot.get(predicted_class, {})
+        block = blocks[predicted_class] = {
+            "name": predicted_class,
+            "description": details.get("description", "No description available"),
+            "symptoms": details.get("symptoms", []),
+            "treatment": details.get("treatment", [])
+        }
+    return block
+
+
+def _build_prediction_response(
+    predictions: np.ndarray,
+    metadata: Dict[str, Any],
+    enhance_features: bool,
+    fields: Tuple[str, ...] = RESPONSE_FIELDS,
+    top_k: Optional[int] = None,
+    served: Optional[ServedVersion] = None
+) -> Dict[str, Any]:
+    """Build the per-image prediction payload shared by /predict and /predict/batch"""
+    start = time.perf_counter()
+    served = served or _serving()
+    class_names = served.class_names
+    confidences = predictions.tolist()
+    top_class_idx = int(np.argmax(predictions))
+    predicted_class = class_names[top_class_idx]
+    
+    payload = {}
+    for field in fields:
+        if field == "predicted_class":
+            payload[field] = predicted_class
+        elif field == "confidence":
+            payload[field] = round(confidences[top_class_idx], 4)
+        elif field == "all_confidences":
+            if top_k is None:
+                pairs = zip(class_names, confidences)
+            else:
+                # Most likely first
+                pairs = ((class_names[i], confidences[i]) for i in np.argsort(predictions)[::-1][:top_k])
+            payload[field] = {cls_name: round(conf, 4) for cls_name, conf in pairs}
+        elif field == "disease_info":
+            payload[field] = _disease_block(predicted_class)
+        elif field == "image_metadata":
+            payload[field] = metadata
+        elif field == "prediction_quality":
+            payload[field] = "rice_optimized" if enhance_features else "standard"
+        elif field == "model_version":
+            payload[field] = served.version
+    metrics.observe_stage("response_build", time.perf_counter() - start)
+    metrics.PREDICTIONS.labels(predicted_class, served.version).inc()
+    return payload
+
 
 @app.post("/predict", tags=["Prediction"])
 async def predict(
@@ -239,7 +698,10 @@ async def predict(
     maintain_aspect_ratio: bool = Query(True, description="Maintain aspect ratio during resizing"),
     max_size_mb: int = Query(10, description="Maximum file size in MB", ge=1, le=100),
     compression_quality: int = Query(85, description="JPEG compression quality (1-100)", ge=1, le=100),
-    enhance_features: bool = Query(True, description="Apply rice disease-specific image enhancements for better prediction")
+    enhance_features: bool = Query(True, description="Apply rice disease-specific image enhancements for better prediction"),
+    verbosity: Literal["minimal", "standard", "full"] = Query("full", description="minimal: class and confidence; standard: adds confidences, disease info and quality; full: adds image metadata"),
+    top_k: Optional[int] = Query(None, ge=1, description="Only return the N most likely classes in all_confidences (added to minimal responses too)"),
+    fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return; overrides verbosity")
 ) -> Dict[str, Any]:
     """
     Predict rice disease from uploaded image.
@@ -253,85 +715,406 @@ async def predict(
     - Contrast/sharpness optimization (makes disease features more prominent)
     - Adaptive brightness adjustment (compensates for under/overexposed images)
     - Noise reduction (removes sensor noise while preserving disease features)
+    
+    Repeat uploads of identical bytes with the same options are answered from
+    the prediction cache (`X-Prediction-Cache: hit`).
+    
+    Use `verbosity`, `top_k` or `fields` to shrink the response on slow
+    connections, e.g. `verbosity=minimal` for just the class and confidence.
     """
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model not loaded in this runtime (SKIP_MODEL_LOAD=1).")
+    _require_model()
+    selected = _response_fields(verbosity, fields, top_k)
+    served = _serving()
 
+    metrics.IN_FLIGHT.inc()
     try:
+        cache_key = None
+        if prediction_cache is not None and (file.content_type or "").startswith("image/"):
+            digest = await digest_upload(file)
+            cache_key = make_cache_key(digest, maintain_aspect_ratio, enhance_features, served.version)
+            # Off the event loop: the sqlite backend writes (and may wait on other workers' locks)
+            cached = await asyncio.to_thread(prediction_cache.get, cache_key)
+            if cached is not None:
+                metadata = {
+                    **cached["metadata"],
+                    "file_name": file.filename,
+                    "content_type": file.content_type,
+                    "processing_info": build_processing_info((224, 224), compression_quality, enhance_features)
+                }
+                payload = _build_prediction_response(np.asarray(cached["predictions"]), metadata, enhance_features, selected, top_k, served)
+                return FastJSONResponse(payload, headers={"X-Prediction-Cache": "hit", "X-Model-Version": served.version})
+        
         # Process the uploaded image with rice-specific enhancements
         image_array, metadata = await validate_and_process_image(
             file=file,
             max_size_mb=max_size_mb,
             target_size=(224, 224),
             compression_quality=compression_quality,
-            enhance_features=enhance_features
+            enhance_features=enhance_features,
+            maintain_aspect_ratio=maintain_aspect_ratio
         )
         
-        # Make prediction
-        output_dict = model(image_array)
-        predictions = next(iter(output_dict.values())).numpy()[0]
-        top_class_idx = int(np.argmax(predictions))
-        confidence = float(predictions[top_class_idx])
-        predicted_class = class_names[top_class_idx]
+        # Make prediction (batched with concurrent requests)
+        with metrics.stage("inference"):
+            predictions, served = await _submit(image_array, served)
+        _shadow_sample(image_array, predictions, served)
+        
+        if cache_key is not None:
+            # Keyed by the version that answered, in case a switch moved the request
+            cache_key = make_cache_key(digest, maintain_aspect_ratio, enhance_features, served.version)
+            await asyncio.to_thread(prediction_cache.set, cache_key, {
+                "predictions": [float(p) for p in predictions],
+                "metadata": {k: v for k, v in metadata.items() if k not in _REQUEST_METADATA_FIELDS}
+            })
+        # Returned as a response so FastAPI skips jsonable_encoder; orjson handles the payload directly
+        payload = _build_prediction_response(predictions, metadata, enhance_features, selected, top_k, served)
+        headers = {"X-Model-Version": served.version}
+        if cache_key is not None:
+            headers["X-Prediction-Cache"] = "miss"
+        return FastJSONResponse(payload, headers=headers)
+    except HTTPException:
+        # Re-raise HTTP exceptions (like file size too large)
+        raise
+    except BatchQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed", "application/x-zip")
+
+
+def _is_zip_upload(filename: Optional[str], content_type: Optional[str]) -> bool:
+    return (content_type or "") in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip")
+
+
+def _expand_zip(source: BinaryIO, max_files: int, max_total_bytes: int) -> List[Any]:
+    """Return (name, bytes, content_type) for every image in a zip archive file, enforcing batch limits"""
+    try:
+        source.seek(0)
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Uploaded archive is not a valid zip file")
+
+    with archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith("__MACOSX/")
+            and not os.path.basename(info.filename).startswith(".")
+        ]
+        if len(entries) > max_files:
+            raise HTTPException(status_code=400, detail=f"Batch contains {len(entries)} images; the limit is {max_files}")
+        # Check declared sizes before decompressing anything
+        total_bytes = sum(info.file_size for info in entries)
+        if total_bytes > max_total_bytes:
+            raise HTTPException(status_code=413, detail=f"Batch is {total_bytes} bytes uncompressed; the limit is {max_total_bytes}")
+
+        items = []
+        for info in entries:
+            content_type = mimetypes.guess_type(info.filename)[0] or "application/octet-stream"
+            try:
+                contents = archive.read(info)
+            except (zipfile.BadZipFile, zlib.error, NotImplementedError, OSError) as e:
+                # Corrupt member, CRC mismatch or unsupported compression method
+                raise HTTPException(status_code=400, detail=f"Zip entry '{info.filename}' cannot be read: {str(e)}")
+            items.append((info.filename, contents, content_type))
+        return items
+
+
+def _read_uploads(files: List[UploadFile]) -> List[Any]:
+    """Return (name, bytes, content_type) for every spooled upload (blocking; run on a thread)"""
+    items = []
+    for upload in files:
+        upload.file.seek(0)
+        items.append((upload.filename, upload.file.read(), upload.content_type))
+    return items
+
+
+@app.post("/predict/batch", tags=["Prediction"])
+async def predict_batch(
+    files: List[UploadFile] = File(..., description="Image files, or a single zip archive of images"),
+    maintain_aspect_ratio: bool = Query(True, description="Maintain aspect ratio during resizing"),
+    compression_quality: int = Query(85, description="JPEG compression quality (1-100)", ge=1, le=100),
+    enhance_features: bool = Query(True, description="Apply rice disease-specific image enhancements for better prediction"),
+    verbosity: Literal["minimal", "standard", "full"] = Query("full", description="Response fields per image, as for /predict"),
+    top_k: Optional[int] = Query(None, ge=1, description="Only return the N most likely classes in all_confidences"),
+    fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return; overrides verbosity")
+):
+    """
+    Predict rice disease for many images in one request.
+    
+    Accepts multiple image files or a single zip archive. Images are
+    preprocessed in parallel and run through the model in batches. The
+    response is streamed as NDJSON: one line per image, in completion order,
+    each carrying the image's `index` and the same fields as `/predict`.
+    Images that fail produce a line with an `error` field instead.
+    `verbosity`, `top_k` and `fields` work as for `/predict`.
+    """
+    _require_model()
+    selected = _response_fields(verbosity, fields, top_k)
+    
+    max_total_bytes = BATCH_MAX_TOTAL_MB * 1024 * 1024
+    
+    # Read every upload up front; the files are closed once the handler returns
+    if len(files) == 1 and _is_zip_upload(files[0].filename, files[0].content_type):
+        if upload_size(files[0]) > max_total_bytes:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_TOTAL_MB} MB limit")
+        # Decompressing up to BATCH_MAX_TOTAL_MB is blocking work; read the spooled file on a thread
+        items = await asyncio.to_thread(_expand_zip, files[0].file, BATCH_MAX_FILES, max_total_bytes)
+    else:
+        if len(files) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Batch contains {len(files)} images; the limit is {BATCH_MAX_FILES}")
+        # Check sizes of the spooled uploads before reading any of them
+        if sum(upload_size(upload) for upload in files) > max_total_bytes:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_TOTAL_MB} MB limit")
+        items = await asyncio.to_thread(_read_uploads, files)
+    
+    processor = ImageProcessor(target_size=(224, 224), quality=compression_quality)
+    processing_info = build_processing_info((224, 224), compression_quality, enhance_features)
+    # Every image of the batch runs on the version active when the request arrived,
+    # unless a switch closes it before the image is queued (see _submit)
+    served = _serving()
+    
+    async def predict_one(index: int, name: Optional[str], contents: bytes, content_type: Optional[str]) -> Dict[str, Any]:
+        metrics.IN_FLIGHT.inc()
+        try:
+            image_array, metadata = await executors.run_preprocessing(
+                processor.process_image_bytes,
+                contents,
+                filename=name,
+                content_type=content_type,
+                maintain_aspect_ratio=maintain_aspect_ratio,
+                enhance_features=enhance_features
+            )
+            metadata["processing_info"] = processing_info
+            with metrics.stage("inference"):
+                predictions, answered = await _submit(image_array, served)
+            _shadow_sample(image_array, predictions, answered)
+            return {"index": index, **_build_prediction_response(predictions, metadata, enhance_features, selected, top_k, answered)}
+        except BatchQueueFull as e:
+            return {"index": index, "file_name": name, "status_code": 503, "error": str(e)}
+        except Exception as e:
+            return {"index": index, "file_name": name, "status_code": 400, "error": f"Prediction failed: {str(e)}"}
+        finally:
+            metrics.IN_FLIGHT.dec()
+    
+    async def stream():
+        tasks = [asyncio.ensure_future(predict_one(i, *item)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield serialize(result) + b"\n"
+        finally:
+            # Client went away: stop the remaining work
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"X-Model-Version": served.version})
+
+
+@app.post("/predict/raw", tags=["Prediction"])
+async def predict_raw(
+    request: Request,
+    enhance_features: bool = Query(True, description="Run the rice enhancement chain server-side; disable if the client already enhanced the image"),
+    verbosity: Literal["minimal", "standard", "full"] = Query("full", description="Response fields, as for /predict"),
+    top_k: Optional[int] = Query(None, ge=1, description="Only return the N most likely classes in all_confidences"),
+    fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return; overrides verbosity")
+):
+    """
+    Predict rice disease from an image the client has already resized.
+    
+    The request body is a 224x224 RGB image as uint8: either the 150528 raw
+    bytes in row-major height x width x channel order
+    (`Content-Type: application/octet-stream`), or a `.npy` file of shape
+    (224, 224, 3) or (1, 224, 224, 3). Decoding and resizing are skipped, and
+    the pixels are read in place from the request body. With
+    `enhance_features=false` they go to the model unchanged.
+    """
+    _require_model()
+    selected = _response_fields(verbosity, fields, top_k)
+    served = _serving()
+    
+    metrics.IN_FLIGHT.inc()
+    try:
+        with metrics.stage("upload_read"):
+            body = await request.body()
+        try:
+            pixels, input_format = decode_tensor(body, RAW_TENSOR_SHAPE)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        metrics.observe_upload(len(body), RAW_TENSOR_SHAPE[1::-1])
         
-        # Get disease information if available
-        disease_details = disease_info.get(predicted_class, {})
+        processor = ImageProcessor(target_size=RAW_TENSOR_SHAPE[1::-1])
+        if enhance_features:
+            image_array = await executors.run_preprocessing(processor.process_tensor, pixels, enhance_features=True)
+        else:
+            # A view of the body (or one vectorized scale with UINT8_INPUT=0);
+            # not worth a trip to the executor
+            image_array = processor.process_tensor(pixels, enhance_features=False)
         
-        return {
-            "predicted_class": predicted_class,
-            "confidence": round(confidence, 4),
-            "all_confidences": {
-                cls_name: round(float(conf), 4)
-                for cls_name, conf in zip(class_names, predictions)
-            },
-            "disease_info": {
-                "name": predicted_class,
-                "description": disease_details.get("description", "No description available"),
-                "symptoms": disease_details.get("symptoms", []),
-                "treatment": disease_details.get("treatment", [])
-            } if predicted_class != "normal" else {"name": "normal", "description": "No disease detected"},
-            "image_metadata": metadata,
-            "prediction_quality": "rice_optimized" if enhance_features else "standard"
+        with metrics.stage("inference"):
+            predictions, served = await _submit(image_array, served)
+        _shadow_sample(image_array, predictions, served)
+        metadata = {
+            "input_format": input_format,
+            "input_shape": RAW_TENSOR_SHAPE,
+            "file_size_bytes": len(body),
+            "enhancement_mode": "rice_optimized" if enhance_features else "none"
         }
+        payload = _build_prediction_response(predictions, metadata, enhance_features, selected, top_k, served)
+        return FastJSONResponse(payload, headers={"X-Model-Version": served.version})
+    except HTTPException:
+        raise
+    except BatchQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+@app.post("/predict/tiled", tags=["Prediction"])
+async def predict_tiled(
+    file: UploadFile = File(...),
+    stride: int = Query(TILE_STRIDE, ge=TILE_SIZE // 4, le=TILE_SIZE, description=f"Pixels between tile origins; below {TILE_SIZE} the tiles overlap"),
+    enhance_features: bool = Query(True, description="Apply the rice enhancement chain to each tile"),
+    include_grid: bool = Query(True, description="Return the per-tile class and confidence grids; false returns the field summary only")
+):
+    """
+    Predict rice disease across a high-resolution field or drone image, tile by tile.
+    
+    Instead of shrinking the whole image to 224x224, the image is decoded
+    once at full resolution and the model runs on every 224x224 tile, with
+    tile origins `stride` pixels apart (the last row and column of tiles are
+    flush with the image edges). Each tile is enhanced on its own when
+    `enhance_features=true`.
+    
+    The response has a `grid` of per-tile classes and confidences (row-major,
+    tile origins in `grid.x` and `grid.y`) and a field-level `summary`: the
+    disease found in the most tiles (`normal` when none is), the share of
+    tiles with a disease, per-class tile coverage and mean confidence, and
+    the most confident disease tiles.
+    """
+    _require_model()
+    served = _serving()
+    
+    metrics.IN_FLIGHT.inc()
+    try:
+        # Checked before the upload is decoded, so rejected images cost nothing
+        with tile_slots.acquire():
+            with metrics.stage("upload_read"):
+                file_size = enforce_upload_size(file, MAX_UPLOAD_MB * 1024 * 1024)
+        
+            # The grid is sized from the image header, so over-limit images are never decoded
+            try:
+                width, height = await asyncio.to_thread(read_image_size, file.file)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            grid = TileGrid(height, width, stride=stride)
+            if len(grid) > TILE_MAX_TILES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"The {width}x{height} image gives {len(grid)} tiles at stride {stride}; the limit is {TILE_MAX_TILES}, use a larger stride"
+                )
+        
+            # Full resolution: no scaled JPEG decoding. Always on a thread, even
+            # with PREPROCESS_USE_PROCESSES: the decoded image is used in place
+            # for every tile and is too large to pickle back from a process.
+            processor = ImageProcessor(scaled_decode=False)
+            try:
+                pixels, metadata = await asyncio.to_thread(
+                    processor.decode_pixels, file.file, filename=file.filename, content_type=file.content_type, file_size=file_size
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+            with metrics.stage("inference"):
+                # run_batch is looked up per batch: a version switch mid-request pins it to this version's model
+                probabilities = await predict_tiles(
+                    pixels, grid, lambda batch: served.batcher.run_batch(batch), enhance_features, model_dtype=processor.model_dtype
+                )
+        
+            tiles = summarize(probabilities, grid, served.class_names)
+            summary = tiles["summary"]
+            summary["disease_info"] = _disease_block(summary["predicted_class"])
+            metrics.PREDICTIONS.labels(summary["predicted_class"], served.version).inc()
+            payload = {
+                "summary": summary,
+                "tiling": {
+                    "tile_size": TILE_SIZE,
+                    "stride": stride,
+                    "tiles": len(grid),
+                    "enhancement_mode": "rice_optimized" if enhance_features else "none"
+                },
+                "image_metadata": metadata,
+                "model_version": served.version
+            }
+            if include_grid:
+                payload["grid"] = tiles["grid"]
+            return FastJSONResponse(payload, headers={"X-Model-Version": served.version})
     except HTTPException:
-        # Re-raise HTTP exceptions (like file size too large)
         raise
+    except TilingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        metrics.IN_FLIGHT.dec()
 
 
 
 @app.get("/disease-info", tags=["Disease Info"])
-def list_diseases() -> Dict[str, List[str]]:
-    return {"available_diseases": sorted(list(disease_info.keys()))}
+def list_diseases(request: Request) -> Dict[str, List[str]]:
+    disease_info = _read_disease_info()
+    cached = response_cache.get(
+        ("disease-info",), disease_info,
+        lambda: {"available_diseases": sorted(list(disease_info.keys()))},
+        knowledge_base.last_modified(DISEASE_INFO)
+    )
+    return conditional_response(request, cached)
 
 
 
 @app.get("/disease-info/{name}", tags=["Disease Info"])
-def get_disease_info(name: str = Path(..., description="Disease identifier (e.g., 'blast', 'bacterial_leaf_blight')")) -> Dict[str, Any]:
+def get_disease_info(request: Request, name: str = Path(..., description="Disease identifier (e.g., 'blast', 'bacterial_leaf_blight')")) -> Dict[str, Any]:
     key = name.strip().lower()
+    disease_info = _read_disease_info()
     info = disease_info.get(key)
     if not info:
         raise HTTPException(
             status_code=404,
             detail=f"Disease '{name}' not found. Available options: {list(disease_info.keys())}"
         )
-    return {"disease": key, "info": info}
+    cached = response_cache.get(
+        ("disease-info", key), disease_info,
+        lambda: {"disease": key, "info": info},
+        knowledge_base.last_modified(DISEASE_INFO), knowledge_base.etag(DISEASE_INFO, key)
+    )
+    return conditional_response(request, cached)
 
 
 @app.get("/disease-medicines", tags=["Treatment"])
 def get_disease_medicines(
+    request: Request,
     name: str = Query(..., description="Disease identifier to get recommended medicines (e.g., 'blast')")
 ) -> Dict[str, Any]:
     key = name.strip().lower()
+    disease_medicines = _read_medicines()
     medicines = disease_medicines.get(key)
     if not medicines:
         raise HTTPException(
             status_code=404,
             detail=f"No medicine information found for '{name}'. Available diseases: {list(disease_medicines.keys())}"
         )
-    sorted_medicines = sorted(medicines, key=lambda m: m.get("priority", 999))
-    return {"name": key, "recommended_medicines": sorted_medicines}
+    cached = response_cache.get(
+        ("disease-medicines", key), disease_medicines,
+        lambda: {"name": key, "recommended_medicines": medicines},
+        knowledge_base.last_modified(MEDICINES), knowledge_base.etag(MEDICINES, key)
+    )
+    return conditional_response(request, cached)
 
 
 # CRUD Endpoints for Medicines Management
@@ -339,160 +1122,118 @@ def get_disease_medicines(
 @app.get("/medicines", tags=["Medicines CRUD"])
 def list_all_diseases_crud():
     """List all disease keys in medicines file for CRUD operations"""
-    data = _read_medicines_json()
+    data = _read_medicines()
     return {"available_diseases": sorted(data.keys())}
 
 
 @app.get("/medicines/{disease}", tags=["Medicines CRUD"])
-def list_medicines_crud(disease: str = Path(..., description="Disease key e.g. 'blast'")):
-    """List all medicines for a specific disease"""
+def list_medicines_crud(request: Request, disease: str = Path(..., description="Disease key e.g. 'blast'")):
+    """List all medicines for a specific disease (the ETag header is the list's version, for If-Match)"""
     key = disease.strip().lower()
-    data = _read_medicines_json()
+    data = _read_medicines()
     if key not in data:
         raise HTTPException(
             status_code=404, 
             detail=f"No medicines found for disease '{key}'. Available diseases: {list(data.keys())}"
         )
-    # Sort by priority ascending
-    medicines = sorted(data[key], key=lambda m: m.get("priority", 999))
-    return {"disease": key, "medicines": medicines}
+    # Lists are stored in priority order
+    cached = response_cache.get(
+        ("medicines", key), data,
+        lambda: {"disease": key, "medicines": data[key]},
+        knowledge_base.last_modified(MEDICINES), knowledge_base.etag(MEDICINES, key)
+    )
+    return conditional_response(request, cached)
 
 
 @app.get("/medicines/{disease}/{idx}", tags=["Medicines CRUD"])
 def get_medicine_crud(
+    response: Response,
     disease: str = Path(..., description="Disease key"),
     idx: int = Path(..., ge=0, description="0-based index of medicine item")
 ):
     """Get a specific medicine by disease and index"""
     key = disease.strip().lower()
-    data = _read_medicines_json()
+    data = _read_medicines()
     if key not in data:
         raise HTTPException(status_code=404, detail=f"Disease '{key}' not found")
     if idx >= len(data[key]):
         raise HTTPException(status_code=404, detail=f"Medicine index {idx} not found in '{key}'")
+    response.headers["ETag"] = knowledge_base.etag(MEDICINES, key)
     return {"disease": key, "index": idx, "medicine": data[key][idx]}
 
 
 @app.post("/medicines/{disease}", status_code=201, tags=["Medicines CRUD"])
 def create_medicine(
+    response: Response,
     disease: str = Path(..., description="Disease key"),
     medicine: Medicine = ...,
+    if_match: Optional[str] = Header(None, description="ETag of the disease record this change is based on"),
     api_key: str = Depends(get_api_key)
 ):
     """Add a new medicine to a disease category"""
     key = disease.strip().lower()
-    data = _read_medicines_json()
-    
-    # Create disease category if it doesn't exist
-    if key not in data:
-        data[key] = []
-    
-    # Check for duplicate name (optional - you can remove this if duplicates are allowed)
-    existing_names = [m.get("name", "").lower() for m in data[key]]
-    if medicine.name.lower() in existing_names:
-        raise HTTPException(
-            status_code=409, 
-            detail=f"Medicine '{medicine.name}' already exists under '{key}'"
-        )
-    
-    # Reorder priorities and add the new medicine
-    medicines = data.get(key, [])
-    _reorder_medicines(medicines, medicine.dict())
-    data[key] = sorted(medicines, key=lambda m: m.get("priority", 999))
-    
-    _write_medicines_json(data)
-    
+
+    def add(medicines: MedicineIndex):
+        # Check for duplicate name (optional - you can remove this if duplicates are allowed)
+        if medicines.has_name(medicine.name):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Medicine '{medicine.name}' already exists under '{key}'"
+            )
+
+        # Insert at its priority; later medicines shift down one
+        medicines.insert(medicine.dict())
+
+    # Creates the disease category if it doesn't exist
+    _update_record(MEDICINES, key, add, response, if_match, create=True)
+
     return {"disease": key, "created": medicine, "message": "Medicine added successfully"}
 
 
 @app.put("/medicines/{disease}/{idx}", tags=["Medicines CRUD"])
 def update_medicine(
+    response: Response,
     disease: str = Path(..., description="Disease key"),
     idx: int = Path(..., ge=0, description="0-based index of medicine to update"),
     medicine: Medicine = ...,
+    if_match: Optional[str] = Header(None, description="ETag of the disease record this change is based on"),
     api_key: str = Depends(get_api_key)
 ):
     """Update an existing medicine"""
     key = disease.strip().lower()
-    data = _read_medicines_json()
-    
-    if key not in data:
-        raise HTTPException(status_code=404, detail=f"Disease '{key}' not found")
-    if idx >= len(data[key]):
-        raise HTTPException(status_code=404, detail=f"Medicine index {idx} not found in '{key}'")
-    
-    # Reorder priorities and update the medicine
-    medicines = data.get(key, [])
-    _reorder_medicines(medicines, medicine.dict(), original_index=idx)
-    data[key] = sorted(medicines, key=lambda m: m.get("priority", 999))
 
-    _write_medicines_json(data)
-    
-    return {"disease": key, "updated": medicine, "message": "Medicine updated successfully"}
+    def update(medicines: MedicineIndex):
+        if idx >= len(medicines):
+            raise HTTPException(status_code=404, detail=f"Medicine index {idx} not found in '{key}'")
 
+        # Replace the medicine and move it to its (possibly new) priority
+        medicines.replace(idx, medicine.dict())
 
-def _reorder_medicines(medicines: List[Dict[str, Any]], new_medicine: Dict[str, Any], original_index: Optional[int] = None):
-    """
-    Reorders medicine priorities to ensure uniqueness and correct sorting.
-    - If a new medicine is added with a priority that already exists,
-      it shifts down the priorities of subsequent items.
-    - If a medicine's priority is updated, it adjusts the list accordingly.
-    """
-    new_priority = new_medicine.get("priority", 999)
-    
-    # If updating, remove the old version of the medicine first
-    if original_index is not None and 0 <= original_index < len(medicines):
-        medicines.pop(original_index)
-
-    # Check if the new priority already exists
-    is_priority_taken = any(m.get("priority") == new_priority for m in medicines)
-
-    if is_priority_taken:
-        # Shift priorities for items with the same or higher priority
-        for med in medicines:
-            if med.get("priority", 999) >= new_priority:
-                med["priority"] = med.get("priority", 999) + 1
-    
-    # Add the new or updated medicine to the list
-    medicines.append(new_medicine)
-    
-    # Normalize priorities to be sequential if there are gaps
-    medicines.sort(key=lambda m: m.get("priority", 999))
-    for i, med in enumerate(medicines):
-        med["priority"] = i + 1 # Re-assign priorities starting from 1
+    _update_record(MEDICINES, key, update, response, if_match)
+
+    return {"disease": key, "updated": medicine, "message": "Medicine updated successfully"}
 
 
 @app.delete("/medicines/{disease}/{idx}", tags=["Medicines CRUD"])
 def delete_medicine(
+    response: Response,
     disease: str = Path(..., description="Disease key"),
     idx: int = Path(..., ge=0, description="0-based index of medicine to delete"),
+    if_match: Optional[str] = Header(None, description="ETag of the disease record this change is based on"),
     api_key: str = Depends(get_api_key)
 ):
     """Delete a medicine from a disease category"""
     key = disease.strip().lower()
-    data = _read_medicines_json()
-    
-    if key not in data:
-        raise HTTPException(status_code=404, detail=f"Disease '{key}' not found")
-    if idx >= len(data[key]):
-        raise HTTPException(status_code=404, detail=f"Medicine index {idx} not found in '{key}'")
-    
-    # Remove the medicine
-    removed_medicine = data[key].pop(idx)
-    
-    # Re-order the remaining medicines to ensure sequential priorities
-    remaining_medicines = data[key]
-    remaining_medicines.sort(key=lambda m: m.get("priority", 999))
-    for i, med in enumerate(remaining_medicines):
-        med["priority"] = i + 1
-    data[key] = remaining_medicines
-
-    # Optional: Remove empty disease categories (uncomment if desired)
-    # if not data[key]:
-    #     data.pop(key)
-    
-    _write_medicines_json(data)
-    
+
+    def delete(medicines: MedicineIndex):
+        if idx >= len(medicines):
+            raise HTTPException(status_code=404, detail=f"Medicine index {idx} not found in '{key}'")
+
+        # Later medicines move up one priority; empty disease categories are kept
+        return medicines.pop(idx)
+
+    removed_medicine = _update_record(MEDICINES, key, delete, response, if_match)
+
     return {
         "disease": key, 
         "index": idx, 
@@ -506,40 +1247,41 @@ def delete_medicine(
 @app.get("/crud/disease-info", tags=["Disease Info CRUD"])
 def list_all_diseases_info_crud():
     """List all disease keys from the disease info file"""
-    data = _read_disease_info_json()
+    data = _read_disease_info()
     return {"available_diseases": sorted(data.keys())}
 
 
 @app.get("/crud/disease-info/{disease_key}", tags=["Disease Info CRUD"])
-def get_disease_info_crud(disease_key: str = Path(..., description="Disease key e.g. 'blast'")):
+def get_disease_info_crud(response: Response, disease_key: str = Path(..., description="Disease key e.g. 'blast'")):
     """Fetch the full data object for a single disease"""
     key = disease_key.strip().lower()
-    data = _read_disease_info_json()
+    data = _read_disease_info()
     if key not in data:
         raise HTTPException(
             status_code=404, 
             detail=f"Disease info for '{key}' not found. Available diseases: {list(data.keys())}"
         )
+    response.headers["ETag"] = knowledge_base.etag(DISEASE_INFO, key)
     return {"disease_key": key, "data": data[key]}
 
 
 @app.put("/crud/disease-info/{disease_key}", tags=["Disease Info CRUD"])
 def update_disease_info_crud(
+    response: Response,
     disease_key: str = Path(..., description="Disease key to update"),
     info: DiseaseInfo = ...,
+    if_match: Optional[str] = Header(None, description="ETag of the disease record this change is based on"),
     api_key: str = Depends(get_api_key)
 ):
     """Update the information for a specific disease"""
     key = disease_key.strip().lower()
-    data = _read_disease_info_json()
-    
-    if key not in data:
-        raise HTTPException(status_code=404, detail=f"Disease '{key}' not found")
-    
-    # Update the disease info
-    data[key] = info.dict(exclude_none=True)
-    _write_disease_info_json(data)
-    
+
+    def replace(record: Dict[str, Any]):
+        record.clear()
+        record.update(info.dict(exclude_none=True))
+
+    _update_record(DISEASE_INFO, key, replace, response, if_match)
+
     return {"disease_key": key, "updated": info, "message": "Disease info updated successfully"}
 
 
@@ -573,10 +1315,10 @@ async def process_image_endpoint(
         )
         
         # Get the processed image for compression
-        processed_image = Image.fromarray((image_array[0] * 255).astype(np.uint8))
+        processed_image = Image.fromarray(to_uint8_input(image_array)[0])
         
-        # Compress the image
-        compressed_data = processor.compress_image(processed_image, output_format, quality)
+        # Compress the image (CPU-bound, keep it off the event loop)
+        compressed_data = await executors.run_preprocessing(processor.compress_image, processed_image, output_format, quality)
         
         # Calculate compression stats
         original_size = metadata.get("file_size_bytes", 0)
@@ -606,10 +1348,10 @@ def get_image_processing_info() -> Dict[str, Any]:
     return {
         "supported_formats": ["JPEG", "PNG", "WEBP", "BMP", "TIFF"],
         "default_target_size": (224, 224),
-        "max_file_size_mb": 50,
+        "max_file_size_mb": MAX_UPLOAD_MB,
         "default_quality": 85,
         "features": [
-            "Large image upload support (up to 50MB)",
+            f"Large image upload support (up to {MAX_UPLOAD_MB}MB)",
             "Automatic compression and resizing",
             "Aspect ratio preservation",
             "Multiple output formats",
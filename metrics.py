@@ -0,0 +1,102 @@
+"""
+Prometheus metrics for the prediction pipeline, exported at /metrics.
+
+Every /predict image is timed stage by stage (upload read, decode, resize,
+enhance, conversion to model format, waiting for and running inference,
+response building) with one `perf_counter` pair per stage.
+
+Under gunicorn each worker is a separate process, so gunicorn_conf.py sets
+PROMETHEUS_MULTIPROC_DIR before the app is imported: every process (workers
+and preprocessing pool processes alike) then writes its samples to
+memory-mapped files in that directory, and /metrics merges all of them.
+Without it (a single uvicorn process) the in-process registry is served.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# Pipeline stages, in request order
+STAGES = ("upload_read", "decode", "resize", "enhance", "to_model_format", "inference", "model", "response_build")
+
+# 0.5 ms .. 10 s: preprocessing stages sit at the low end, batched inference higher
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SIZE_BUCKETS = (224, 480, 720, 1080, 1600, 2048, 3000, 4096, 6000, 8192)
+
+STAGE_SECONDS = Histogram(
+    "paddy_stage_seconds", "Time spent in each /predict pipeline stage", ["stage"], buckets=_STAGE_BUCKETS
+)
+UPLOAD_BYTES = Counter("paddy_upload_bytes", "Encoded image bytes received for prediction")
+IMAGE_WIDTH = Histogram("paddy_image_width_pixels", "Width of uploaded images", buckets=_SIZE_BUCKETS)
+IMAGE_HEIGHT = Histogram("paddy_image_height_pixels", "Height of uploaded images", buckets=_SIZE_BUCKETS)
+PREDICTIONS = Counter(
+    "paddy_predictions", "Predictions returned, by predicted class and model version", ["predicted_class", "model_version"]
+)
+BATCH_SIZE = Histogram(
+    "paddy_batch_size", "Images per model forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+# livesum: add up the current values of the live processes only
+IN_FLIGHT = Gauge(
+    "paddy_requests_in_flight", "Prediction requests currently being handled", multiprocess_mode="livesum"
+)
+QUEUE_DEPTH = Gauge(
+    "paddy_batch_queue_depth", "Images waiting in the batching queue", multiprocess_mode="livesum"
+)
+# 1 for the version a worker serves (livesum: how many live workers serve it)
+MODEL_ACTIVE = Gauge(
+    "paddy_model_active", "Workers serving each model version", ["model_version"], multiprocess_mode="livesum"
+)
+# Shadow model samples by outcome: agree, disagree (with the served model), dropped, error
+SHADOW_COMPARISONS = Counter(
+    "paddy_shadow_comparisons", "Shadow model samples by candidate version and outcome", ["candidate_version", "outcome"]
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def observe_upload(size_bytes: Optional[int], dimensions: Optional[Tuple[int, int]]) -> None:
+    """Record the encoded size and original (width, height) of one uploaded image."""
+    if size_bytes:
+        UPLOAD_BYTES.inc(size_bytes)
+    if dimensions:
+        IMAGE_WIDTH.observe(dimensions[0])
+        IMAGE_HEIGHT.observe(dimensions[1])
+
+
+def set_active_model(version: str, previous: Optional[str] = None) -> None:
+    if previous is not None and previous != version:
+        MODEL_ACTIVE.labels(previous).set(0)
+    MODEL_ACTIVE.labels(version).set(1)
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, and its content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of an exited worker (gunicorn child_exit hook)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,226 @@
+"""
+Versioned model registry for switching models without restarting workers.
+
+MODEL_REGISTRY_DIR holds one directory per version:
+
+    models/
+        2024-07-15/
+            mymodel/          the model for INFERENCE_BACKEND (mymodel.tflite,
+                              mymodel.onnx, ... for the other backends)
+            labels.txt        class names, as in the repository root
+            metadata.json     optional, free-form (training run, accuracy, notes)
+        ACTIVE                name of the version to serve
+
+Without an ACTIVE file the workers serve MODEL_PATH and labels.txt from the
+repository root (the "base" version, as without a registry).
+
+Activating a version loads and warms it on a thread of its own (not the
+inference threads, so the current version keeps serving; the two compete
+for CPU until the load is done), then switches over in one step. Each
+version has its own micro-batcher, and requests already queued on the old
+batcher finish on the old model. The old batcher is then closed, so a
+request still preprocessing at the switch runs on the new version. The last
+MODEL_REGISTRY_KEEP_LOADED versions stay loaded, which makes rolling back
+a switch with no load at all. ACTIVE is replaced atomically, and every
+worker polls it (MODEL_REGISTRY_POLL_S), so the other workers and later
+restarts follow the worker that handled the switch.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from inference import INFERENCE_BACKEND, InferenceBackend, ModelLoader, backend_model_path
+
+logger = logging.getLogger(__name__)
+
+# Registry settings, overridable via environment variables
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "models")
+# Versions kept loaded in each worker: the active one plus the rollback targets
+MODEL_REGISTRY_KEEP_LOADED = int(os.environ.get("MODEL_REGISTRY_KEEP_LOADED", "2"))
+# How often each worker checks ACTIVE for a switch made by another worker
+MODEL_REGISTRY_POLL_S = float(os.environ.get("MODEL_REGISTRY_POLL_S", "5"))
+
+ACTIVE_FILE = "ACTIVE"
+LABELS_NAME = "labels.txt"
+METADATA_NAME = "metadata.json"
+# Version names double as directory names
+_VERSION_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,63}")
+
+
+def read_labels(path: str) -> List[str]:
+    """Class names from a labels file ("<index> <name>" or "<name>" per line)."""
+    with open(path, "r") as f:
+        return [line.strip().split(maxsplit=1)[-1] for line in f if line.strip()]
+
+
+class LoadedModel:
+    """One model version loaded and warmed up in this process, with its own batcher."""
+
+    def __init__(
+        self,
+        version: str,
+        model: InferenceBackend,
+        class_names: List[str],
+        batcher: Any,
+        metadata: Optional[Dict[str, Any]] = None,
+        startup: Optional[Dict[str, Any]] = None,
+    ):
+        self.version = version
+        self.model = model
+        self.class_names = class_names
+        self.batcher = batcher
+        self.metadata = metadata or {}
+        self.startup = startup or {}
+
+
+class ModelRegistry:
+    """
+    The version directories under `root` and the versions loaded in this process.
+
+    `load` is blocking (it runs ModelLoader) and is meant for the inference
+    thread; the rest only reads small files.
+    """
+
+    def __init__(
+        self,
+        make_batcher: Callable[[InferenceBackend], Any],
+        batch_sizes,
+        root: str = MODEL_REGISTRY_DIR,
+        base_model_path: str = "mymodel",
+        base_labels_file: str = LABELS_NAME,
+        base_version: str = "base",
+        backend: str = INFERENCE_BACKEND,
+        keep_loaded: int = MODEL_REGISTRY_KEEP_LOADED,
+    ):
+        self.make_batcher = make_batcher
+        self.batch_sizes = list(batch_sizes)
+        self.root = root
+        self.base_model_path = base_model_path
+        self.base_labels_file = base_labels_file
+        self.base_version = base_version
+        self.backend = backend
+        self.keep_loaded = max(1, keep_loaded)
+        self._loaded: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return os.path.isdir(self.root)
+
+    def version_dir(self, version: str) -> str:
+        if not _VERSION_PATTERN.fullmatch(version):
+            raise ValueError(f"Invalid model version '{version}'")
+        return os.path.join(self.root, version)
+
+    def model_path(self, version: str) -> str:
+        """The model file or directory INFERENCE_BACKEND loads for a version."""
+        if version == self.base_version:
+            return backend_model_path(self.base_model_path, self.backend)
+        name = os.path.basename(backend_model_path(self.base_model_path, self.backend))
+        return os.path.join(self.version_dir(version), name)
+
+    def labels_file(self, version: str) -> str:
+        if version == self.base_version:
+            return self.base_labels_file
+        return os.path.join(self.version_dir(version), LABELS_NAME)
+
+    def metadata(self, version: str) -> Dict[str, Any]:
+        if version == self.base_version:
+            return {}
+        try:
+            with open(os.path.join(self.version_dir(version), METADATA_NAME), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def exists(self, version: str) -> bool:
+        if version == self.base_version:
+            return True
+        return os.path.isfile(self.labels_file(version)) and os.path.exists(self.model_path(version))
+
+    def versions(self) -> List[str]:
+        """Complete versions in the registry directory, oldest name first."""
+        if not self.enabled:
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if _VERSION_PATTERN.fullmatch(name) and os.path.isdir(os.path.join(self.root, name)) and self.exists(name)
+        )
+
+    def active_version(self) -> str:
+        """The version ACTIVE names, or the base version without one."""
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE), "r") as f:
+                return f.read().strip() or self.base_version
+        except FileNotFoundError:
+            return self.base_version
+
+    def set_active(self, version: str) -> None:
+        """Point ACTIVE at `version` (removed for the base version); readers never see a partial file."""
+        path = os.path.join(self.root, ACTIVE_FILE)
+        if version == self.base_version:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".ACTIVE.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(version + "\n")
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def loaded(self, version: str) -> Optional[LoadedModel]:
+        with self._lock:
+            return self._loaded.get(version)
+
+    def loaded_versions(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def adopt(self, loaded: LoadedModel) -> None:
+        """Keep a version that was loaded elsewhere (the startup model) for rollback."""
+        with self._lock:
+            self._loaded[loaded.version] = loaded
+
+    def touch(self, version: str) -> None:
+        """Mark a loaded version as the most recently used and unload the least recent beyond keep_loaded."""
+        with self._lock:
+            self._loaded.move_to_end(version)
+            while len(self._loaded) > self.keep_loaded:
+                evicted, _ = self._loaded.popitem(last=False)
+                logger.info(f"Unloaded model version {evicted}")
+
+    def load(self, version: str, keep: bool = True) -> LoadedModel:
+        """
+        Load and warm up a version (or return it if it is still loaded).
+
+        With keep=False the version is loaded for the caller alone (a shadow
+        candidate, say): it gets no batcher and takes no loaded slot.
+        """
+        loaded = self.loaded(version)
+        if loaded is not None:
+            return loaded
+        if not self.exists(version):
+            raise KeyError(version)
+        class_names = read_labels(self.labels_file(version))
+        loader = ModelLoader(
+            self.base_model_path, self.batch_sizes, backend=self.backend, model_path=self.model_path(version)
+        )
+        model = loader.load()
+        output_shape = model.output_shape
+        if output_shape and output_shape[-1] is not None and output_shape[-1] != len(class_names):
+            raise ValueError(f"model has {output_shape[-1]} outputs but {LABELS_NAME} lists {len(class_names)} classes")
+        batcher = self.make_batcher(model) if keep else None
+        loaded = LoadedModel(version, model, class_names, batcher, self.metadata(version), loader.report())
+        if keep:
+            self.adopt(loaded)
+        return loaded
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Cache settings, overridable via environment variables.
+# PREDICTION_CACHE_BACKEND: "memory" (per worker, default), "sqlite" (shared by
+# all workers on the host) or "none" to disable caching.
+CACHE_BACKEND = os.environ.get("PREDICTION_CACHE_BACKEND", "memory").lower()
+CACHE_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", "2048"))
+CACHE_MAX_MB = float(os.environ.get("PREDICTION_CACHE_MAX_MB", "16"))
+CACHE_TTL_SECONDS = float(os.environ.get("PREDICTION_CACHE_TTL_SECONDS", "3600"))
+CACHE_SQLITE_PATH = os.environ.get("PREDICTION_CACHE_PATH", "prediction_cache.sqlite3")
+
+
+def content_digest(contents: bytes) -> str:
+    """SHA-256 hex digest of raw upload bytes."""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def make_cache_key(digest: str, maintain_aspect_ratio: bool, enhance_features: bool, model_version: str) -> str:
+    """Content address for a prediction: upload digest plus everything that changes the result."""
+    return f"{digest}:{int(maintain_aspect_ratio)}{int(enhance_features)}:{model_version}"
+
+
+class PredictionCache:
+    """
+    In-process LRU cache with a per-entry TTL.
+
+    Values are small JSON-serializable dicts (class probabilities plus image
+    metadata). Capacity is bounded both by entry count and by the approximate
+    serialized size of the stored values.
+    """
+
+    backend = "memory"
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: float = CACHE_TTL_SECONDS
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        size = len(json.dumps(value, separators=(",", ":")))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _usage(self) -> Tuple[int, int]:
+        """Return (entry count, stored bytes)."""
+        with self._lock:
+            return len(self._entries), self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size_bytes = self._usage()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend,
+                "entries": entries,
+                "size_bytes": size_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class SQLitePredictionCache(PredictionCache):
+    """
+    Prediction cache stored in a SQLite database file so that every gunicorn
+    worker on the host shares one cache.
+
+    Hit/miss/eviction counters are kept per worker; entry count and size are
+    read from the shared database.
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        path: str = CACHE_SQLITE_PATH,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: float = CACHE_TTL_SECONDS
+    ):
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS prediction_cache_accessed ON prediction_cache (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        # Wall-clock time: expiry must be comparable across processes
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at FROM prediction_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] <= now:
+            conn.execute("DELETE FROM prediction_cache WHERE key = ?", (key,))
+            with self._lock:
+                self.expirations += 1
+            row = None
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        conn.execute("UPDATE prediction_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        payload = json.dumps(value, separators=(",", ":"))
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO prediction_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, now + self.ttl_seconds, now)
+            )
+            conn.execute("DELETE FROM prediction_cache WHERE expires_at <= ?", (now,))
+            expired = conn.execute("SELECT changes()").fetchone()[0]
+            evicted = 0
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prediction_cache").fetchone()
+            while count > self.max_entries or total > self.max_bytes:
+                # Evict least recently used entries in chunks
+                excess = max(count - self.max_entries, 1)
+                conn.execute(
+                    "DELETE FROM prediction_cache WHERE key IN "
+                    "(SELECT key FROM prediction_cache ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                )
+                evicted += conn.execute("SELECT changes()").fetchone()[0]
+                count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prediction_cache").fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.expirations += expired
+            self.evictions += evicted
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM prediction_cache")
+
+    def _usage(self) -> Tuple[int, int]:
+        return self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prediction_cache"
+        ).fetchone()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "path": self.path}
+
+
+def create_prediction_cache() -> Optional[PredictionCache]:
+    """Build the cache selected by PREDICTION_CACHE_BACKEND (None when disabled)."""
+    if CACHE_BACKEND in ("none", "off", "0"):
+        return None
+    if CACHE_BACKEND == "sqlite":
+        return SQLitePredictionCache()
+    if CACHE_BACKEND == "memory":
+        return PredictionCache()
+    raise RuntimeError(f"Unknown PREDICTION_CACHE_BACKEND '{CACHE_BACKEND}'. Use memory, sqlite or none.")
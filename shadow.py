@@ -0,0 +1,221 @@
+"""
+Shadow evaluation of a candidate model on sampled live traffic.
+
+With SHADOW_MODEL_VERSION naming a model registry version (see
+model_registry.py), each worker loads that version next to the one it
+serves. A sample (SHADOW_SAMPLE_RATE) of the images /predict,
+/predict/batch and /predict/raw have already answered is handed, as the
+preprocessed model input, to a background task. The task runs the candidate
+in batches of up to SHADOW_BATCH_SIZE and compares each of its predictions
+with the one the client got: class agreement, confidence delta and which
+classes the two disagree on.
+
+Shadow work never holds up a request. The handoff is a `put_nowait` onto a
+bounded queue (SHADOW_QUEUE_DEPTH) that drops the sample when full, and the
+candidate runs on its own thread rather than the inference threads. The
+comparison is per worker at GET /admin/shadow and summed across workers in
+paddy_shadow_comparisons_total.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import metrics
+from executors import run_shadow
+from inference import InferenceBackend, to_float_input
+
+logger = logging.getLogger(__name__)
+
+# Shadow settings, overridable via environment variables.
+# Registry version to evaluate; empty disables shadow evaluation
+SHADOW_MODEL_VERSION = os.environ.get("SHADOW_MODEL_VERSION", "")
+# Fraction of answered images also run through the candidate
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", "0.1"))
+# Samples waiting for the candidate; further samples are dropped
+SHADOW_QUEUE_DEPTH = int(os.environ.get("SHADOW_QUEUE_DEPTH", "32"))
+# Largest candidate forward pass
+SHADOW_BATCH_SIZE = int(os.environ.get("SHADOW_BATCH_SIZE", "8"))
+
+# Disagreeing class pairs listed in stats()
+_TOP_DISAGREEMENTS = 10
+
+
+class ShadowEvaluator:
+    """
+    Runs a candidate model on sampled production inputs and compares it with
+    the primary predictions.
+
+    `offer` is called on the event loop after a request has its prediction;
+    it returns at once whether or not the sample is taken. One collector task
+    takes queued samples in batches and runs them, one batch at a time, so
+    the candidate never has more than SHADOW_BATCH_SIZE images in flight.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        model: InferenceBackend,
+        class_names: List[str],
+        sample_rate: float = SHADOW_SAMPLE_RATE,
+        queue_depth: int = SHADOW_QUEUE_DEPTH,
+        batch_size: int = SHADOW_BATCH_SIZE,
+        seed: Optional[int] = None
+    ):
+        if queue_depth < 1:
+            raise ValueError("queue_depth must be >= 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self.version = version
+        self.model = model
+        self.class_names = class_names
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.queue_depth = queue_depth
+        self.batch_size = batch_size
+        self._random = random.Random(seed)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self._sampled = 0
+        self._dropped = 0
+        self._errors = 0
+        self._compared = 0
+        self._agreed = 0
+        self._delta_sum = 0.0
+        self._abs_delta_sum = 0.0
+        self._candidate_seconds = 0.0
+        self._batches = 0
+        self._by_class: Counter = Counter()
+        self._agreed_by_class: Counter = Counter()
+        self._disagreements: Counter = Counter()
+        self._primary_versions: Counter = Counter()
+
+    def _ensure_started(self) -> None:
+        """Start the collector task on the running loop (restarting it if the loop changed)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_depth)
+        self._worker = loop.create_task(self._collect())
+
+    def offer(self, image_array: np.ndarray, primary: np.ndarray, primary_classes: List[str], primary_version: str) -> bool:
+        """
+        Maybe queue one answered image for the candidate; never waits.
+
+        Args:
+            image_array: The model input the primary ran on, (1, H, W, C) or (H, W, C).
+                Held until the candidate has run, so it must not be reused by the caller.
+            primary: The primary model's probability row for it
+            primary_classes: Class names of the primary model
+            primary_version: Version of the primary model
+
+        Returns:
+            True if the sample was queued
+        """
+        if primary_version == self.version or self._random.random() >= self.sample_rate:
+            return False
+        self._ensure_started()
+        self._sampled += 1
+        if image_array.ndim == 3:
+            image_array = image_array[np.newaxis, ...]
+        try:
+            self._queue.put_nowait((image_array, primary, primary_classes, primary_version))
+        except asyncio.QueueFull:
+            self._dropped += 1
+            metrics.SHADOW_COMPARISONS.labels(self.version, "dropped").inc()
+            return False
+        return True
+
+    def stop(self) -> None:
+        """Cancel the collector task; samples still queued are discarded."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _collect(self) -> None:
+        while True:
+            samples = [await self._queue.get()]
+            while len(samples) < self.batch_size:
+                try:
+                    samples.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await self._evaluate(samples)
+
+    async def _evaluate(self, samples: List[Any]) -> None:
+        """Run one candidate batch and compare every row with its primary prediction."""
+        try:
+            arrays = [arr for arr, *_ in samples]
+            if any(arr.dtype != arrays[0].dtype for arr in arrays):
+                arrays = [to_float_input(arr) for arr in arrays]
+            start = time.perf_counter()
+            outputs = await run_shadow(self.model.predict, np.concatenate(arrays, axis=0))
+            self._candidate_seconds += time.perf_counter() - start
+            self._batches += 1
+        except Exception as e:
+            self._errors += len(samples)
+            metrics.SHADOW_COMPARISONS.labels(self.version, "error").inc(len(samples))
+            logger.warning(f"Shadow inference failed (model version {self.version}): {str(e)}")
+            return
+
+        for row, (_, primary, primary_classes, primary_version) in zip(outputs, samples):
+            self._compare(np.asarray(primary), primary_classes, primary_version, np.asarray(row))
+
+    def _compare(self, primary: np.ndarray, primary_classes: List[str], primary_version: str, candidate: np.ndarray) -> None:
+        primary_idx = int(np.argmax(primary))
+        candidate_idx = int(np.argmax(candidate))
+        primary_class = primary_classes[primary_idx]
+        candidate_class = self.class_names[candidate_idx]
+        # Top-1 confidence of the candidate minus that of the primary
+        delta = float(candidate[candidate_idx]) - float(primary[primary_idx])
+        agreed = primary_class == candidate_class
+
+        self._compared += 1
+        self._delta_sum += delta
+        self._abs_delta_sum += abs(delta)
+        self._by_class[primary_class] += 1
+        self._primary_versions[primary_version] += 1
+        if agreed:
+            self._agreed += 1
+            self._agreed_by_class[primary_class] += 1
+        else:
+            self._disagreements[(primary_class, candidate_class)] += 1
+        metrics.SHADOW_COMPARISONS.labels(self.version, "agree" if agreed else "disagree").inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the sampling settings, queue counters and agreement with the primary."""
+        compared = self._compared
+        return {
+            "candidate_version": self.version,
+            "settings": {
+                "sample_rate": self.sample_rate,
+                "queue_depth": self.queue_depth,
+                "batch_size": self.batch_size
+            },
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "sampled_total": self._sampled,
+            "dropped_total": self._dropped,
+            "errors_total": self._errors,
+            "compared_total": compared,
+            "primary_versions": dict(self._primary_versions),
+            "agreement_rate": round(self._agreed / compared, 4) if compared else None,
+            "mean_confidence_delta": round(self._delta_sum / compared, 4) if compared else None,
+            "mean_abs_confidence_delta": round(self._abs_delta_sum / compared, 4) if compared else None,
+            "candidate_ms_per_batch": round(self._candidate_seconds / self._batches * 1000, 3) if self._batches else None,
+            "by_primary_class": {
+                name: {"compared": count, "agreement_rate": round(self._agreed_by_class[name] / count, 4)}
+                for name, count in sorted(self._by_class.items())
+            },
+            "top_disagreements": [
+                {"primary": primary, "candidate": candidate, "count": count}
+                for (primary, candidate), count in self._disagreements.most_common(_TOP_DISAGREEMENTS)
+            ]
+        }
@@ -39,3 +39,346 @@ def test_crud_disease_info_list(client):
     assert r.status_code == 200
     data = r.json()
     assert 'available_diseases' in data
+
+
+def _png_bytes(size=(640, 480)):
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', size, (60, 140, 60)).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def test_process_image(client):
+    r = client.post(
+        '/process-image',
+        files={'file': ('leaf.png', _png_bytes(), 'image/png')},
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert data['processed_image_size'] == [1, 224, 224, 3]
+    assert data['original_metadata']['original_size'] == [640, 480]
+
+
+def test_batching_stats(client):
+    r = client.get('/batching/stats')
+    assert r.status_code == 200
+    data = r.json()
+    assert 'batch_size_histogram' in data
+    assert 'executors' in data
+
+
+def test_ready_is_503_until_the_model_is_warm(client, monkeypatch):
+    import main
+    from inference import ModelLoader
+    assert client.get('/ready').status_code == 200  # SKIP_MODEL_LOAD: nothing to wait for
+
+    loader = ModelLoader('mymodel', [1])
+    monkeypatch.setattr(main, 'SKIP_MODEL', False)
+    monkeypatch.setattr(main, 'model_loader', loader)
+    r = client.get('/ready')
+    assert r.status_code == 503 and r.json()['state'] == 'pending'
+    r = client.post('/predict', files={'file': ('leaf.png', _png_bytes((32, 32)), 'image/png')})
+    assert r.status_code == 503 and '/ready' in r.json()['detail']
+    assert client.get('/health').status_code == 200
+
+    loader.state, loader.error = 'failed', 'loading: missing model'
+    assert client.get('/health').status_code == 503
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    """Swap in a fake model so prediction endpoints run without TensorFlow"""
+    import numpy as np
+    import main
+    from batching import MicroBatcher
+
+    classes = ['blast', 'normal']
+
+    def run_batch(batch):
+        return np.tile(np.array([[0.9, 0.1]], dtype=np.float32), (batch.shape[0], 1))
+
+    monkeypatch.setattr(main, 'model', object())
+    monkeypatch.setattr(main, 'class_names', classes)
+    monkeypatch.setattr(main, 'batcher', MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=5))
+    return main
+
+
+def test_predict_batch_multipart(client, stub_model):
+    import json
+    files = [('files', (f'leaf{i}.png', _png_bytes((64, 48)), 'image/png')) for i in range(3)]
+    files.append(('files', ('notes.txt', b'not an image', 'text/plain')))
+    r = client.post('/predict/batch', files=files)
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert sorted(line['index'] for line in lines) == [0, 1, 2, 3]
+    by_index = {line['index']: line for line in lines}
+    assert by_index[0]['predicted_class'] == 'blast'
+    assert 'image_metadata' in by_index[0]
+    assert 'error' in by_index[3]
+
+
+def test_predict_batch_zip(client, stub_model):
+    import io
+    import json
+    import zipfile
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('plot1/a.png', _png_bytes((32, 32)))
+        zf.writestr('plot1/b.png', _png_bytes((32, 32)))
+    r = client.post('/predict/batch', files={'files': ('plot.zip', buf.getvalue(), 'application/zip')})
+    assert r.status_code == 200
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert len(lines) == 2
+    assert {line['image_metadata']['file_name'] for line in lines} == {'plot1/a.png', 'plot1/b.png'}
+
+
+def test_predict_batch_zip_with_corrupt_member(client, stub_model):
+    import io
+    import zipfile
+    image = _png_bytes((40, 40))
+    for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', compression=compression) as zf:
+            zf.writestr('plot1/a.png', _png_bytes((32, 32)))
+            zf.writestr('plot1/b.png', image)
+        data = bytearray(buf.getvalue())
+        # Damage the second member's data (CRC mismatch when stored, bad stream when deflated)
+        with zipfile.ZipFile(io.BytesIO(bytes(data))) as zf:
+            info = zf.getinfo('plot1/b.png')
+        start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+        for i in range(start + 4, start + info.compress_size - 4, 7):
+            data[i] ^= 0xFF
+        r = client.post('/predict/batch', files={'files': ('plot.zip', bytes(data), 'application/zip')})
+        assert r.status_code == 400 and 'plot1/b.png' in r.json()['detail']
+
+
+def test_predict_batch_count_limit(client, stub_model, monkeypatch):
+    monkeypatch.setattr(stub_model, 'BATCH_MAX_FILES', 1)
+    files = [('files', (f'leaf{i}.png', _png_bytes((16, 16)), 'image/png')) for i in range(2)]
+    r = client.post('/predict/batch', files=files)
+    assert r.status_code == 400
+
+
+def test_predict_cache_hit_skips_model(client, stub_model, monkeypatch, tmp_path):
+    import asyncio
+    from prediction_cache import SQLitePredictionCache
+
+    on_loop = []
+
+    class _SpyCache(SQLitePredictionCache):
+        # Records whether each lookup/store ran on the event loop thread
+        def get(self, key):
+            on_loop.append(_loop_running())
+            return super().get(key)
+
+        def set(self, key, value):
+            on_loop.append(_loop_running())
+            super().set(key, value)
+
+    def _loop_running():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    calls = []
+    run_batch = stub_model.batcher.run_batch
+    stub_model.batcher.run_batch = lambda batch: calls.append(batch.shape[0]) or run_batch(batch)
+    monkeypatch.setattr(stub_model, 'prediction_cache', _SpyCache(str(tmp_path / 'cache.sqlite3')))
+
+    image = _png_bytes((64, 64))
+    first = client.post('/predict', files={'file': ('leaf.png', image, 'image/png')})
+    second = client.post('/predict', files={'file': ('retry.png', image, 'image/png')})
+    assert first.status_code == 200 and second.status_code == 200
+    assert first.headers['x-prediction-cache'] == 'miss'
+    assert second.headers['x-prediction-cache'] == 'hit'
+    assert second.json()['image_metadata']['file_name'] == 'retry.png'
+    assert second.json()['all_confidences'] == first.json()['all_confidences']
+    assert calls == [1]
+    # get, set, get: none of them on the event loop
+    assert on_loop == [False, False, False]
+
+
+def test_predict_rejects_oversized_upload_from_content_length(client):
+    body = b'\xff' * (1024 * 1024 + 200 * 1024)
+    r = client.post('/predict?max_size_mb=1', files={'file': ('big.jpg', body, 'image/jpeg')})
+    assert r.status_code == 413
+
+
+def test_oversized_chunked_upload_is_cut_off(client):
+    boundary = 'testboundary'
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="big.png"\r\n'
+        'Content-Type: image/png\r\n\r\n'
+    ).encode()
+
+    def body():
+        # No Content-Length: the limit has to be enforced while streaming
+        yield head
+        for _ in range(3):
+            yield b'\x00' * (512 * 1024)
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    r = client.post(
+        '/predict?max_size_mb=1',
+        content=body(),
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+    )
+    assert r.status_code == 413
+
+
+def test_process_image_reports_file_size(client):
+    image = _png_bytes()
+    r = client.post('/process-image', files={'file': ('leaf.png', image, 'image/png')})
+    assert r.status_code == 200
+    assert r.json()['original_metadata']['file_size_bytes'] == len(image)
+
+
+@pytest.fixture
+def tmp_knowledge_base(tmp_path, monkeypatch):
+    import shutil
+    import main
+    from knowledge_base import SQLiteKnowledgeBase
+    shutil.copy('disease_info.json', tmp_path / 'disease_info.json')
+    shutil.copy('disease_medicines.json', tmp_path / 'disease_medicines.json')
+    kb = SQLiteKnowledgeBase(
+        str(tmp_path / 'kb.sqlite3'),
+        str(tmp_path / 'disease_info.json'),
+        str(tmp_path / 'disease_medicines.json')
+    )
+    monkeypatch.setattr(main, 'knowledge_base', kb)
+    return kb
+
+
+def test_medicine_crud_is_visible_to_public_endpoints(client, tmp_knowledge_base):
+    from auth import API_KEY
+    headers = {'X-API-KEY': API_KEY}
+    r = client.post('/medicines/blast', json={'name': 'Test Fungicide', 'priority': 1}, headers=headers)
+    assert r.status_code == 201
+    r = client.post('/medicines/blast', json={'name': 'test fungicide'}, headers=headers)
+    assert r.status_code == 409
+
+    names = [m['name'] for m in client.get('/disease-medicines', params={'name': 'blast'}).json()['recommended_medicines']]
+    assert names[0] == 'Test Fungicide'
+
+    r = client.delete('/medicines/blast/0', headers=headers)
+    assert r.status_code == 200 and r.json()['deleted']['name'] == 'Test Fungicide'
+    assert client.delete('/medicines/nope/0', headers=headers).status_code == 404
+
+
+def test_stale_if_match_gets_412(client, tmp_knowledge_base):
+    from auth import API_KEY
+    r = client.get('/crud/disease-info/blast')
+    etag = r.headers['etag']
+    info = r.json()['data']
+    headers = {'X-API-KEY': API_KEY, 'If-Match': etag}
+
+    r = client.put('/crud/disease-info/blast', json={**info, 'note': 'first'}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers['etag'] != etag
+    r = client.put('/crud/disease-info/blast', json={**info, 'note': 'second'}, headers=headers)
+    assert r.status_code == 412
+    assert client.get('/crud/disease-info/blast').json()['data']['note'] == 'first'
+
+
+@pytest.mark.parametrize('path', ['/classes', '/disease-info', '/disease-info/blast', '/disease-medicines?name=blast', '/medicines/blast'])
+def test_read_endpoints_support_conditional_get(client, path):
+    r = client.get(path)
+    assert r.status_code == 200
+    etag = r.headers['etag']
+    assert r.headers['cache-control']
+    assert r.headers['last-modified']
+
+    r = client.get(path, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.content == b''
+    assert client.get(path, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_cached_body_changes_with_the_data(client, tmp_knowledge_base):
+    from auth import API_KEY
+    r = client.get('/medicines/blast')
+    etag = r.headers['etag']
+    r = client.post('/medicines/blast', json={'name': 'Fresh'}, headers={'X-API-KEY': API_KEY})
+    assert r.headers['etag'] != etag
+
+    r = client.get('/medicines/blast', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert 'Fresh' in [m['name'] for m in r.json()['medicines']]
+    assert r.headers['etag'] == client.get('/medicines/blast').headers['etag']
+
+
+def _metric_samples(client):
+    from prometheus_client.parser import text_string_to_metric_families
+    r = client.get('/metrics')
+    assert r.status_code == 200 and r.headers['content-type'].startswith('text/plain')
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(r.text) for sample in family.samples
+    }
+
+
+def test_metrics_time_every_predict_stage(client, stub_model):
+    before = _metric_samples(client)
+    image = _png_bytes((64, 48))
+    r = client.post('/predict', files={'file': ('leaf.png', image, 'image/png')})
+    assert r.status_code == 200
+    after = _metric_samples(client)
+
+    def delta(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0) - before.get(key, 0)
+
+    for stage in ('upload_read', 'decode', 'resize', 'enhance', 'inference', 'response_build'):
+        assert delta('paddy_stage_seconds_count', stage=stage) == 1, stage
+    assert delta('paddy_upload_bytes_total') == len(image)
+    assert delta('paddy_image_width_pixels_sum') == 64
+    assert delta('paddy_image_height_pixels_sum') == 48
+    assert delta('paddy_predictions_total', predicted_class='blast', model_version=stub_model.MODEL_VERSION) == 1
+    assert after[('paddy_requests_in_flight', ())] == 0
+
+
+def test_predict_verbosity_top_k_and_fields(client, stub_model):
+    image = _png_bytes((64, 48))
+
+    def predict(**params):
+        return client.post('/predict', params=params, files={'file': ('leaf.png', image, 'image/png')})
+
+    full = predict()
+    assert full.status_code == 200
+    assert set(full.json()) == set(stub_model.RESPONSE_FIELDS)
+    assert full.json()['image_metadata']['processing_info']['enhancement_mode'] == 'rice_optimized'
+
+    minimal = predict(verbosity='minimal')
+    assert minimal.json() == {'predicted_class': 'blast', 'confidence': 0.9}
+    assert len(minimal.content) < len(full.content) / 5
+
+    top = predict(verbosity='minimal', top_k=1).json()
+    assert top['all_confidences'] == {'blast': 0.9}
+    assert 'image_metadata' not in predict(verbosity='standard').json()
+    assert list(predict(fields='confidence,disease_info').json()) == ['confidence', 'disease_info']
+
+    assert predict(fields='confidence,secret').status_code == 400
+    assert predict(verbosity='chatty').status_code == 422
+
+
+def test_predict_raw_accepts_uint8_tensors(client, stub_model):
+    import io
+    import numpy as np
+    pixels = np.full((224, 224, 3), 120, dtype=np.uint8)
+
+    r = client.post('/predict/raw', content=pixels.tobytes(), headers={'Content-Type': 'application/octet-stream'})
+    assert r.status_code == 200
+    assert r.json()['predicted_class'] == 'blast'
+    assert r.json()['image_metadata']['input_format'] == 'raw'
+
+    buf = io.BytesIO()
+    np.save(buf, pixels[np.newaxis])
+    r = client.post('/predict/raw', params={'enhance_features': 'false', 'verbosity': 'minimal'}, content=buf.getvalue())
+    assert r.json() == {'predicted_class': 'blast', 'confidence': 0.9}
+
+    assert client.post('/predict/raw', content=pixels[:100].tobytes()).status_code == 400
+    assert client.post('/predict/raw', content=b'\0' * 10_000_000).status_code == 413
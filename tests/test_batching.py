@@ -0,0 +1,102 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from batching import BatcherClosed, MicroBatcher, BatchQueueFull
+
+
+def _fake_model(batch):
+    # One "probability" row per input: mean pixel value and batch size
+    return np.stack([batch.reshape(batch.shape[0], -1).mean(axis=1), np.full(batch.shape[0], batch.shape[0])], axis=1)
+
+
+def test_concurrent_requests_share_a_batch():
+    batcher = MicroBatcher(_fake_model, max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        inputs = [np.full((1, 4, 4, 3), i, dtype=np.float32) for i in range(8)]
+        return await asyncio.gather(*(batcher.submit(x) for x in inputs))
+
+    results = asyncio.run(run())
+    # Each caller gets its own row back
+    assert [int(r[0]) for r in results] == list(range(8))
+    assert all(int(r[1]) == 8 for r in results)
+    stats = batcher.stats()
+    assert stats["batch_size_histogram"] == {"8": 1}
+    assert stats["items_total"] == 8
+
+
+def test_batch_size_is_capped():
+    batcher = MicroBatcher(_fake_model, max_batch_size=3, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(np.zeros((4, 4, 3), dtype=np.float32)) for _ in range(7)))
+
+    asyncio.run(run())
+    stats = batcher.stats()
+    assert max(int(size) for size in stats["batch_size_histogram"]) <= 3
+    assert stats["items_total"] == 7
+
+
+def test_model_errors_propagate_to_every_waiter():
+    def broken(batch):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(broken, max_batch_size=4, max_wait_ms=10)
+
+    async def run():
+        return await asyncio.gather(
+            *(batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.float32)) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_full_queue_rejects():
+    batcher = MicroBatcher(_fake_model, max_batch_size=1, max_wait_ms=0, max_queue_depth=1)
+
+    async def run():
+        # Nothing yields to the collector between these two submits
+        first = asyncio.ensure_future(batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.float32)))
+        await asyncio.sleep(0)
+        with pytest.raises(BatchQueueFull):
+            await batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.float32))
+        await first
+
+    asyncio.run(run())
+
+
+def test_mixed_uint8_and_float_inputs_are_scaled_together():
+    batcher = MicroBatcher(_fake_model, max_batch_size=4, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.submit(np.full((1, 4, 4, 3), 255, dtype=np.uint8)),
+            batcher.submit(np.full((1, 4, 4, 3), 0.5, dtype=np.float32)),
+        )
+
+    results = asyncio.run(run())
+    assert [float(r[0]) for r in results] == [1.0, 0.5]
+
+
+def test_closed_batcher_answers_queued_inputs_and_refuses_new_ones():
+    batcher = MicroBatcher(_fake_model, max_batch_size=4, max_wait_ms=10)
+
+    async def run():
+        queued = asyncio.ensure_future(batcher.submit(np.ones((1, 4, 4, 3), dtype=np.float32)))
+        await asyncio.sleep(0)
+        batcher.close()
+        await batcher.drain()
+        assert queued.done() and float(queued.result()[0]) == 1.0
+        # A late submit must not restart the collector
+        with pytest.raises(BatcherClosed):
+            await batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.float32))
+        assert batcher._worker is None
+
+        batcher.reopen()
+        return await batcher.submit(np.full((1, 4, 4, 3), 2, dtype=np.float32))
+
+    assert float(asyncio.run(run())[0]) == 2.0
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import bench_suite  # noqa: E402
+
+
+def _report(**results):
+    return {'meta': {}, 'results': results}
+
+
+def test_compare_flags_only_regressions_beyond_the_threshold():
+    baseline = _report(
+        **{'micro/decode/jpeg': {'n': 30, 'p50_ms': 10.0, 'p95_ms': 12.0, 'throughput_per_s': 100.0},
+           'micro/model/batch-1': {'p50_ms': 0.01},
+           'load/predict': {'p99_ms': 50.0, 'throughput_per_s': 200.0, 'errors': 0},
+           'memory/peak_rss': {'peak_rss_mb': 300.0}}
+    )
+    current = _report(
+        **{'micro/decode/jpeg': {'n': 5, 'p50_ms': 11.0, 'p95_ms': 15.0, 'throughput_per_s': 90.0},
+           # +400%, but below the noise floor
+           'micro/model/batch-1': {'p50_ms': 0.05},
+           'load/predict': {'p99_ms': 55.0, 'throughput_per_s': 150.0, 'errors': 2},
+           'memory/peak_rss': {'peak_rss_mb': 400.0},
+           'load/crud': {'p50_ms': 1000.0}}
+    )
+    regressions = bench_suite.compare(baseline, current, threshold=0.2, min_delta_ms=0.1)
+    assert [line.split(':')[0] for line in regressions] == [
+        'load/predict throughput_per_s',
+        'load/predict errors',
+        'memory/peak_rss peak_rss_mb',
+        'micro/decode/jpeg p95_ms',
+    ]
+    assert bench_suite.compare(baseline, baseline) == []
+
+
+def test_quick_run_with_the_stub_model(tmp_path, monkeypatch):
+    import main
+    # Restored after the test: the run installs its own model and knowledge base
+    monkeypatch.setattr(main, 'model', main.model)
+    monkeypatch.setattr(main, 'knowledge_base', main.knowledge_base)
+    monkeypatch.setattr(bench_suite, 'SKIP_MODEL', True)
+
+    args = argparse.Namespace(
+        scenarios='micro,predict,crud', target='inprocess', resolutions='96x64', formats='JPEG,PNG',
+        iterations=2, requests=10, concurrency=3, stub_latency_ms=0.0,
+    )
+    report = bench_suite.run(args)
+    results = report['results']
+    assert report['meta']['model'] == 'stub'
+    for key in ('micro/decode/jpeg-96x64', 'micro/pipeline/png-96x64', 'micro/enhance', 'micro/model/batch-1'):
+        assert results[key]['n'] == 2 and results[key]['p50_ms'] <= results[key]['p99_ms']
+    for key in ('load/predict', 'load/crud'):
+        assert results[key]['n'] == 10 and results[key]['errors'] == 0
+    assert results['memory/peak_rss']['peak_rss_mb'] > 0
+    assert bench_suite.compare(report, report) == []
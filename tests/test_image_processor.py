@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from image_processor import ImageProcessor
+from inference import to_float_input
+
+
+def _jpeg_bytes(size=(1600, 1200)):
+    rng = np.random.default_rng(0)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([60 + 40 * x / w, 120 + 60 * y / h, 50 + 0 * x], axis=-1)
+    noisy = base + rng.normal(0, 4, (h, w, 3))
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def test_scaled_decode_reduces_jpeg_but_keeps_metadata():
+    processor = ImageProcessor(scaled_decode=True)
+    image, source = processor._load_image(_jpeg_bytes(), 'image/jpeg')
+    assert source['size'] == (1600, 1200)
+    assert image.size[0] < 1600
+    assert image.size[0] >= 224 and image.size[1] >= 224
+
+    _, metadata = processor.process_image_bytes(_jpeg_bytes(), content_type='image/jpeg')
+    assert metadata['original_size'] == (1600, 1200)
+    assert metadata['original_format'] == 'JPEG'
+
+
+def test_scaled_decode_parity_with_full_decode():
+    contents = _jpeg_bytes()
+    full, _ = ImageProcessor(scaled_decode=False).process_image_bytes(contents, content_type='image/jpeg')
+    scaled, _ = ImageProcessor(scaled_decode=True).process_image_bytes(contents, content_type='image/jpeg')
+    assert full.shape == scaled.shape == (1, 224, 224, 3)
+    # Documented tolerance, see tools/decode_parity.py
+    assert np.abs(to_float_input(full) - to_float_input(scaled)).mean() < 0.02
+
+
+def test_rgba_png_is_accepted():
+    buf = io.BytesIO()
+    Image.new('RGBA', (300, 200), (20, 160, 40, 255)).save(buf, format='PNG')
+    array, metadata = ImageProcessor().process_image_bytes(buf.getvalue(), content_type='image/png')
+    assert array.shape == (1, 224, 224, 3)
+    assert metadata['original_mode'] == 'RGBA'
+
+
+def test_decode_tensor_accepts_raw_and_npy_without_copying():
+    import pytest
+    from image_processor import decode_tensor
+
+    pixels = np.random.default_rng(0).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    raw = pixels.tobytes()
+    view, input_format = decode_tensor(raw)
+    assert input_format == 'raw' and np.array_equal(view, pixels)
+    assert not view.flags.owndata and not view.flags.writeable
+
+    for array in (pixels, pixels[np.newaxis]):
+        buf = io.BytesIO()
+        np.save(buf, array)
+        view, input_format = decode_tensor(buf.getvalue())
+        assert input_format == 'npy' and view.shape == (224, 224, 3) and np.array_equal(view, pixels)
+        assert not view.flags.owndata
+
+    for bad in (pixels.astype(np.float32), pixels[:200], np.asfortranarray(pixels)):
+        buf = io.BytesIO()
+        np.save(buf, bad)
+        with pytest.raises(ValueError):
+            decode_tensor(buf.getvalue())
+    with pytest.raises(ValueError, match='150528'):
+        decode_tensor(raw[:-1])
+
+
+def test_process_tensor_matches_the_image_pipeline():
+    pixels = np.random.default_rng(1).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    processor = ImageProcessor()
+    image = Image.fromarray(pixels)
+    np.testing.assert_array_equal(
+        processor.process_tensor(pixels, enhance_features=False), processor._to_model_format(image)
+    )
+    # uint8 input without enhancement is the caller's buffer itself
+    assert np.shares_memory(processor.process_tensor(pixels, enhance_features=False), pixels)
+    enhanced = processor.process_tensor(pixels, enhance_features=True)
+    assert enhanced.shape == (1, 224, 224, 3) and enhanced.dtype == np.uint8
+    np.testing.assert_array_equal(enhanced, processor._to_model_format(processor._enhance_image(image)))
+
+
+def test_uint8_model_input_scales_to_the_float32_pipeline():
+    contents = _jpeg_bytes((640, 480))
+    pixels, _ = ImageProcessor().process_image_bytes(contents, content_type='image/jpeg')
+    floats, _ = ImageProcessor(uint8_input=False).process_image_bytes(contents, content_type='image/jpeg')
+    assert pixels.dtype == np.uint8 and floats.dtype == np.float32
+    # Scaling per batch in the backend gives the model exactly what per-request scaling did
+    np.testing.assert_array_equal(to_float_input(pixels), floats)
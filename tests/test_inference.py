@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+
+import inference
+from inference import (
+    ModelLoader,
+    OnnxBackend,
+    QuantizedTFLiteBackend,
+    TFLiteBackend,
+    TFUint8SavedModelBackend,
+    create_inference_backend,
+    parity_report,
+    to_float_input,
+    to_uint8_input,
+)
+
+
+def test_parity_report_checks_top1_and_tolerance():
+    reference = np.array([[0.7, 0.2, 0.1], [0.1, 0.3, 0.6]], dtype=np.float32)
+    close = reference + np.float32(2e-4)
+    report = parity_report(reference, close)
+    assert report['ok'] and report['top1_agreement'] == 1.0
+    assert report['max_abs_diff'] == pytest.approx(2e-4, abs=1e-6)
+
+    assert not parity_report(reference, reference + np.float32(0.01))['ok']
+    flipped = reference[:, ::-1].copy()
+    report = parity_report(reference, flipped, atol=1.0)
+    assert report['top1_agreement'] == 0.0 and not report['ok']
+    with pytest.raises(ValueError):
+        parity_report(reference, reference[:1])
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(RuntimeError, match='INFERENCE_BACKEND'):
+        create_inference_backend('mymodel', backend='torch')
+
+
+@pytest.mark.parametrize('backend', [TFLiteBackend, QuantizedTFLiteBackend, OnnxBackend, TFUint8SavedModelBackend])
+def test_converted_backends_need_a_converted_model(tmp_path, backend):
+    with pytest.raises(FileNotFoundError, match='convert_model.py'):
+        backend(str(tmp_path / 'missing.model'))
+
+
+class _FakeInt8Interpreter:
+    """Stands in for a fully INT8-quantized TFLite model: output = per-image mean of the input."""
+
+    def __init__(self, model_path, num_threads=None):
+        self.shape = np.array([1, 4, 4, 3])
+        self.resizes = []
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': self.shape, 'dtype': np.int8, 'quantization': (1 / 255, -128)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.shape[0], 2]), 'dtype': np.int8, 'quantization': (1 / 256, -128)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = np.array(shape)
+        self.resizes.append(tuple(shape))
+
+    def set_tensor(self, index, value):
+        assert value.dtype == np.int8
+        self.value = value
+
+    def invoke(self):
+        mean = (self.value.astype(np.float32) + 128) / 255
+        self.output = np.round(np.stack([mean.mean(axis=(1, 2, 3)), 1 - mean.mean(axis=(1, 2, 3))], axis=1) * 256 - 128)
+
+    def get_tensor(self, index):
+        return np.clip(self.output, -128, 127).astype(np.int8)
+
+
+def test_tflite_backend_handles_integer_io_and_batch_resize(tmp_path, monkeypatch):
+    path = tmp_path / 'model.quant.tflite'
+    path.write_bytes(b'')
+    monkeypatch.setattr(inference, '_tflite_interpreter_class', lambda: _FakeInt8Interpreter)
+    backend = QuantizedTFLiteBackend(str(path))
+    assert backend.name == 'quantized' and backend.input_shape == (1, 4, 4, 3)
+
+    batch = np.stack([np.full((4, 4, 3), v, dtype=np.float32) for v in (0.25, 0.5, 0.75)])
+    out = backend.predict(batch)
+    assert out.dtype == np.float32 and out.shape == (3, 2)
+    np.testing.assert_allclose(out[:, 0], [0.25, 0.5, 0.75], atol=2 / 255)
+    backend.predict(batch)
+    assert backend._interpreter().resizes == [(3, 4, 4, 3)]
+
+
+def test_uint8_and_float_inputs_convert_exactly():
+    pixels = np.arange(256, dtype=np.uint8).reshape(1, 16, 16, 1).repeat(3, axis=3)
+    floats = to_float_input(pixels)
+    np.testing.assert_array_equal(floats, np.array(pixels, dtype=np.float32) / 255.0)
+    assert floats.dtype == np.float32 and to_float_input(floats) is floats
+    np.testing.assert_array_equal(to_uint8_input(floats), pixels)
+    assert to_uint8_input(pixels) is pixels
+
+
+class _FakeUint8Interpreter(_FakeInt8Interpreter):
+    """A TFLite model whose uint8 input is quantized as pixel / 255."""
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': self.shape, 'dtype': np.uint8, 'quantization': (np.float32(1 / 255), 0)}]
+
+    def set_tensor(self, index, value):
+        self.received = value
+        self.value = value.astype(np.int16) - 128
+
+
+def test_tflite_backend_feeds_uint8_pixels_unchanged(tmp_path, monkeypatch):
+    path = tmp_path / 'model.quant.tflite'
+    path.write_bytes(b'')
+    monkeypatch.setattr(inference, '_tflite_interpreter_class', lambda: _FakeUint8Interpreter)
+    backend = QuantizedTFLiteBackend(str(path))
+    pixels = np.stack([np.full((4, 4, 3), v, dtype=np.uint8) for v in (64, 128, 191)])
+    np.testing.assert_allclose(backend.predict(pixels)[:, 0], [64 / 255, 128 / 255, 191 / 255], atol=2 / 255)
+    assert backend._interpreter().received is pixels
+    # float32 input is quantized to the same pixels
+    np.testing.assert_array_equal(backend.predict(to_float_input(pixels)), backend.predict(pixels))
+
+
+class _RecordingBackend(inference.InferenceBackend):
+    name = 'fake'
+    imports = 0
+
+    @staticmethod
+    def import_runtime():
+        _RecordingBackend.imports += 1
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.batches = []
+
+    def predict(self, batch):
+        self.batches.append(batch.shape)
+        return np.zeros((batch.shape[0], 2), dtype=np.float32)
+
+
+def test_model_loader_times_phases_and_warms_every_batch_size(monkeypatch):
+    monkeypatch.setitem(inference.BACKENDS, 'fake', _RecordingBackend)
+    loader = ModelLoader('mymodel', [4, 1, 2, 3, 4], backend='fake')
+    assert loader.state == 'pending' and not loader.ready
+    model = loader.load()
+    assert loader.ready and loader.model is model and _RecordingBackend.imports == 1
+    assert [shape[0] for shape in model.batches] == [1, 2, 3, 4]
+    assert model.batches[0][1:] == (224, 224, 3)
+    report = loader.report()
+    assert set(report['phases_ms']) == {'importing', 'loading', 'warming', 'total'}
+    assert list(report['warmup_ms']) == ['1', '2', '3', '4']
+
+
+def test_model_loader_reports_the_failed_phase(monkeypatch):
+    class Broken(_RecordingBackend):
+        def predict(self, batch):
+            raise ValueError('bad graph')
+    monkeypatch.setitem(inference.BACKENDS, 'broken', Broken)
+    loader = ModelLoader('mymodel', [1], backend='broken')
+    with pytest.raises(ValueError):
+        loader.load()
+    assert loader.state == 'failed' and loader.error == 'warming: bad graph'
@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pytest
+
+from inference import InferenceBackend
+from inference_server import InferenceServer, RemoteBackend
+
+
+class _MeanModel(InferenceBackend):
+    name = 'fake'
+
+    def __init__(self):
+        super().__init__('fake-model')
+
+    def predict(self, batch):
+        if not np.isfinite(batch).all():
+            raise ValueError('non-finite input')
+        means = batch.mean(axis=(1, 2, 3))
+        return np.stack([means, 1 - means], axis=1)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv('INFERENCE_SERVER_AUTHKEY', 'test-key')
+    server = InferenceServer(_MeanModel(), str(tmp_path / 'inference.sock'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.close()
+
+
+def test_remote_backend_round_trips_through_shared_memory(server):
+    backend = RemoteBackend(server.socket_path, timeout=5)
+    assert backend.info['backend'] == 'fake'
+
+    small = np.full((2, 8, 8, 3), 0.25, dtype=np.float32)
+    np.testing.assert_allclose(backend.predict(small), [[0.25, 0.75]] * 2)
+    # A larger batch grows the shared buffer
+    large = np.stack([np.full((8, 8, 3), v, dtype=np.float32) for v in np.linspace(0, 1, 6)])
+    np.testing.assert_allclose(backend.predict(large)[:, 0], np.linspace(0, 1, 6), atol=1e-6)
+
+    with pytest.raises(RuntimeError, match='non-finite'):
+        backend.predict(np.full((1, 8, 8, 3), np.nan, dtype=np.float32))
+    np.testing.assert_allclose(backend.predict(small), [[0.25, 0.75]] * 2)
+    # uint8 batches cross as uint8 (a quarter of the bytes) and keep their dtype
+    pixels = np.full((2, 8, 8, 3), 51, dtype=np.uint8)
+    np.testing.assert_allclose(backend.predict(pixels), [[51, -50]] * 2)
+    backend.close()
+
+
+def test_remote_backend_serves_concurrent_threads(server):
+    backend = RemoteBackend(server.socket_path, timeout=5)
+    errors = []
+
+    def run(value):
+        batch = np.full((3, 8, 8, 3), value, dtype=np.float32)
+        for _ in range(20):
+            out = backend.predict(batch)
+            if not np.allclose(out[:, 0], value):
+                errors.append((value, out))
+
+    pool = [threading.Thread(target=run, args=(v,)) for v in (0.1, 0.4, 0.7, 0.9)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    assert errors == []
+    backend.close()
+
+
+def test_remote_backend_times_out_without_a_server(tmp_path):
+    with pytest.raises(TimeoutError):
+        RemoteBackend(str(tmp_path / 'nobody.sock'), timeout=0.3)
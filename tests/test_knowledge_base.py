@@ -0,0 +1,329 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from knowledge_base import (
+    MEDICINES,
+    MedicineIndex,
+    JsonDocumentStore,
+    JsonKnowledgeBase,
+    JournaledDocumentStore,
+    PreconditionFailed,
+    SQLiteKnowledgeBase,
+    medicine_catalog,
+)
+
+
+def _dump(path, data):
+    tmp = str(path) + '.tmp'
+    with open(tmp, 'w', encoding='utf8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def test_snapshot_is_cached_until_file_changes(tmp_path):
+    path = tmp_path / 'doc.json'
+    _dump(path, {'blast': [{'name': 'a'}]})
+    store = JsonDocumentStore(str(path))
+
+    first = store.snapshot()
+    assert store.snapshot() is first
+    assert store.version == 1
+
+    # Another worker replaces the file: new inode, so the next read reloads
+    _dump(path, {'blast': [{'name': 'b'}]})
+    second = store.snapshot()
+    assert second is not first
+    assert second['blast'][0]['name'] == 'b'
+    assert store.version == 2
+
+
+def test_snapshots_are_read_only_and_copies_are_editable(tmp_path):
+    path = tmp_path / 'doc.json'
+    _dump(path, {'blast': [{'name': 'a'}]})
+    store = JsonDocumentStore(str(path))
+
+    snapshot = store.snapshot()
+    with pytest.raises(TypeError):
+        snapshot['blast'] = []
+    with pytest.raises(TypeError):
+        snapshot['blast'][0]['name'] = 'x'
+
+    data = store.mutable_copy()
+    data['blast'].append({'name': 'c'})
+    store.write(data)
+    assert [m['name'] for m in store.snapshot()['blast']] == ['a', 'c']
+    assert snapshot['blast'] == ({'name': 'a'},)
+    with open(path, encoding='utf8') as f:
+        assert json.load(f) == data
+
+
+def test_missing_file_reads_as_empty(tmp_path):
+    store = JsonDocumentStore(str(tmp_path / 'missing.json'))
+    assert store.snapshot() == {}
+
+
+def _seed_files(tmp_path):
+    info_path, medicines_path = tmp_path / 'info.json', tmp_path / 'medicines.json'
+    _dump(info_path, {'blast': {'disease_name': 'Blast', 'description': 'd', 'symptoms': []}})
+    _dump(medicines_path, {'blast': [{'name': 'a', 'priority': 1}, {'name': 'b', 'priority': 2}], 'empty': []})
+    return str(info_path), str(medicines_path)
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_backends_update_one_disease(tmp_path, backend):
+    info_path, medicines_path = _seed_files(tmp_path)
+    if backend == 'json':
+        kb = JsonKnowledgeBase(info_path, medicines_path)
+    else:
+        kb = SQLiteKnowledgeBase(str(tmp_path / 'kb.sqlite3'), info_path, medicines_path)
+
+    assert kb.medicines()['empty'] == ()
+    kb.update_medicines('blast', lambda meds: meds.insert({'name': 'c', 'priority': 3}))
+    assert [m['name'] for m in kb.medicines()['blast']] == ['a', 'b', 'c']
+    kb.update_disease_info('blast', lambda record: record.update(description='new'))
+    assert kb.disease_info()['blast']['description'] == 'new'
+
+    with pytest.raises(KeyError):
+        kb.update_medicines('tungro', lambda meds: None)
+    kb.update_medicines('tungro', lambda meds: meds.insert({'name': 'x'}), create=True)
+    assert kb.medicines()['tungro'][0]['name'] == 'x'
+
+    # A failing edit leaves the stored data untouched
+    def fail(meds):
+        meds.pop(0)
+        raise ValueError('rejected')
+    with pytest.raises(ValueError):
+        kb.update_medicines('blast', fail)
+    assert len(kb.medicines()['blast']) == 3
+
+
+def test_sqlite_writes_are_visible_to_other_instances(tmp_path):
+    info_path, medicines_path = _seed_files(tmp_path)
+    db = str(tmp_path / 'kb.sqlite3')
+    # Two instances stand in for two gunicorn workers
+    first = SQLiteKnowledgeBase(db, info_path, medicines_path)
+    second = SQLiteKnowledgeBase(db, info_path, medicines_path)
+    before = second.medicines()
+    first.update_medicines('blast', lambda meds: meds.pop(1))
+    assert [m['name'] for m in second.medicines()['blast']] == ['a']
+    assert second.medicines() is not before
+    assert second.medicines() is second.medicines()
+
+    # Export round-trips through the JSON backend
+    disease_info, medicines = second.export_documents()
+    target = JsonKnowledgeBase(str(tmp_path / 'out_info.json'), str(tmp_path / 'out_medicines.json'))
+    target.import_documents(disease_info, medicines)
+    assert target.export_documents() == (disease_info, medicines)
+
+
+def test_sqlite_warns_about_json_edits_it_ignores(tmp_path, caplog):
+    info_path, medicines_path = _seed_files(tmp_path)
+    db = str(tmp_path / 'kb.sqlite3')
+    SQLiteKnowledgeBase(db, info_path, medicines_path)
+
+    # Rewriting the same content (as an export does) is not reported
+    with open(medicines_path) as f:
+        medicines = json.load(f)
+    with open(medicines_path, 'w') as f:
+        json.dump(medicines, f)
+    with caplog.at_level('WARNING', logger='knowledge_base'):
+        SQLiteKnowledgeBase(db, info_path, medicines_path)
+    assert not caplog.records
+
+    medicines['blast'].append({'name': 'c', 'priority': 9})
+    with open(medicines_path, 'w') as f:
+        json.dump(medicines, f)
+    with caplog.at_level('WARNING', logger='knowledge_base'):
+        kb = SQLiteKnowledgeBase(db, info_path, medicines_path)
+    assert [r.getMessage().split()[0] for r in caplog.records] == [medicines_path]
+    # The database still serves what it had
+    assert len(kb.medicines()['blast']) == len(medicines['blast']) - 1
+
+
+def _open(backend, tmp_dir):
+    info_path, medicines_path = os.path.join(tmp_dir, 'info.json'), os.path.join(tmp_dir, 'medicines.json')
+    if backend == 'json':
+        return JsonKnowledgeBase(info_path, medicines_path)
+    return SQLiteKnowledgeBase(os.path.join(tmp_dir, 'kb.sqlite3'), info_path, medicines_path)
+
+
+def test_if_match_rejects_stale_etag(tmp_path):
+    _seed_files(tmp_path)
+    kb = _open('json', str(tmp_path))
+    etag = kb.etag(MEDICINES, 'blast')
+    _, new_etag = kb.update_medicines('blast', lambda meds: meds.pop(1), if_match=etag)
+    assert new_etag == kb.etag(MEDICINES, 'blast') != etag
+
+    with pytest.raises(PreconditionFailed) as excinfo:
+        kb.update_medicines('blast', lambda meds: meds.pop(1), if_match=etag)
+    assert excinfo.value.etag == new_etag
+    assert len(kb.medicines()['blast']) == 1
+    with pytest.raises(PreconditionFailed):
+        kb.update_medicines('tungro', lambda meds: None, create=True, if_match='*')
+
+
+def _increment_stock(meds):
+    meds.replace(0, {**meds[0], 'stock': meds[0].get('stock', 0) + 1})
+
+
+def _hammer(backend, tmp_dir, worker, threads=4, writes=10):
+    """Append uniquely named medicines and increment a shared counter from several threads."""
+    kb = _open(backend, tmp_dir)
+
+    def run(thread):
+        for i in range(writes):
+            name = f'w{worker}-t{thread}-{i}'
+            kb.update_medicines(('blast', 'tungro')[i % 2], lambda meds: meds.insert({'name': name}), create=True)
+            kb.update_medicines('blast', _increment_stock)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_concurrent_writers_lose_nothing(tmp_path, backend):
+    _seed_files(tmp_path)
+    _open(backend, str(tmp_path))
+    processes = 3
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=_hammer, args=(backend, str(tmp_path), w)) for w in range(processes)]
+    for p in workers:
+        p.start()
+    _hammer(backend, str(tmp_path), processes)  # this process takes part too
+    for p in workers:
+        p.join(60)
+        assert p.exitcode == 0
+
+    medicines = _open(backend, str(tmp_path)).medicines()
+    names = [m['name'] for m in medicines['blast'] + medicines['tungro']]
+    total = (processes + 1) * 4 * 10
+    assert len(names) == len(set(names)) == total + 2
+    assert medicines['blast'][0]['stock'] == total
+
+
+def test_medicine_index_keeps_priority_order_and_tracks_changes():
+    catalog = medicine_catalog([{'name': n, 'priority': p} for n, p in [('c', 3), ('a', 1), ('b', 2), ('d', 4)]])
+    assert [m['name'] for m in catalog] == ['a', 'b', 'c', 'd']
+    assert catalog.has_name('A') and not catalog.has_name('z')
+
+    index = MedicineIndex(catalog)
+    assert index.insert({'name': 'x', 'priority': 2}) == 1
+    assert [(m['name'], m['priority']) for m in index] == [('a', 1), ('x', 2), ('b', 3), ('c', 4), ('d', 5)]
+    assert index[0] is catalog[0]  # untouched items are shared, not copied
+    assert (index.dirty_from, index.resized) == (1, True)
+
+    moved = MedicineIndex(catalog)
+    assert moved.replace(0, {'name': 'a2', 'priority': 3}) == 2
+    assert [(m['name'], m['priority']) for m in moved] == [('b', 1), ('c', 2), ('a2', 3), ('d', 4)]
+    assert (moved.dirty_from, moved.dirty_to, moved.resized) == (0, 3, False)
+    assert moved.has_name('a2') and not moved.has_name('a')
+    assert moved[3] is catalog[3]
+
+    index.pop(1)
+    assert [(m['name'], m['priority']) for m in index] == [('a', 1), ('b', 2), ('c', 3), ('d', 4)]
+    assert not index.has_name('x')
+    assert MedicineIndex(catalog).insert({'name': 'first', 'priority': 0}) == 0
+    assert MedicineIndex(catalog).insert({'name': 'last', 'priority': 999}) == 4
+
+
+def test_sqlite_reload_keeps_unchanged_diseases(tmp_path):
+    info_path, medicines_path = _seed_files(tmp_path)
+    db = str(tmp_path / 'kb.sqlite3')
+    writer = SQLiteKnowledgeBase(db, info_path, medicines_path)
+    reader = SQLiteKnowledgeBase(db, info_path, medicines_path)
+    before = reader.medicines()
+    writer.update_medicines('blast', lambda meds: meds.replace(1, {'name': 'b2', 'priority': 1}))
+    after = reader.medicines()
+    assert after['empty'] is before['empty']
+    assert [(m['name'], m['priority']) for m in after['blast']] == [('b2', 1), ('a', 2)]
+
+
+def test_journal_replays_and_compacts(tmp_path):
+    info_path, medicines_path = _seed_files(tmp_path)
+    with open(medicines_path, 'rb') as f:
+        original = f.read()
+    kb = JsonKnowledgeBase(info_path, medicines_path)
+    other = JsonKnowledgeBase(info_path, medicines_path)
+    before = other.medicines()
+
+    kb.update_medicines('blast', lambda meds: meds.insert({'name': 'c', 'priority': 1}))
+    kb.update_medicines('tungro', lambda meds: meds.insert({'name': 'x'}), create=True)
+    # Updates only append to the journal; the document file is untouched
+    with open(medicines_path, 'rb') as f:
+        assert f.read() == original
+    assert os.path.getsize(medicines_path + '.journal') > 0
+    after = other.medicines()
+    assert [m['name'] for m in after['blast']] == ['c', 'a', 'b']
+    assert after['empty'] is before['empty']
+
+    # A fresh process replays the journal on startup
+    expected = JsonKnowledgeBase(info_path, medicines_path).export_documents()
+    kb.compact()
+    assert os.path.getsize(medicines_path + '.journal') == 0
+    with open(medicines_path, encoding='utf8') as f:
+        assert json.load(f) == expected[1]
+    assert other.export_documents() == expected
+    assert JsonKnowledgeBase(info_path, medicines_path, journal=False).export_documents() == expected
+
+
+def test_journal_ignores_and_truncates_torn_tail(tmp_path):
+    info_path, medicines_path = _seed_files(tmp_path)
+    kb = JsonKnowledgeBase(info_path, medicines_path)
+    kb.update_medicines('blast', lambda meds: meds.pop(1))
+    # Simulate a crash in the middle of an append
+    with open(medicines_path + '.journal', 'ab') as f:
+        f.write(b'0badc0de {"k":"blast","v":[')
+
+    recovered = JsonKnowledgeBase(info_path, medicines_path)
+    assert [m['name'] for m in recovered.medicines()['blast']] == ['a']
+    recovered.update_medicines('blast', lambda meds: meds.insert({'name': 'd'}))
+    assert [m['name'] for m in JsonKnowledgeBase(info_path, medicines_path).medicines()['blast']] == ['a', 'd']
+
+
+def test_journal_compacts_past_size_limit(tmp_path):
+    path = str(tmp_path / 'doc.json')
+    _dump(path, {})
+    store = JournaledDocumentStore(path, max_journal_bytes=200)
+    for i in range(10):
+        with store.locked():
+            store.put(f'k{i}', {'value': 'x' * 30})
+        store.sync()
+    assert os.path.getsize(store.journal_path) < 200
+    with open(path, encoding='utf8') as f:
+        on_disk = json.load(f)
+    assert set(on_disk) | set(store.snapshot()) == {f'k{i}' for i in range(10)}
+    assert JournaledDocumentStore(path).snapshot() == store.snapshot()
+
+
+def test_journal_group_commits_concurrent_writers(tmp_path, monkeypatch):
+    path = str(tmp_path / 'doc.json')
+    _dump(path, {})
+    store = JournaledDocumentStore(path)
+    real_fsync, calls = os.fsync, []
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.02)
+        real_fsync(fd)
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+
+    def write(i):
+        with store.locked():
+            store.put(f'k{i}', i)
+        store.sync()
+    pool = [threading.Thread(target=write, args=(i,)) for i in range(16)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    assert len(store.snapshot()) == 16
+    # Writers that appended during an fsync shared the next one
+    assert len(calls) < 16
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WORKER = '''
+import metrics
+metrics.observe_stage("decode", 0.002)
+metrics.PREDICTIONS.labels("blast", "v1").inc()
+metrics.IN_FLIGHT.inc()
+'''
+
+_SCRAPE = '''
+import sys, metrics
+metrics.mark_process_dead(int(sys.argv[1]))
+sys.stdout.write(metrics.render()[0].decode())
+'''
+
+
+def _run(code, env, *args):
+    return subprocess.run(
+        [sys.executable, '-c', code, *args], cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    )
+
+
+def test_metrics_are_merged_across_worker_processes(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    workers = [subprocess.Popen([sys.executable, '-c', _WORKER], cwd=ROOT, env=env) for _ in range(3)]
+    for worker in workers:
+        assert worker.wait(60) == 0
+
+    # The first worker "exits": its in-flight gauge no longer counts
+    text = _run(_SCRAPE, env, str(workers[0].pid)).stdout
+    samples = {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text) for sample in family.samples
+    }
+    assert samples[('paddy_stage_seconds_count', (('stage', 'decode'),))] == 3
+    assert samples[('paddy_predictions_total', (('model_version', 'v1'), ('predicted_class', 'blast')))] == 3
+    assert samples[('paddy_requests_in_flight', ())] == 2
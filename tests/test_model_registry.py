@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ['SKIP_MODEL_LOAD'] = '1'
+
+import inference  # noqa: E402
+import main  # noqa: E402
+from auth import API_KEY, API_KEY_NAME  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+from model_registry import LoadedModel, ModelRegistry  # noqa: E402
+
+CLASSES = ['blast', 'normal', 'tungro']
+
+
+class _OneHotModel(inference.InferenceBackend):
+    """Always predicts the class index stored in <model dir>/class.txt."""
+
+    name = 'fake'
+
+    def __init__(self, path):
+        super().__init__(path)
+        with open(os.path.join(path, 'class.txt')) as f:
+            self.index = int(f.read())
+
+    def predict(self, batch):
+        return np.tile(np.eye(len(CLASSES), dtype=np.float32)[self.index], (batch.shape[0], 1))
+
+    @property
+    def output_shape(self):
+        return (None, len(CLASSES))
+
+
+def _write_version(root, version, index, labels=CLASSES, metadata=None):
+    os.makedirs(os.path.join(root, version, 'mymodel'))
+    with open(os.path.join(root, version, 'mymodel', 'class.txt'), 'w') as f:
+        f.write(str(index))
+    with open(os.path.join(root, version, 'labels.txt'), 'w') as f:
+        f.write(''.join(f'{i} {name}\n' for i, name in enumerate(labels)))
+    if metadata is not None:
+        with open(os.path.join(root, version, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setitem(inference.BACKENDS, 'fake', _OneHotModel)
+    root = str(tmp_path / 'models')
+    _write_version(root, 'v1', 1)
+    _write_version(root, 'v2', 2, metadata={'accuracy': 0.93})
+    _write_version(root, 'v3', 0, labels=CLASSES[:2])
+    os.makedirs(os.path.join(root, 'incomplete'))
+    _write_version(str(tmp_path), 'base', 0)
+    return ModelRegistry(
+        lambda model: MicroBatcher(functools.partial(main._run_model, served_model=model), max_wait_ms=5),
+        [1, 2],
+        root=root,
+        base_model_path=str(tmp_path / 'base' / 'mymodel'),
+        base_labels_file=str(tmp_path / 'base' / 'labels.txt'),
+        backend='fake',
+    )
+
+
+def test_registry_lists_loads_and_points_at_versions(registry):
+    assert registry.versions() == ['v1', 'v2', 'v3']
+    assert registry.active_version() == 'base'
+    registry.set_active('v2')
+    assert registry.active_version() == 'v2'
+    assert [name for name in os.listdir(registry.root) if name.startswith('.')] == []
+    registry.set_active('base')
+    assert registry.active_version() == 'base'
+
+    v2 = registry.load('v2')
+    assert v2.class_names == CLASSES and v2.metadata == {'accuracy': 0.93}
+    assert v2.startup['state'] == 'ready' and list(v2.startup['warmup_ms']) == ['1', '2']
+    assert registry.load('v2') is v2
+    with pytest.raises(ValueError, match='2 classes'):
+        registry.load('v3')
+    with pytest.raises(KeyError):
+        registry.load('incomplete')
+    with pytest.raises(ValueError):
+        registry.load('../v1')
+
+    # Loaded for the caller alone (a shadow candidate): no batcher, no loaded slot
+    candidate = registry.load('v1', keep=False)
+    assert candidate.batcher is None and registry.loaded_versions() == ['v2']
+
+    # Loaded versions beyond keep_loaded are unloaded, least recently activated first
+    registry.load('v1')
+    registry.load('base')
+    registry.touch('v1')
+    registry.touch('base')
+    assert registry.loaded_versions() == ['v1', 'base']
+
+
+@pytest.fixture
+def served(registry, monkeypatch):
+    """main serving the base version as after startup: global model and batcher, adopted by the registry"""
+    model = _OneHotModel(registry.base_model_path)
+    startup = LoadedModel('base', model, CLASSES, MicroBatcher(main._run_model, max_wait_ms=5))
+    registry.adopt(startup)
+    for name, value in {
+        'model_registry': registry, 'REGISTRY_ENABLED': True, 'model': model, 'class_names': CLASSES,
+        'batcher': startup.batcher, 'MODEL_VERSION': 'base', 'previous_version': None, 'labels_mtime': 0.0,
+    }.items():
+        monkeypatch.setattr(main, name, value)
+    return registry
+
+
+def _predict(client):
+    pixels = np.zeros((224, 224, 3), dtype=np.uint8)
+    r = client.post('/predict/raw', params={'enhance_features': 'false'}, content=pixels.tobytes())
+    assert r.status_code == 200
+    assert r.headers['X-Model-Version'] == r.json()['model_version']
+    return r.json()['model_version'], r.json()['predicted_class']
+
+
+def test_admin_endpoints_switch_and_roll_back(served):
+    client = TestClient(main.app)
+    auth = {API_KEY_NAME: API_KEY}
+    assert _predict(client) == ('base', 'blast')
+
+    assert client.post('/admin/models/v2/activate', headers={API_KEY_NAME: 'wrong'}).status_code == 403
+    assert client.post('/admin/models/v9/activate', headers=auth).status_code == 404
+    assert client.post('/admin/models/bad name/activate', headers=auth).status_code == 400
+    r = client.post('/admin/models/v3/activate', headers=auth)
+    assert r.status_code == 500 and 'classes' in r.json()['detail']
+
+    r = client.post('/admin/models/v2/activate', headers=auth)
+    assert r.status_code == 200
+    assert r.json()['active'] == 'v2' and r.json()['previous'] == 'base'
+    assert _predict(client) == ('v2', 'tungro')
+    assert served.active_version() == 'v2'
+    listing = client.get('/admin/models', headers=auth).json()
+    assert listing['active'] == 'v2' and set(listing['loaded']) == {'base', 'v2'}
+    assert [v['version'] for v in listing['versions']] == ['base', 'v1', 'v2', 'v3']
+
+    r = client.post('/admin/models/rollback', headers=auth)
+    assert r.status_code == 200 and r.json()['active'] == 'base'
+    assert _predict(client) == ('base', 'blast')
+    assert served.active_version() == 'base'
+
+
+def test_queued_requests_finish_on_the_version_they_started_with(served):
+    # The startup batcher runs whatever main.model is, until the switch binds it to its own model
+    async def run():
+        before = main._serving()
+        pending = asyncio.ensure_future(before.batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.uint8)))
+        await asyncio.sleep(0)
+        loaded = served.load('v1')
+        main._switch_to(loaded)
+        after = await main._serving().batcher.submit(np.zeros((1, 4, 4, 3), dtype=np.uint8))
+        return before, await pending, after
+
+    before, old_row, new_row = asyncio.run(run())
+    assert before.version == 'base' and main.MODEL_VERSION == 'v1'
+    assert before.class_names[int(old_row.argmax())] == 'blast'
+    assert main.class_names[int(new_row.argmax())] == 'normal'
+
+
+def test_switch_with_a_request_still_preprocessing(served):
+    async def run():
+        before = main._serving()
+        preprocessed = asyncio.Event()
+
+        async def request():
+            await preprocessed.wait()
+            return await main._submit(np.zeros((1, 4, 4, 3), dtype=np.uint8), before)
+
+        in_flight = asyncio.ensure_future(request())
+        await asyncio.sleep(0)
+        main._switch_to(served.load('v1'))
+        # Nothing was queued on the old batcher, so it drains at once
+        await before.batcher.drain()
+        preprocessed.set()
+        row, answered = await in_flight
+        # The old batcher stayed stopped rather than restarting for the late request
+        assert before.batcher._worker is None
+        return answered, row
+
+    answered, row = asyncio.run(run())
+    assert answered.version == 'v1' and answered.batcher is main.batcher
+    assert answered.class_names[int(row.argmax())] == 'normal'
@@ -0,0 +1,59 @@
+import io
+import time
+
+from prediction_cache import PredictionCache, SQLitePredictionCache, content_digest, make_cache_key
+from uploads import UPLOAD_CHUNK_SIZE, digest_file
+
+
+def test_key_depends_on_bytes_and_options():
+    base = make_cache_key(content_digest(b'abc'), True, True, 'v1')
+    assert base == make_cache_key(content_digest(b'abc'), True, True, 'v1')
+    assert base != make_cache_key(content_digest(b'abd'), True, True, 'v1')
+    assert base != make_cache_key(content_digest(b'abc'), False, True, 'v1')
+    assert base != make_cache_key(content_digest(b'abc'), True, False, 'v1')
+    assert base != make_cache_key(content_digest(b'abc'), True, True, 'v2')
+
+
+def test_streamed_digest_matches_the_bytes_digest():
+    contents = bytes(range(256)) * (UPLOAD_CHUNK_SIZE // 256 + 3)
+    source = io.BytesIO(contents)
+    source.seek(100)
+    assert digest_file(source) == content_digest(contents)
+    assert source.tell() == 0
+
+
+def test_lru_eviction():
+    cache = PredictionCache(max_entries=2, max_bytes=1 << 20, ttl_seconds=60)
+    cache.set('a', {'v': 1})
+    cache.set('b', {'v': 2})
+    assert cache.get('a') == {'v': 1}  # 'b' is now least recently used
+    cache.set('c', {'v': 3})
+    assert cache.get('b') is None
+    assert cache.get('a') == {'v': 1}
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+
+def test_byte_limit_and_ttl():
+    cache = PredictionCache(max_entries=100, max_bytes=30, ttl_seconds=0.05)
+    cache.set('a', {'v': 'x' * 10})
+    cache.set('b', {'v': 'y' * 10})
+    assert cache.stats()['size_bytes'] <= 30
+    assert cache.get('a') is None
+    time.sleep(0.06)
+    assert cache.get('b') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_sqlite_cache_is_shared(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    writer = SQLitePredictionCache(path=path, max_entries=2, ttl_seconds=60)
+    reader = SQLitePredictionCache(path=path, max_entries=2, ttl_seconds=60)
+    writer.set('a', {'predictions': [0.1, 0.9]})
+    assert reader.get('a') == {'predictions': [0.1, 0.9]}
+    writer.set('b', {'v': 2})
+    writer.set('c', {'v': 3})
+    assert reader.stats()['entries'] == 2
+    assert writer.stats()['evictions'] == 1
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import threading
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+os.environ['SKIP_MODEL_LOAD'] = '1'
+
+import main  # noqa: E402
+from auth import API_KEY, API_KEY_NAME  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+from shadow import ShadowEvaluator  # noqa: E402
+
+CLASSES = ['blast', 'normal', 'tungro']
+
+
+class _FixedModel:
+    """Predicts `index` with `confidence` for every image, optionally blocking until released."""
+
+    def __init__(self, index, confidence=1.0, release=None):
+        self.row = np.full(len(CLASSES), (1 - confidence) / (len(CLASSES) - 1), dtype=np.float32)
+        self.row[index] = confidence
+        self.release = release
+        self.calls = []
+
+    def predict(self, batch):
+        if self.release is not None:
+            self.release.wait(10)
+        self.calls.append(batch.shape[0])
+        return np.tile(self.row, (batch.shape[0], 1))
+
+
+def _primary(index, confidence):
+    row = np.full(len(CLASSES), (1 - confidence) / (len(CLASSES) - 1), dtype=np.float32)
+    row[index] = confidence
+    return row
+
+
+async def _until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.005)
+
+
+def test_shadow_compares_sampled_predictions_with_the_primary():
+    shadow = ShadowEvaluator('v2', _FixedModel(0, 0.9), CLASSES, sample_rate=1.0, batch_size=4)
+    image = np.zeros((1, 4, 4, 3), dtype=np.uint8)
+
+    async def run():
+        assert shadow.offer(image, _primary(0, 0.8), CLASSES, 'v1')
+        assert shadow.offer(image[0], _primary(0, 0.6), CLASSES, 'v1')
+        assert shadow.offer(image.astype(np.float32), _primary(2, 0.7), CLASSES, 'v1')
+        # The candidate itself is never compared with itself
+        assert not shadow.offer(image, _primary(0, 0.8), CLASSES, 'v2')
+        await _until(lambda: shadow.stats()['compared_total'] == 3)
+        shadow.stop()
+
+    asyncio.run(run())
+    stats = shadow.stats()
+    assert stats['sampled_total'] == 3 and stats['dropped_total'] == 0 and stats['errors_total'] == 0
+    assert shadow.model.calls == [3]
+    assert stats['agreement_rate'] == round(2 / 3, 4)
+    assert stats['mean_confidence_delta'] == round((0.1 + 0.3 + 0.2) / 3, 4)
+    assert stats['by_primary_class'] == {
+        'blast': {'compared': 2, 'agreement_rate': 1.0}, 'tungro': {'compared': 1, 'agreement_rate': 0.0}
+    }
+    assert stats['top_disagreements'] == [{'primary': 'tungro', 'candidate': 'blast', 'count': 1}]
+    assert stats['primary_versions'] == {'v1': 3}
+
+
+def test_shadow_sampling_never_waits_and_drops_when_the_queue_is_full():
+    release = threading.Event()
+    shadow = ShadowEvaluator('v2', _FixedModel(0, release=release), CLASSES, sample_rate=1.0, queue_depth=2, batch_size=1)
+    image = np.zeros((1, 4, 4, 3), dtype=np.uint8)
+
+    async def run():
+        start = time.perf_counter()
+        taken = [shadow.offer(image, _primary(0, 0.9), CLASSES, 'v1') for _ in range(5)]
+        elapsed = time.perf_counter() - start
+        # The candidate is stuck, yet every offer returned at once
+        assert elapsed < 0.1
+        assert taken == [True, True, False, False, False]
+        release.set()
+        await _until(lambda: shadow.stats()['compared_total'] == 2)
+        shadow.stop()
+
+    asyncio.run(run())
+    stats = shadow.stats()
+    assert stats['sampled_total'] == 5 and stats['dropped_total'] == 3
+
+    none_taken = ShadowEvaluator('v2', _FixedModel(0), CLASSES, sample_rate=0.0)
+    assert not none_taken.offer(image, _primary(0, 0.9), CLASSES, 'v1')
+    assert none_taken.stats()['sampled_total'] == 0
+
+
+def test_admin_shadow_reports_live_comparisons(monkeypatch):
+    served_model = _FixedModel(1)
+    shadow = ShadowEvaluator('v2', _FixedModel(2), CLASSES, sample_rate=1.0)
+    for name, value in {
+        'model': served_model, 'class_names': CLASSES, 'batcher': MicroBatcher(main._run_model, max_wait_ms=5),
+        'MODEL_VERSION': 'v1', 'SHADOW_MODEL_VERSION': 'v2', 'shadow': None,
+    }.items():
+        monkeypatch.setattr(main, name, value)
+    auth = {API_KEY_NAME: API_KEY}
+
+    with TestClient(main.app) as client:
+        r = client.get('/admin/shadow', headers=auth)
+        assert r.status_code == 200 and r.json()['enabled'] is False and 'status' in r.json()
+
+        monkeypatch.setattr(main, 'shadow', shadow)
+        pixels = np.zeros((224, 224, 3), dtype=np.uint8)
+        r = client.post('/predict/raw', params={'enhance_features': 'false'}, content=pixels.tobytes())
+        assert r.status_code == 200 and r.json()['predicted_class'] == 'normal'
+
+        deadline = time.monotonic() + 5
+        while client.get('/admin/shadow', headers=auth).json()['compared_total'] < 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        stats = client.get('/admin/shadow', headers=auth).json()
+
+    assert stats['enabled'] is True and stats['candidate_version'] == 'v2' and stats['served_version'] == 'v1'
+    assert stats['agreement_rate'] == 0.0
+    assert stats['top_disagreements'] == [{'primary': 'normal', 'candidate': 'tungro', 'count': 1}]
@@ -0,0 +1,158 @@
+import asyncio
+import io
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+os.environ['SKIP_MODEL_LOAD'] = '1'
+
+import main  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+from image_processor import ImageProcessor, read_image_size  # noqa: E402
+from tiling import TileGrid, TileSlots, fill_batch, predict_tiles, summarize, tile_origins, tile_windows  # noqa: E402
+
+CLASSES = ['blast', 'normal', 'tungro']
+
+
+def _field(width=700, height=500, red_width=300):
+    """Green field with a red patch on the left"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[..., 1] = 160
+    pixels[:, :red_width] = (200, 40, 40)
+    return pixels
+
+
+def _red_is_blast(batch):
+    """blast for mostly red tiles, normal otherwise"""
+    red = batch[..., 0].reshape(len(batch), -1).mean(axis=1) / 255
+    probabilities = np.zeros((len(batch), len(CLASSES)), dtype=np.float32)
+    probabilities[:, 0] = red
+    probabilities[:, 1] = 1 - red
+    return probabilities
+
+
+def test_tiles_cover_the_image_as_views():
+    assert tile_origins(700, 224, 168) == [0, 168, 336, 476]
+    assert tile_origins(560, 224, 168) == [0, 168, 336]
+    assert tile_origins(224, 224, 168) == [0]
+    assert tile_origins(100, 224, 168) == [0]
+
+    pixels = _field()
+    windows = tile_windows(pixels)
+    assert np.shares_memory(windows, pixels)
+    assert np.array_equal(windows[168, 476], pixels[168:392, 476:700])
+
+    small = tile_windows(np.zeros((100, 300, 3), dtype=np.uint8))
+    assert small.shape[:2] == (1, 77) and small[0, 0, 150, 0, 0] == 255
+
+
+def test_fill_batch_writes_model_input():
+    pixels = _field()
+    windows = tile_windows(pixels)
+    origins = [(0, 0), (168, 476)]
+    out = np.empty((4, 224, 224, 3), dtype=np.uint8)
+
+    batch = fill_batch(windows, origins, out, enhance_features=False)
+    assert batch.shape == (2, 224, 224, 3) and np.shares_memory(batch, out)
+    assert np.array_equal(batch[1], pixels[168:392, 476:700])
+
+    batch = fill_batch(windows, origins, out, enhance_features=True)
+    expected = np.asarray(ImageProcessor()._enhance_image(Image.fromarray(pixels[168:392, 476:700].copy())))
+    assert np.array_equal(batch[1], expected)
+
+    scaled = fill_batch(windows, origins, np.empty((2, 224, 224, 3), dtype=np.float32), enhance_features=False)
+    assert np.allclose(scaled[1], pixels[168:392, 476:700] / 255.0)
+
+
+def test_predict_tiles_runs_bounded_batches_in_grid_order():
+    pixels = _field()
+    grid = TileGrid(*pixels.shape[:2], stride=168)
+    sizes = []
+
+    def run_batch(batch):
+        sizes.append(len(batch))
+        return _red_is_blast(batch)
+
+    probabilities = asyncio.run(predict_tiles(pixels, grid, run_batch, enhance_features=False, batch_size=3))
+    assert sizes == [3, 3, 3, 3]
+    expected = _red_is_blast(np.stack([pixels[y:y + 224, x:x + 224] for y, x in grid.origins(0, len(grid))]))
+    assert np.allclose(probabilities, expected)
+
+
+def test_summary_names_the_most_common_disease():
+    grid = TileGrid(300, 700, stride=224)
+    assert (grid.rows, grid.cols) == (2, 4)
+    probabilities = np.zeros((8, 3), dtype=np.float32)
+    top = [0, 0, 1, 1, 2, 1, 1, 1]
+    probabilities[np.arange(8), top] = [0.9, 0.6, 0.8, 0.8, 0.95, 0.8, 0.8, 0.8]
+    result = summarize(probabilities, grid, CLASSES)
+
+    assert result['grid']['classes'][0] == ['blast', 'blast', 'normal', 'normal']
+    assert result['grid']['x'] == [0, 224, 448, 476] and result['grid']['y'] == [0, 76]
+    summary = result['summary']
+    assert summary['predicted_class'] == 'blast'
+    assert summary['affected_fraction'] == 0.375
+    assert summary['class_coverage'] == {'blast': 0.25, 'normal': 0.625, 'tungro': 0.125}
+    assert [(h['class'], h['row'], h['col']) for h in summary['hotspots']] == [('tungro', 1, 0), ('blast', 0, 0), ('blast', 0, 1)]
+
+    healthy = np.zeros((8, 3), dtype=np.float32)
+    healthy[:, 1] = 1
+    assert summarize(healthy, grid, CLASSES)['summary']['predicted_class'] == 'normal'
+
+
+class _RedIsBlastModel:
+    def predict(self, batch):
+        return _red_is_blast(batch)
+
+
+def test_predict_tiled_endpoint(monkeypatch):
+    for name, value in {
+        'model': _RedIsBlastModel(), 'class_names': CLASSES, 'batcher': MicroBatcher(main._run_model), 'MODEL_VERSION': 'v1',
+    }.items():
+        monkeypatch.setattr(main, name, value)
+    buf = io.BytesIO()
+    Image.fromarray(_field()).save(buf, format='PNG')
+    upload = {'file': ('field.png', buf.getvalue(), 'image/png')}
+    client = TestClient(main.app)
+
+    r = client.post('/predict/tiled', params={'stride': 224, 'enhance_features': 'false'}, files=upload)
+    assert r.status_code == 200
+    body = r.json()
+    assert body['model_version'] == 'v1' and r.headers['X-Model-Version'] == 'v1'
+    assert body['tiling']['tiles'] == 12 and body['image_metadata']['original_size'] == [700, 500]
+    assert body['grid']['classes'][0] == ['blast', 'normal', 'normal', 'normal']
+    assert body['summary']['predicted_class'] == 'blast' and body['summary']['affected_fraction'] == 0.25
+
+    r = client.post('/predict/tiled', params={'include_grid': 'false'}, files=upload)
+    assert r.status_code == 200 and 'grid' not in r.json() and r.json()['tiling']['stride'] == 168
+
+    busy = TileSlots(1)
+    monkeypatch.setattr(main, 'tile_slots', busy)
+    with busy.acquire():
+        r = client.post('/predict/tiled', files=upload)
+    assert r.status_code == 503 and 'capacity' in r.json()['detail']
+    assert busy.stats() == {'max_concurrent': 1, 'active': 0, 'rejected_total': 1}
+    assert client.post('/predict/tiled', params={'include_grid': 'false'}, files=upload).status_code == 200
+
+    # Over-limit grids are rejected from the header, before any decoding
+    monkeypatch.setattr(main, 'TILE_MAX_TILES', 4)
+    monkeypatch.setattr(ImageProcessor, 'decode_pixels', lambda *args, **kwargs: pytest.fail('decoded'))
+    r = client.post('/predict/tiled', files=upload)
+    assert r.status_code == 400 and 'The 700x500 image gives' in r.json()['detail']
+
+    r = client.post('/predict/tiled', files={'file': ('notes.txt', b'not an image', 'text/plain')})
+    assert r.status_code == 400
+
+
+def test_decode_pixels_keeps_full_resolution():
+    buf = io.BytesIO()
+    Image.fromarray(_field(1600, 1200)).save(buf, format='JPEG')
+    pixels, metadata = ImageProcessor(scaled_decode=False).decode_pixels(buf.getvalue(), content_type='image/jpeg')
+    assert pixels.shape == (1200, 1600, 3) and pixels.dtype == np.uint8
+    assert metadata['original_size'] == (1600, 1200)
+    assert read_image_size(buf.getvalue()) == (1600, 1200)
+    with pytest.raises(ValueError):
+        read_image_size(b'not an image')
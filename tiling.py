@@ -0,0 +1,259 @@
+"""
+Tiled prediction for high-resolution field and drone images.
+
+Resizing a 20-50 MP photo of a whole plot to one 224x224 input shrinks each
+lesion below a pixel. /predict/tiled instead decodes the image once, at full
+resolution, and runs the model on overlapping 224x224 tiles cut from it:
+
+- the tiles are views into the decoded array
+  (`np.lib.stride_tricks.sliding_window_view`), so cutting them copies
+  nothing. The origins are every TILE_STRIDE pixels, plus one flush with the
+  right and bottom edges so the whole image is covered.
+- the tiles go to the model TILE_BATCH_SIZE at a time, through two reusable
+  batch buffers. The next batch is filled (and enhanced) while the model
+  runs the current one. Memory beyond the decoded image does not grow with
+  the resolution.
+- each tiled request keeps at most one tile batch queued on the inference
+  threads, and at most TILE_MAX_CONCURRENT tiled requests run in a worker
+  at once (further ones get 503, like a full /predict queue). So /predict
+  batches wait behind at most TILE_MAX_CONCURRENT tile batches, however
+  many field images arrive.
+- the result is a grid of per-tile classes and confidences, plus a summary
+  for the whole field: how many tiles show each class, the share of tiles
+  with a disease, and the most confident disease tiles.
+"""
+import asyncio
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from batching import MAX_BATCH_SIZE
+from executors import PREPROCESS_USE_PROCESSES, run_inference, run_preprocessing
+from image_processor import ImageProcessor
+
+# Tiling settings, overridable via environment variables.
+# Model input size; tiles are cut at this size and never resized
+TILE_SIZE = 224
+# Default distance between tile origins (168: tiles overlap by a quarter)
+TILE_STRIDE = int(os.environ.get("TILE_STRIDE", "168"))
+# Tiles per forward pass; the default keeps to the batch sizes warmed up at startup
+TILE_BATCH_SIZE = int(os.environ.get("TILE_BATCH_SIZE", str(MAX_BATCH_SIZE)))
+# Largest grid one request may produce (a 50 MP image at stride 168 has about 1700 tiles)
+TILE_MAX_TILES = int(os.environ.get("TILE_MAX_TILES", "4096"))
+# Tiled requests running at once in a worker; each holds a decoded image
+# and one tile batch on the inference threads
+TILE_MAX_CONCURRENT = int(os.environ.get("TILE_MAX_CONCURRENT", "1"))
+
+# Class that counts as no disease in the field summary
+HEALTHY_CLASS = "normal"
+# Most confident disease tiles listed in the summary
+_HOTSPOTS = 5
+# Runs the rice enhancement chain on tiles (the chain keeps no per-processor state)
+_enhancer = ImageProcessor()
+
+
+class TilingBusy(Exception):
+    """Raised when a worker is already running TILE_MAX_CONCURRENT tiled requests."""
+
+
+class TileSlots:
+    """
+    Admission control for tiled requests in one worker.
+
+    Requests beyond `limit` are rejected rather than queued: a waiting field
+    image would still hold its upload, and the client can retry elsewhere.
+    Only used from the event loop, so a plain counter suffices.
+    """
+
+    def __init__(self, limit: int = TILE_MAX_CONCURRENT):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.rejected_total = 0
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        if self.active >= self.limit:
+            self.rejected_total += 1
+            raise TilingBusy(f"Tiled prediction is at capacity ({self.limit} images in progress); retry shortly")
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"max_concurrent": self.limit, "active": self.active, "rejected_total": self.rejected_total}
+
+
+def tile_origins(length: int, tile: int = TILE_SIZE, stride: int = TILE_STRIDE) -> List[int]:
+    """Tile start offsets along one axis: every `stride` pixels, the last one flush with the edge."""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile + 1, stride))
+    if origins[-1] != length - tile:
+        origins.append(length - tile)
+    return origins
+
+
+def tile_windows(pixels: np.ndarray, tile: int = TILE_SIZE) -> np.ndarray:
+    """
+    Every tile x tile window of an (H, W, 3) image as one read-only view.
+
+    `windows[y, x]` is the tile whose top-left pixel is (x, y); images
+    smaller than a tile are padded with white first (the only copy).
+    """
+    height, width = pixels.shape[:2]
+    if height < tile or width < tile:
+        pad = ((0, max(tile - height, 0)), (0, max(tile - width, 0)), (0, 0))
+        pixels = np.pad(pixels, pad, constant_values=255)
+    return np.lib.stride_tricks.sliding_window_view(pixels, (tile, tile, pixels.shape[2]))[:, :, 0]
+
+
+class TileGrid:
+    """The tile origins of one image, in row-major order."""
+
+    def __init__(self, height: int, width: int, tile: int = TILE_SIZE, stride: int = TILE_STRIDE):
+        self.tile = tile
+        self.stride = stride
+        self.ys = tile_origins(height, tile, stride)
+        self.xs = tile_origins(width, tile, stride)
+
+    @property
+    def rows(self) -> int:
+        return len(self.ys)
+
+    @property
+    def cols(self) -> int:
+        return len(self.xs)
+
+    def __len__(self) -> int:
+        return self.rows * self.cols
+
+    def origins(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """(y, x) of tiles start..stop-1."""
+        return [(self.ys[i // self.cols], self.xs[i % self.cols]) for i in range(start, min(stop, len(self)))]
+
+
+def fill_batch(windows: np.ndarray, origins: List[Tuple[int, int]], out: np.ndarray, enhance_features: bool) -> np.ndarray:
+    """
+    Write the tiles at `origins` into the batch buffer `out` as model input.
+
+    With enhance_features each tile goes through the rice enhancement chain
+    on its own, as an uploaded image of that size would. The pixels are then
+    copied (uint8) or scaled to [0, 1] (float32).
+    """
+    for i, (y, x) in enumerate(origins):
+        tile = windows[y, x]
+        if enhance_features:
+            tile = np.asarray(_enhancer._enhance_image(Image.fromarray(tile), rice_specific=True))
+        if out.dtype == np.uint8:
+            out[i] = tile
+        else:
+            np.divide(tile, np.float32(255.0), out=out[i], dtype=np.float32)
+    return out[:len(origins)]
+
+
+async def _run_fill(*args: Any) -> np.ndarray:
+    # Filling reads the decoded image in place, which a preprocessing process cannot
+    if PREPROCESS_USE_PROCESSES:
+        return await asyncio.to_thread(fill_batch, *args)
+    return await run_preprocessing(fill_batch, *args)
+
+
+async def predict_tiles(
+    pixels: np.ndarray,
+    grid: TileGrid,
+    run_batch: Callable[[np.ndarray], np.ndarray],
+    enhance_features: bool = True,
+    batch_size: int = TILE_BATCH_SIZE,
+    model_dtype: Any = np.uint8
+) -> np.ndarray:
+    """
+    Run every tile of `grid` through `run_batch` on the inference executor.
+
+    Returns:
+        (len(grid), num_classes) probabilities, in the grid's row-major order
+    """
+    windows = tile_windows(pixels, grid.tile)
+    size = min(batch_size, len(grid))
+    buffers = [np.empty((size, grid.tile, grid.tile, 3), dtype=model_dtype) for _ in range(2)]
+    outputs: List[np.ndarray] = []
+    running: Optional[asyncio.Future] = None
+    try:
+        for n, start in enumerate(range(0, len(grid), size)):
+            # Fill one buffer while the model reads the other
+            batch = await _run_fill(windows, grid.origins(start, start + size), buffers[n % 2], enhance_features)
+            if running is not None:
+                outputs.append(await running)
+            running = asyncio.ensure_future(run_inference(run_batch, batch))
+        outputs.append(await running)
+    except BaseException:
+        # The batch on the inference threads cannot be cancelled; wait for it
+        # so the request's admission slot is freed only once its work is done
+        if running is not None and not running.done():
+            await asyncio.wait([running])
+        raise
+    return np.concatenate(outputs, axis=0)
+
+
+def summarize(probabilities: np.ndarray, grid: TileGrid, class_names: List[str]) -> Dict[str, Any]:
+    """
+    Per-tile class and confidence grids and the field-level summary.
+
+    The field's predicted class is the disease found in the most tiles, or
+    HEALTHY_CLASS when no tile shows a disease.
+    """
+    top = probabilities.argmax(axis=1)
+    confidence = probabilities[np.arange(len(top)), top]
+    counts = np.bincount(top, minlength=len(class_names))
+    healthy = class_names.index(HEALTHY_CLASS) if HEALTHY_CLASS in class_names else None
+
+    diseased = np.ones(len(top), dtype=bool) if healthy is None else top != healthy
+    disease_counts = counts.copy()
+    if healthy is not None:
+        disease_counts[healthy] = 0
+    if disease_counts.any():
+        predicted = int(disease_counts.argmax())
+    else:
+        predicted = healthy if healthy is not None else int(counts.argmax())
+
+    hotspots = []
+    for i in np.argsort(-confidence * diseased, kind="stable")[:_HOTSPOTS]:
+        if not diseased[i]:
+            break
+        y, x = grid.origins(int(i), int(i) + 1)[0]
+        hotspots.append({
+            "class": class_names[top[i]],
+            "confidence": round(float(confidence[i]), 4),
+            "row": int(i) // grid.cols,
+            "col": int(i) % grid.cols,
+            "x": x,
+            "y": y
+        })
+
+    names = np.asarray(class_names, dtype=object)[top].reshape(grid.rows, grid.cols)
+    return {
+        "grid": {
+            "rows": grid.rows,
+            "cols": grid.cols,
+            "x": grid.xs,
+            "y": grid.ys,
+            "classes": names.tolist(),
+            "confidences": np.round(confidence, 4).reshape(grid.rows, grid.cols).tolist()
+        },
+        "summary": {
+            "predicted_class": class_names[predicted],
+            "tiles": len(top),
+            "affected_fraction": round(float(diseased.mean()), 4),
+            "class_coverage": {
+                class_names[i]: round(int(count) / len(top), 4) for i, count in enumerate(counts) if count
+            },
+            "mean_confidences": {
+                name: round(float(value), 4) for name, value in zip(class_names, probabilities.mean(axis=0))
+            },
+            "hotspots": hotspots
+        }
+    }
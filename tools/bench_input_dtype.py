@@ -0,0 +1,91 @@
+"""
+Measure what uint8 model input saves against float32 model input.
+
+For each path through preprocessing (upload, /predict/raw with and without
+enhancement) this reports,
+with UINT8_INPUT on and off:
+  alloc     peak NumPy allocation per request (tracemalloc; Pillow's own
+            image buffers are not traced and are the same either way)
+  model     bytes of the array handed to the batcher
+  ms        time per request
+and, per batch of MAX_BATCH_SIZE images, the bytes of the concatenated batch
+(also what crosses shared memory with INFERENCE_SHARED=1) and the time of the
+one per-batch scaling (`inference.to_float_input`) that replaces the
+per-request one when the backend runs a float model.
+
+Usage:
+    python tools/bench_input_dtype.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MAX_BATCH_SIZE  # noqa: E402
+from decode_parity import synthetic_leaf  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from inference import to_float_input  # noqa: E402
+
+
+def _peak_alloc(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def _time_ms(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def paths(uint8_input):
+    jpeg = synthetic_leaf((1600, 1200))
+    pixels = np.random.default_rng(0).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    processor = ImageProcessor(uint8_input=uint8_input)
+    return [
+        ("upload", lambda: processor.process_image_bytes(jpeg, content_type="image/jpeg")[0]),
+        ("raw, enhanced", lambda: processor.process_tensor(pixels)),
+        ("raw, not enhanced", lambda: processor.process_tensor(pixels, enhance_features=False)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'path':20s} {'input':7s} {'alloc KiB':>10s} {'model KiB':>10s} {'ms':>7s}")
+    samples = {}
+    for uint8_input in (False, True):
+        label = "uint8" if uint8_input else "float32"
+        for name, fn in paths(uint8_input):
+            peak, array = _peak_alloc(fn)
+            samples[label] = array
+            ms = _time_ms(fn, args.iterations)
+            print(f"{name:20s} {label:7s} {peak / 1024:10.1f} {array.nbytes / 1024:10.1f} {ms:7.3f}")
+
+    print(f"\nbatch of {MAX_BATCH_SIZE} (MAX_BATCH_SIZE):")
+    for label, sample in samples.items():
+        batch = np.repeat(sample, MAX_BATCH_SIZE, axis=0)
+        print(f"  {label:7s} batch {batch.nbytes / 1024:8.1f} KiB")
+    batch = np.repeat(samples["uint8"], MAX_BATCH_SIZE, axis=0)
+    peak, _ = _peak_alloc(lambda: to_float_input(batch))
+    ms = _time_ms(lambda: to_float_input(batch), args.iterations)
+    print(f"  to_float_input once per batch: {ms:.3f} ms, {peak / 1024:.1f} KiB (float models only)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Benchmark the priority-ordered medicine index against the old list handling.
+
+The old code sorted the list by priority on every read, scanned it for
+duplicate names, and on every write ran `_reorder_medicines` (shift loop,
+sort, full renumbering) plus another sort. `knowledge_base.MedicineIndex`
+keeps the list in priority order, so reads return it as is, and
+insert/move/delete only touch the range that changes.
+
+For each catalog size this times, per operation:
+  read      return the list in priority order
+  dup-check test whether a name already exists
+  insert    add a medicine at priority n/2
+  move      move the medicine at position n/4 to priority 3n/4
+  delete    remove the medicine at position n/2
+and, with --store, the same writes end to end through JsonKnowledgeBase
+(whole-file rewrites and the change journal) and SQLiteKnowledgeBase in a
+temporary directory.
+
+Usage:
+    python tools/bench_medicines.py [--sizes 100,1000,5000] [--iterations N] [--store]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import (  # noqa: E402
+    MEDICINES,
+    JsonKnowledgeBase,
+    MedicineIndex,
+    SQLiteKnowledgeBase,
+    medicine_catalog,
+)
+
+
+def _catalog(size):
+    return [
+        {"name": f"Product {i}", "brand": f"Brand {i % 37}", "type": "Fungicide", "price": f"Rs. {100 + i}", "priority": i + 1}
+        for i in range(size)
+    ]
+
+
+# The pre-index implementation, kept here as the baseline
+def _legacy_reorder(medicines, new_medicine, original_index=None):
+    new_priority = new_medicine.get("priority", 999)
+    if original_index is not None and 0 <= original_index < len(medicines):
+        medicines.pop(original_index)
+    if any(m.get("priority") == new_priority for m in medicines):
+        for med in medicines:
+            if med.get("priority", 999) >= new_priority:
+                med["priority"] = med.get("priority", 999) + 1
+    medicines.append(new_medicine)
+    medicines.sort(key=lambda m: m.get("priority", 999))
+    for i, med in enumerate(medicines):
+        med["priority"] = i + 1
+
+
+def _legacy_insert(medicines, medicine):
+    _legacy_reorder(medicines, medicine)
+    medicines.sort(key=lambda m: m.get("priority", 999))
+
+
+def _legacy_move(medicines, idx, medicine):
+    _legacy_reorder(medicines, medicine, original_index=idx)
+    medicines.sort(key=lambda m: m.get("priority", 999))
+
+
+def _legacy_delete(medicines, idx):
+    medicines.pop(idx)
+    medicines.sort(key=lambda m: m.get("priority", 999))
+    for i, med in enumerate(medicines):
+        med["priority"] = i + 1
+
+
+def _time(fn, setup, iterations):
+    """Mean milliseconds of fn(state) where state = setup() is rebuilt (untimed) before each call."""
+    total = 0.0
+    for _ in range(iterations):
+        state = setup()
+        start = time.perf_counter()
+        fn(state)
+        total += time.perf_counter() - start
+    return total / iterations * 1000
+
+
+def bench_memory(size, iterations):
+    items = _catalog(size)
+    catalog = medicine_catalog(items)
+    mid, quarter, three_quarters = size // 2, size // 4, 3 * size // 4
+    new = {"name": "New product", "priority": mid + 1}
+    moved = {"name": f"Product {quarter}", "priority": three_quarters + 1}
+
+    def legacy_copy():
+        return [dict(m) for m in items]
+
+    def index_copy():
+        return MedicineIndex(catalog)
+
+    return {
+        "read": (
+            _time(lambda meds: sorted(meds, key=lambda m: m.get("priority", 999)), lambda: items, iterations),
+            _time(lambda meds: meds, lambda: catalog, iterations),
+        ),
+        "dup-check": (
+            _time(lambda meds: "new product" in [m.get("name", "").lower() for m in meds], lambda: items, iterations),
+            _time(lambda meds: meds.has_name("New product"), lambda: catalog, iterations),
+        ),
+        "insert": (
+            _time(lambda meds: _legacy_insert(meds, dict(new)), legacy_copy, iterations),
+            _time(lambda index: index.insert(dict(new)), index_copy, iterations),
+        ),
+        "move": (
+            _time(lambda meds: _legacy_move(meds, quarter, dict(moved)), legacy_copy, iterations),
+            _time(lambda index: index.replace(quarter, dict(moved)), index_copy, iterations),
+        ),
+        "delete": (
+            _time(lambda meds: _legacy_delete(meds, mid), legacy_copy, iterations),
+            _time(lambda index: index.pop(mid), index_copy, iterations),
+        ),
+    }
+
+
+def bench_store(size, iterations):
+    """End-to-end write latency (including storage) per backend."""
+    import json
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        info_path = os.path.join(tmp, "info.json")
+        medicines_path = os.path.join(tmp, "medicines.json")
+        with open(info_path, "w") as f:
+            json.dump({}, f)
+        with open(medicines_path, "w") as f:
+            json.dump({"blast": _catalog(size), "tungro": _catalog(size)}, f)
+        backends = {
+            "json-rewrite": JsonKnowledgeBase(info_path, medicines_path, journal=False),
+            "json": JsonKnowledgeBase(info_path, medicines_path),
+            "sqlite": SQLiteKnowledgeBase(os.path.join(tmp, "kb.sqlite3"), info_path, medicines_path),
+        }
+        for name, kb in backends.items():
+            kb.medicines()
+            start = time.perf_counter()
+            for i in range(iterations):
+                kb.update_medicines("blast", lambda index: index.insert({"name": f"Bench {i}", "priority": size // 2}))
+                kb.update_medicines("blast", lambda index: index.pop(size // 2))
+            write_ms = (time.perf_counter() - start) / (2 * iterations) * 1000
+            start = time.perf_counter()
+            for _ in range(iterations):
+                kb.etag(MEDICINES, "blast")
+                kb.medicines()["blast"]
+            read_ms = (time.perf_counter() - start) / iterations * 1000
+            results[name] = (write_ms, read_ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,5000")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--store", action="store_true", help="also time writes through the storage backends")
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"{size} medicines per disease")
+        for op, (legacy_ms, index_ms) in bench_memory(size, args.iterations).items():
+            print(f"  {op:9s} legacy={legacy_ms:8.3f}ms index={index_ms:8.3f}ms speedup={legacy_ms / max(index_ms, 1e-6):7.1f}x")
+        if args.store:
+            for backend, (write_ms, read_ms) in bench_store(size, max(1, args.iterations // 5)).items():
+                print(f"  store {backend:12s} write={write_ms:8.3f}ms read={read_ms:8.3f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Measure /predict response size and serialization cost per verbosity level.
+
+For a realistic prediction (all classes from labels.txt, disease info from
+the knowledge base, metadata of a processed synthetic photo) this reports,
+per response shape:
+  bytes     body size, raw and gzip-compressed
+  legacy    building the full response the old way (processing_info rebuilt,
+            disease_info looked up, FastAPI's jsonable_encoder + json.dumps)
+  current   main._build_prediction_response + orjson, as /predict now does
+
+Usage:
+    SKIP_MODEL_LOAD=1 python tools/bench_response.py [--iterations N]
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SKIP_MODEL_LOAD", "1")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+import main  # noqa: E402
+from http_cache import serialize  # noqa: E402
+from image_processor import ImageProcessor, build_processing_info  # noqa: E402
+from decode_parity import synthetic_leaf  # noqa: E402
+
+SHAPES = [
+    ("minimal", {"verbosity": "minimal"}),
+    ("minimal, top_k=3", {"verbosity": "minimal", "top_k": 3}),
+    ("standard", {"verbosity": "standard"}),
+    ("full", {"verbosity": "full"}),
+]
+
+
+def legacy_response(predictions, metadata, enhance_features=True):
+    """The response as built and serialized before verbosity levels and orjson."""
+    metadata = {**metadata, "processing_info": build_processing_info.__wrapped__((224, 224), 85, enhance_features)}
+    top_class_idx = int(np.argmax(predictions))
+    predicted_class = main.class_names[top_class_idx]
+    disease_details = main.knowledge_base.disease_info().get(predicted_class, {})
+    payload = {
+        "predicted_class": predicted_class,
+        "confidence": round(float(predictions[top_class_idx]), 4),
+        "all_confidences": {name: round(float(conf), 4) for name, conf in zip(main.class_names, predictions)},
+        "disease_info": {
+            "name": predicted_class,
+            "description": disease_details.get("description", "No description available"),
+            "symptoms": disease_details.get("symptoms", []),
+            "treatment": disease_details.get("treatment", [])
+        },
+        "image_metadata": metadata,
+        "prediction_quality": "rice_optimized" if enhance_features else "standard"
+    }
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def current_response(predictions, metadata, verbosity="full", top_k=None):
+    fields = main._response_fields(verbosity, None, top_k)
+    metadata = {**metadata, "processing_info": build_processing_info((224, 224), 85, True)}
+    return serialize(main._build_prediction_response(predictions, metadata, True, fields, top_k))
+
+
+def _time_us(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    predictions = rng.dirichlet(np.ones(len(main.class_names))).astype(np.float32)
+    # A diseased prediction, so disease_info carries symptoms and treatment
+    predictions[main.class_names.index("blast")] = 1.0
+    predictions /= predictions.sum()
+    _, metadata = ImageProcessor().process_image_bytes(synthetic_leaf((1600, 1200)), filename="leaf.jpg", content_type="image/jpeg")
+
+    legacy = legacy_response(predictions, metadata)
+    legacy_us = _time_us(lambda: legacy_response(predictions, metadata), args.iterations)
+    print(f"{'shape':18s} {'bytes':>7s} {'gzip':>6s} {'us/response':>12s}")
+    print(f"{'legacy full':18s} {len(legacy):7d} {len(gzip.compress(legacy)):6d} {legacy_us:12.1f}")
+    for label, params in SHAPES:
+        body = current_response(predictions, metadata, **params)
+        us = _time_us(lambda: current_response(predictions, metadata, **params), args.iterations)
+        print(f"{label:18s} {len(body):7d} {len(gzip.compress(body)):6d} {us:12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
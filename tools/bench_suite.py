@@ -0,0 +1,524 @@
+"""
+Reproducible benchmark and load-test suite with regression gating.
+
+Scenarios (--scenarios, default all):
+  micro    times each ImageProcessor stage (decode, resize, enhancement,
+           to_model_format, the whole pipeline and the /predict/raw tensor
+           path) on
+           synthetic leaf photos in JPEG, PNG, WEBP and TIFF at several
+           resolutions, plus the model call at batch size 1 and at
+           PREDICT_MAX_BATCH_SIZE
+  predict  drives POST /predict with --concurrency clients, cycling through
+           the same synthetic images (prediction cache disabled)
+  crud     drives the knowledge base endpoints: cached reads, with every
+           fifth request a medicine insert or delete
+
+Load tests run against the app in this process through httpx's ASGI
+transport (--target inprocess) or against a local uvicorn server started for
+the run (--target uvicorn). Writes go to a scratch copy of the knowledge
+base. With SKIP_MODEL_LOAD=1 a stub model (fixed probabilities, optionally
+after --stub-latency-ms per batch) stands in for the real one, so the suite
+runs without TensorFlow; the results record which model was used.
+
+Each run reports p50/p95/p99 latency, throughput and peak RSS, and can be
+saved as a JSON baseline and compared against one:
+
+    python tools/bench_suite.py run --output baseline.json
+    python tools/bench_suite.py run --compare baseline.json [--threshold 0.2]
+    python tools/bench_suite.py compare baseline.json current.json
+
+A comparison exits with status 1 when any latency or peak RSS grows, or any
+throughput drops, by more than --threshold (a fraction of the baseline).
+Latency changes below --min-delta-ms are ignored as noise. Baselines are
+only meaningful on the same machine with the same settings.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every /predict request should reach the pipeline and the model
+os.environ.setdefault("PREDICTION_CACHE_BACKEND", "none")
+
+from batching import MAX_BATCH_SIZE  # noqa: E402
+from image_processor import ImageProcessor  # noqa: E402
+from inference import InferenceBackend, ModelLoader  # noqa: E402
+from decode_parity import synthetic_leaf  # noqa: E402
+
+SKIP_MODEL = os.environ.get("SKIP_MODEL_LOAD") == "1"
+FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "TIFF": "image/tiff"}
+READ_PATHS = (
+    "/disease-info",
+    "/disease-info/blast",
+    "/disease-medicines?name=blast",
+    "/medicines/blast",
+    "/medicines",
+    "/crud/disease-info/blast",
+)
+
+
+class StubModel(InferenceBackend):
+    """Stands in for the classifier under SKIP_MODEL_LOAD=1: the same probabilities for every image."""
+
+    name = "stub"
+
+    def __init__(self, num_classes: int, latency_ms: float = 0.0):
+        super().__init__("stub")
+        self.latency_s = latency_ms / 1000
+        row = np.arange(num_classes, 0, -1, dtype=np.float32)
+        self._row = row / row.sum()
+
+    def predict(self, batch):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return np.tile(self._row, (len(batch), 1))
+
+
+def load_model(args, num_classes):
+    if SKIP_MODEL:
+        return StubModel(num_classes, args.stub_latency_ms)
+    return ModelLoader("mymodel", range(1, MAX_BATCH_SIZE + 1)).load()
+
+
+def build_corpus(resolutions, formats):
+    """Synthetic leaf photos: (name, encoded bytes, content type) per resolution and format."""
+    corpus = []
+    for seed, resolution in enumerate(resolutions.split(",")):
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for fmt in formats.upper().split(","):
+            corpus.append((f"{fmt.lower()}-{width}x{height}", synthetic_leaf((width, height), seed, fmt), FORMATS[fmt]))
+    return corpus
+
+
+def summarize(samples, elapsed=None):
+    """Latency percentiles (ms) and throughput for a list of per-call durations in seconds."""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 4)
+
+    elapsed = elapsed if elapsed is not None else sum(ordered)
+    return {
+        "n": len(ordered),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "throughput_per_s": round(len(ordered) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def _time(fn, iterations):
+    fn()  # warm-up
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run_micro(corpus, model, iterations):
+    processor = ImageProcessor()
+    results = {}
+    resized = None
+    for name, contents, content_type in corpus:
+        image, _ = processor._load_image(contents, content_type)
+        results[f"micro/decode/{name}"] = _time(lambda: processor._load_image(contents, content_type), iterations)
+        results[f"micro/resize/{name}"] = _time(lambda: processor._resize(image, True, (255, 255, 255)), iterations)
+        results[f"micro/pipeline/{name}"] = _time(
+            lambda: processor.process_image_bytes(contents, content_type=content_type), iterations
+        )
+        if resized is None:
+            resized = processor._resize(image, True, (255, 255, 255))
+
+    # Everything after resizing works on the 224x224 image, whatever the source
+    enhanced = processor._enhance_image(resized)
+    results["micro/enhance"] = _time(lambda: processor._enhance_image(resized), iterations)
+    results["micro/to_model_format"] = _time(lambda: processor._to_model_format(enhanced), iterations)
+
+    # /predict/raw: a pre-resized uint8 tensor skips decode and resize
+    pixels = np.asarray(resized.convert("RGB"))
+    results["micro/tensor"] = _time(lambda: processor.process_tensor(pixels, enhance_features=False), iterations)
+    results["micro/tensor_enhanced"] = _time(lambda: processor.process_tensor(pixels), iterations)
+
+    sample = processor.process_image_bytes(corpus[0][1], content_type=corpus[0][2])[0]
+    for batch_size in sorted({1, MAX_BATCH_SIZE}):
+        batch = np.repeat(sample, batch_size, axis=0)
+        results[f"micro/model/batch-{batch_size}"] = _time(lambda: model.predict(batch), iterations)
+    return results
+
+
+def _multipart(name, contents, content_type):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + contents + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def predict_plan(corpus):
+    """Request i of the predict scenario: (method, path, body, headers, expected status)."""
+    bodies = [_multipart(f"{name}.{content_type.split('/')[1]}", contents, content_type) for name, contents, content_type in corpus]
+
+    def request(i):
+        body, content_type = bodies[i % len(bodies)]
+        return "POST", "/predict", body, {"Content-Type": content_type}, 200
+    return request
+
+
+def crud_plan():
+    """Request i of the crud scenario; writes alternate between an insert at the top and deleting the top entry."""
+    from auth import API_KEY, API_KEY_NAME
+
+    def request(i):
+        if i % 5 != 4:
+            return "GET", READ_PATHS[i % len(READ_PATHS)], None, {}, 200
+        headers = {API_KEY_NAME: API_KEY}
+        if (i // 5) % 2 == 0:
+            body = json.dumps({"name": f"Bench product {i}", "priority": 1}).encode()
+            return "POST", "/medicines/blast", body, {**headers, "Content-Type": "application/json"}, 201
+        return "DELETE", "/medicines/blast/0", None, headers, 200
+    return request
+
+
+def scratch_knowledge_base(directory):
+    """A KNOWLEDGE_BASE_BACKEND knowledge base over copies of the JSON files in `directory`."""
+    import knowledge_base
+
+    paths = []
+    for name in ("disease_info.json", "disease_medicines.json"):
+        paths.append(shutil.copy(os.path.join(ROOT, name), os.path.join(directory, name)))
+    if knowledge_base.KNOWLEDGE_BASE_BACKEND == "sqlite":
+        return knowledge_base.SQLiteKnowledgeBase(os.path.join(directory, "knowledge_base.sqlite3"), *paths)
+    return knowledge_base.JsonKnowledgeBase(*paths)
+
+
+def prepare_app(kb_dir, model):
+    """Import main with a scratch knowledge base and the given model installed."""
+    import main
+
+    main.knowledge_base = scratch_knowledge_base(kb_dir)
+    main.model = model
+    return main
+
+
+async def _drive_asgi(app, plan, total, concurrency):
+    import httpx
+
+    # image_processor configures INFO logging; one line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    latencies, errors = [], []
+    counter = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for i in counter:
+                method, path, body, headers, expected = plan(i)
+                start = time.perf_counter()
+                response = await client.request(method, path, content=body, headers=headers)
+                elapsed = time.perf_counter() - start
+                if response.status_code == expected:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(f"{method} {path}: {response.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return latencies, errors, wall
+
+
+def _drive_http(port, plan, total, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, body, headers, expected = plan(i)
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError as e:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == expected:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(f"{method} {path}: {status}")
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def _load_result(latencies, errors, wall):
+    result = summarize(latencies, wall)
+    result["errors"] = len(errors)
+    if errors:
+        print(f"  {len(errors)} failed requests, e.g. {errors[0]}", file=sys.stderr)
+    return result
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_mb(pid=None):
+    """Peak resident set size of `pid` (from /proc) or of this process."""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _wait_ready(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"benchmark server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/ready")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"benchmark server not ready after {timeout:.0f}s")
+
+
+def run_load(args, corpus, model, scenarios):
+    results = {}
+    plans = {"predict": lambda: predict_plan(corpus), "crud": crud_plan}
+    with tempfile.TemporaryDirectory(prefix="paddy-bench-") as kb_dir:
+        if args.target == "inprocess":
+            main = prepare_app(kb_dir, model)
+            for scenario in scenarios:
+                print(f"load: {scenario} ({args.requests} requests, {args.concurrency} clients)", file=sys.stderr)
+                run = _drive_asgi(main.app, plans[scenario](), args.requests, args.concurrency)
+                results[f"load/{scenario}"] = _load_result(*asyncio.run(run))
+            results["memory/peak_rss"] = {"peak_rss_mb": _peak_rss_mb()}
+            return results
+
+        port = _free_port()
+        command = [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port), "--kb-dir", kb_dir,
+                   "--stub-latency-ms", str(args.stub_latency_ms)]
+        server = subprocess.Popen(command, cwd=ROOT)
+        try:
+            _wait_ready(port, server, args.ready_timeout)
+            for scenario in scenarios:
+                print(f"load: {scenario} ({args.requests} requests, {args.concurrency} clients)", file=sys.stderr)
+                results[f"load/{scenario}"] = _load_result(*_drive_http(port, plans[scenario](), args.requests, args.concurrency))
+            results["memory/peak_rss"] = {"peak_rss_mb": _peak_rss_mb(server.pid)}
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    return results
+
+
+def run(args):
+    from main import class_names
+
+    scenarios = args.scenarios.split(",")
+    corpus = build_corpus(args.resolutions, args.formats)
+    model = load_model(args, len(class_names) or 2)
+    results = {}
+    if "micro" in scenarios:
+        print(f"micro: {len(corpus)} images, {args.iterations} iterations", file=sys.stderr)
+        results.update(run_micro(corpus, model, args.iterations))
+    load_scenarios = [s for s in scenarios if s in ("predict", "crud")]
+    if load_scenarios:
+        # The uvicorn server loads its own model
+        results.update(run_load(args, corpus, model if args.target == "inprocess" else None, load_scenarios))
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "model": model.name,
+            "target": args.target,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "iterations": args.iterations,
+            "max_batch_size": MAX_BATCH_SIZE,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_delta_ms=0.1):
+    """Return one line per metric that regressed by more than `threshold` relative to the baseline."""
+    regressions = []
+    for key, base in sorted(baseline["results"].items()):
+        cur = current["results"].get(key)
+        if cur is None:
+            continue
+        for metric, before in base.items():
+            after = cur.get(metric)
+            if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+                continue
+            if metric.endswith("_ms") or metric.endswith("_mb"):
+                worse = after > before * (1 + threshold)
+                if metric.endswith("_ms") and after - before < min_delta_ms:
+                    worse = False
+            elif metric.startswith("throughput"):
+                worse = after < before * (1 - threshold)
+            elif metric == "errors":
+                worse = after > before
+            else:
+                continue
+            if worse:
+                change = f"{(after - before) / before:+.0%}" if before else "new"
+                regressions.append(f"{key} {metric}: {before} -> {after} ({change})")
+    return regressions
+
+
+def print_results(report):
+    meta = report["meta"]
+    print(f"model={meta['model']} target={meta['target']} cpus={meta['cpus']} python={meta['python']}")
+    for key, r in report["results"].items():
+        if "p50_ms" in r:
+            errors = f" errors={r['errors']}" if "errors" in r else ""
+            print(
+                f"  {key:36s} p50={r['p50_ms']:9.3f}ms p95={r['p95_ms']:9.3f}ms p99={r['p99_ms']:9.3f}ms "
+                f"{r['throughput_per_s'] or 0:9.1f}/s n={r['n']}{errors}"
+            )
+        elif "peak_rss_mb" in r:
+            print(f"  {key:36s} {r['peak_rss_mb'] or 0:.1f}MB")
+
+
+def report_comparison(baseline, current, args):
+    for field in ("model", "target", "cpus", "concurrency", "max_batch_size"):
+        if baseline["meta"].get(field) != current["meta"].get(field):
+            print(f"warning: baseline {field}={baseline['meta'].get(field)} but this run has {current['meta'].get(field)}")
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+        return 1
+    print(f"no regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+def serve(args):
+    """Run the app under uvicorn with a scratch knowledge base (and the stub model if SKIP_MODEL_LOAD=1)."""
+    import uvicorn
+
+    from main import class_names
+
+    model = StubModel(len(class_names) or 2, args.stub_latency_ms) if SKIP_MODEL else None
+    main = prepare_app(args.kb_dir, model)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--scenarios", default="micro,predict,crud")
+    run_parser.add_argument("--target", choices=("inprocess", "uvicorn"), default="inprocess")
+    run_parser.add_argument("--resolutions", default="640x480,1920x1080,4000x3000")
+    run_parser.add_argument("--formats", default=",".join(FORMATS))
+    run_parser.add_argument("--iterations", type=int, default=30, help="timed calls per micro-benchmark")
+    run_parser.add_argument("--requests", type=int, default=400, help="requests per load scenario")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--quick", action="store_true", help="small images and few iterations (smoke test)")
+    run_parser.add_argument("--ready-timeout", type=float, default=600)
+    run_parser.add_argument("--output", help="write the results as JSON (e.g. a new baseline)")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="fail if this run regressed against BASELINE")
+
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    for p in (run_parser, compare_parser):
+        p.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+        p.add_argument("--min-delta-ms", type=float, default=0.1, help="ignore latency changes below this")
+
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--kb-dir", required=True)
+
+    for p in (run_parser, serve_parser):
+        p.add_argument("--stub-latency-ms", type=float, default=0.0, help="stub model delay per batch (SKIP_MODEL_LOAD=1)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        return serve(args)
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        return report_comparison(baseline, current, args)
+
+    if args.quick:
+        args.resolutions, args.iterations, args.requests = "320x240,1280x960", 3, 40
+    report = run(args)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            return report_comparison(json.load(f), report, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
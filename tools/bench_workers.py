@@ -0,0 +1,223 @@
+"""
+Compare memory and throughput of the per-worker and shared-inference layouts.
+
+For each layout this starts gunicorn with gunicorn_conf.py on a local port:
+  local   every worker loads its own model (INFERENCE_SHARED=0)
+  shared  one inference process holds the model and the workers send it
+          batches through shared memory (INFERENCE_SHARED=1)
+waits until /ready answers 200 from every worker, drives /predict with
+concurrent clients for --duration seconds (prediction cache disabled, so
+every request reaches the model), and then reads RSS and PSS (proportional
+set size: shared pages split between the processes sharing them) of the
+master, each worker and the inference process from /proc.
+
+Usage:
+    python tools/bench_workers.py [--layouts local,shared] [--workers 4]
+                                  [--clients 16] [--duration 20] [--port 8765]
+
+Linux only (reads /proc). Extra environment (e.g. INFERENCE_BACKEND) is
+passed through to gunicorn.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _png(seed):
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _multipart(image):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"leaf.png\"\r\n"
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + image + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _memory_mb(pid):
+    """(RSS, PSS) in MB; PSS from smaps_rollup (None if unavailable)."""
+    rss = pss = None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss, pss
+
+
+def _role(pid):
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    if "resource_tracker" in cmdline:
+        return "resource tracker"
+    if "multiprocessing" in cmdline:
+        return "inference process"
+    return "worker"
+
+
+def _wait_ready(port, workers, timeout):
+    """Poll /ready until enough consecutive 200s that every worker has answered."""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/ready")
+            status = conn.getresponse().status
+            conn.close()
+        except OSError:
+            status = None
+        streak = streak + 1 if status == 200 else 0
+        if streak >= workers * 4:
+            return
+        time.sleep(0.05 if status == 200 else 0.5)
+    raise TimeoutError(f"server on port {port} not ready after {timeout:.0f}s")
+
+
+def _load(port, clients, duration):
+    body, content_type = _multipart(_png(0))
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        local = []
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/predict", body=body, headers={"Content-Type": content_type})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+    }
+
+
+def run_layout(layout, args):
+    env = dict(os.environ, INFERENCE_SHARED="1" if layout == "shared" else "0", PREDICTION_CACHE_BACKEND="none")
+    if not args.allow_skip:
+        # Measuring without a model would compare nothing
+        env.pop("SKIP_MODEL_LOAD", None)
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app",
+         "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        started = time.monotonic()
+        _wait_ready(args.port, args.workers, args.ready_timeout)
+        ready_s = time.monotonic() - started
+        load = _load(args.port, args.clients, args.duration)
+        processes = [{"pid": master.pid, "role": "master"}]
+        processes += [{"pid": pid, "role": _role(pid)} for pid in sorted(_children(master.pid))]
+        for p in processes:
+            p["rss_mb"], p["pss_mb"] = _memory_mb(p["pid"])
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+    return {
+        "layout": layout,
+        "workers": args.workers,
+        "ready_s": ready_s,
+        **load,
+        "total_rss_mb": sum(p["rss_mb"] or 0 for p in processes),
+        "total_pss_mb": sum(p["pss_mb"] or 0 for p in processes),
+        "processes": processes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", default="local,shared")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--allow-skip", action="store_true", help="keep SKIP_MODEL_LOAD=1 from the environment")
+    parser.add_argument("--json", action="store_true", help="print the full results as JSON")
+    args = parser.parse_args()
+
+    results = [run_layout(layout, args) for layout in args.layouts.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    for r in results:
+        print(
+            f"{r['layout']:6s} workers={r['workers']} ready={r['ready_s']:.1f}s "
+            f"throughput={r['throughput_rps']:.1f} req/s p50={r['p50_ms'] or 0:.0f}ms p95={r['p95_ms'] or 0:.0f}ms "
+            f"errors={r['errors']} total RSS={r['total_rss_mb']:.0f}MB PSS={r['total_pss_mb']:.0f}MB"
+        )
+        for p in r["processes"]:
+            print(f"    {p['role']:18s} pid={p['pid']:<7d} RSS={p['rss_mb'] or 0:7.1f}MB PSS={p['pss_mb'] or 0:7.1f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
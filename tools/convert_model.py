@@ -0,0 +1,319 @@
+"""
+Convert the SavedModel for the lightweight inference backends and check parity.
+
+    python tools/convert_model.py tflite [--output mymodel.tflite]
+        Convert mymodel/ with the TFLite converter (float32, no optimizations).
+
+    python tools/convert_model.py tflite --quantize dynamic|int8 --calibration DIR
+        Write a quantized model (default mymodel.quant.tflite, served with
+        INFERENCE_BACKEND=quantized). `dynamic` stores weights as INT8;
+        `int8` also quantizes activations, using ranges calibrated on the
+        images in DIR (preprocessed like /predict). --integer-io makes the
+        model's input and output INT8 as well.
+
+    python tools/convert_model.py onnx [--output mymodel.onnx] [--opset 13]
+        Convert mymodel/ with tf2onnx (pip install tf2onnx).
+
+    python tools/convert_model.py uint8 [--output mymodel_uint8] [--normalize imagenet]
+        Wrap mymodel/ in a SavedModel whose serving signature takes uint8
+        NHWC pixels and does the scaling to [0, 1] (and optionally ImageNet
+        mean/std normalization) in the graph; served with
+        INFERENCE_BACKEND=tf_uint8.
+
+    python tools/convert_model.py parity --backend tflite|onnx|tf_uint8 [--model PATH]
+        Run the SavedModel and the converted model on the same inputs and
+        check that top-1 classes agree and probabilities match within --atol.
+
+    python tools/convert_model.py evaluate --holdout DIR [--backend quantized ...]
+        Compare backends against the SavedModel on a labelled holdout set
+        (DIR/<class name>/<image>, class names as in labels.txt): model size,
+        latency at batch size 1 and --batch-size, accuracy per class and the
+        delta to the SavedModel.
+
+Conversion runs the parity check afterwards unless --skip-parity is given
+(for quantized models, and for --normalize imagenet, which changes what the
+model sees, the parity numbers are reported but not enforced; pass
+--holdout to evaluate accuracy instead). Inputs come from --images
+(preprocessed like /predict) or, without them, synthetic leaf-like images.
+Conversion and the checks need TensorFlow; serving the converted model does
+not. Exits non-zero when parity fails.
+"""
+import argparse
+import io
+import json
+import mimetypes
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from inference import (  # noqa: E402
+    MODEL_INPUT_SHAPE,
+    ONNX_MODEL_PATH,
+    PARITY_ATOL,
+    QUANTIZED_MODEL_PATH,
+    TFLITE_MODEL_PATH,
+    UINT8_MODEL_PATH,
+    OnnxBackend,
+    QuantizedTFLiteBackend,
+    TFLiteBackend,
+    TFSavedModelBackend,
+    TFUint8SavedModelBackend,
+    parity_report,
+    to_float_input,
+)
+
+SAVED_MODEL_PATH = "mymodel"
+LABELS_FILE = "labels.txt"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+BACKENDS = {
+    "tflite": TFLiteBackend,
+    "quantized": QuantizedTFLiteBackend,
+    "onnx": OnnxBackend,
+    "tf_uint8": TFUint8SavedModelBackend,
+}
+DEFAULT_PATHS = {
+    "tflite": TFLITE_MODEL_PATH,
+    "quantized": QUANTIZED_MODEL_PATH,
+    "onnx": ONNX_MODEL_PATH,
+    "tf_uint8": UINT8_MODEL_PATH,
+}
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def convert_tflite(saved_model, output, quantize="none", calibration=None, integer_io=False):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+    if quantize != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "int8":
+        def representative_dataset():
+            # One image per step, exactly as the server preprocesses it
+            for sample in calibration:
+                yield [sample[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        if integer_io:
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(saved_model, output, opset):
+    subprocess.run(
+        [sys.executable, "-m", "tf2onnx.convert", "--saved-model", saved_model, "--output", output, "--opset", str(opset)],
+        check=True,
+    )
+
+
+def wrap_uint8(saved_model, output, normalize="none"):
+    """Save the SavedModel behind a serving signature that takes uint8 pixels and scales them in the graph."""
+    import tensorflow as tf
+
+    module = tf.Module()
+    # Keep a reference so the original variables are saved with the wrapper
+    module.model = tf.saved_model.load(saved_model)
+    serving = module.model.signatures["serving_default"]
+    input_name = next(iter(serving.structured_input_signature[1]))
+
+    @tf.function(input_signature=[tf.TensorSpec((None, *MODEL_INPUT_SHAPE), tf.uint8, name=input_name)])
+    def serve(pixels):
+        # Same float32 arithmetic as ImageProcessor with UINT8_INPUT=0
+        x = tf.cast(pixels, tf.float32) / 255.0
+        if normalize == "imagenet":
+            x = (x - tf.constant(IMAGENET_MEAN)) / tf.constant(IMAGENET_STD)
+        return serving(**{input_name: x})
+
+    module.serve = serve
+    tf.saved_model.save(module, output, signatures={"serving_default": serve})
+
+
+def _synthetic_image(rng, size=(640, 480)):
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([60 + 60 * x / w, 100 + 100 * y / h, 40 + 30 * np.sin(x / 50.0)], axis=-1)
+    base += rng.normal(0, 25, (h, w, 3))
+    image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(2))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _image_files(directory):
+    return sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(directory)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_inputs(paths, count, seed=0):
+    """Preprocess images exactly like /predict; synthetic samples when no paths are given."""
+    processor = ImageProcessor()
+    if paths:
+        samples = [(open(p, "rb").read(), mimetypes.guess_type(p)[0] or "image/jpeg") for p in paths]
+    else:
+        rng = np.random.default_rng(seed)
+        samples = [(_synthetic_image(rng), "image/png") for _ in range(count)]
+    arrays = [processor.process_image_bytes(contents, content_type=content_type)[0] for contents, content_type in samples]
+    # float32 in [0, 1]: what the converters and calibration expect, and every backend accepts
+    return to_float_input(np.concatenate(arrays, axis=0))
+
+
+def load_holdout(directory, labels_file=LABELS_FILE):
+    """Labelled holdout set from DIR/<class name>/*; returns (inputs, label indices, class names)."""
+    with open(labels_file) as f:
+        class_names = [line.strip().split(maxsplit=1)[-1] for line in f if line.strip()]
+    paths, labels = [], []
+    for idx, name in enumerate(class_names):
+        files = _image_files(os.path.join(directory, name))
+        paths += files
+        labels += [idx] * len(files)
+    if not paths:
+        raise SystemExit(f"no images under {directory}/<class name>/ for classes {class_names}")
+    return load_inputs(paths, 0), np.array(labels), class_names
+
+
+def predict_all(backend, inputs, batch_size):
+    return np.concatenate([backend.predict(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)])
+
+
+def model_size_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1e6
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1e6
+
+
+def latency_ms(backend, inputs, batch_size, repeats=20):
+    """Median and p95 milliseconds per forward pass of `batch_size` images (after one warm-up pass)."""
+    batch = np.resize(inputs, (batch_size,) + inputs.shape[1:])
+    backend.predict(batch)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.predict(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50": float(np.percentile(timings, 50)), "p95": float(np.percentile(timings, 95))}
+
+
+def check_parity(saved_model, backend, model_path, inputs, atol, batch_size):
+    reference = TFSavedModelBackend(saved_model)
+    candidate = BACKENDS[backend](model_path)
+    report = parity_report(predict_all(reference, inputs, batch_size), predict_all(candidate, inputs, batch_size), atol=atol)
+    print(json.dumps({"backend": backend, "model": model_path, **report}))
+    return report["ok"]
+
+
+def evaluate(saved_model, candidates, holdout, batch_size):
+    """Size, latency and per-class accuracy of each candidate against the SavedModel."""
+    inputs, labels, class_names = load_holdout(holdout)
+    models = [("tf", saved_model, TFSavedModelBackend(saved_model))]
+    models += [(name, path, BACKENDS[name](path)) for name, path in candidates]
+    results = []
+    for name, path, backend in models:
+        predicted = predict_all(backend, inputs, batch_size).argmax(axis=1)
+        per_class = {
+            class_name: float(np.mean(predicted[labels == idx] == idx)) if np.any(labels == idx) else None
+            for idx, class_name in enumerate(class_names)
+        }
+        results.append({
+            "backend": name,
+            "model": path,
+            "size_mb": round(model_size_mb(path), 2),
+            "latency_ms": {"batch_1": latency_ms(backend, inputs, 1), f"batch_{batch_size}": latency_ms(backend, inputs, batch_size)},
+            "accuracy": float(np.mean(predicted == labels)),
+            "per_class_accuracy": per_class,
+        })
+    baseline = results[0]
+    for result in results[1:]:
+        result["accuracy_delta"] = result["accuracy"] - baseline["accuracy"]
+        result["per_class_accuracy_delta"] = {
+            c: None if acc is None else acc - baseline["per_class_accuracy"][c]
+            for c, acc in result["per_class_accuracy"].items()
+        }
+    print(json.dumps({"holdout": holdout, "samples": int(len(labels)), "models": results}, indent=2))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("tflite", "onnx", "uint8", "parity", "evaluate"))
+    parser.add_argument("--saved-model", default=SAVED_MODEL_PATH)
+    parser.add_argument(
+        "--output",
+        help="converted model path (default: TFLITE_MODEL_PATH / QUANTIZED_MODEL_PATH / ONNX_MODEL_PATH / UINT8_MODEL_PATH)",
+    )
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--quantize", choices=("none", "dynamic", "int8"), default="none", help="tflite: quantization mode")
+    parser.add_argument("--calibration", help="tflite --quantize int8: directory of sample images")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--normalize", choices=("none", "imagenet"), default="none", help="uint8: normalization in the graph")
+    parser.add_argument("--integer-io", action="store_true", help="tflite --quantize int8: INT8 model input and output")
+    parser.add_argument("--holdout", help="labelled holdout directory (DIR/<class name>/<image>)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), nargs="+", help="parity/evaluate: backends to check")
+    parser.add_argument("--model", help="parity: converted model path")
+    parser.add_argument("--images", nargs="*", default=[])
+    parser.add_argument("--samples", type=int, default=32, help="synthetic inputs when no --images are given")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--atol", type=float, default=PARITY_ATOL)
+    parser.add_argument("--skip-parity", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "evaluate":
+        if not args.holdout:
+            parser.error("evaluate needs --holdout")
+        backends = args.backend or ["quantized"]
+        evaluate(args.saved_model, [(b, DEFAULT_PATHS[b]) for b in backends], args.holdout, args.batch_size)
+        return 0
+    if args.command == "parity":
+        if not args.backend or len(args.backend) != 1:
+            parser.error("parity needs one --backend")
+        backend = args.backend[0]
+        model_path = args.model or DEFAULT_PATHS[backend]
+    else:
+        backend = {"uint8": "tf_uint8"}.get(args.command, args.command)
+        if args.quantize != "none":
+            backend = "quantized"
+        if args.command != "tflite" and args.quantize != "none":
+            parser.error("--quantize applies to tflite only")
+        model_path = args.output or DEFAULT_PATHS[backend]
+        if args.command == "tflite":
+            calibration = None
+            if args.quantize == "int8":
+                if not args.calibration:
+                    parser.error("--quantize int8 needs --calibration DIR")
+                files = _image_files(args.calibration)[:args.calibration_samples]
+                if not files:
+                    parser.error(f"no images in {args.calibration}")
+                calibration = load_inputs(files, 0)
+            convert_tflite(args.saved_model, model_path, args.quantize, calibration, args.integer_io)
+        elif args.command == "uint8":
+            wrap_uint8(args.saved_model, model_path, args.normalize)
+        else:
+            convert_onnx(args.saved_model, model_path, args.opset)
+        print(f"wrote {model_path} ({model_size_mb(model_path):.1f} MB, SavedModel {model_size_mb(args.saved_model):.1f} MB)")
+        if backend == "quantized" and args.holdout:
+            evaluate(args.saved_model, [(backend, model_path)], args.holdout, args.batch_size)
+            return 0
+        if args.skip_parity:
+            return 0
+    inputs = load_inputs(args.images, args.samples)
+    ok = check_parity(args.saved_model, backend, model_path, inputs, args.atol, args.batch_size)
+    # Quantized models are expected to drift, and a model normalized differently
+    # sees different input; their parity numbers are informational
+    return 0 if ok or backend == "quantized" or args.normalize != "none" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Compare scaled decoding against full decoding in ImageProcessor.
+
+Runs every image through the preprocessing pipeline twice (scaled_decode on
+and off) and reports how far the model input tensors drift apart, plus the
+time spent in each path.
+
+Usage:
+    python tools/decode_parity.py [image ...]
+
+Without arguments a set of synthetic leaf-like photos is generated.
+"""
+import io
+import mimetypes
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor  # noqa: E402
+from inference import to_float_input  # noqa: E402
+
+# Documented tolerance for scaled vs full decode (model input is in [0, 1])
+MEAN_ABS_TOLERANCE = 0.02
+
+
+def synthetic_leaf(size=(4000, 3000), seed=0, fmt="JPEG"):
+    """Generate a leaf-like photo: green gradient, veins, brown lesions and sensor noise."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([
+        60 + 40 * x / w,
+        120 + 60 * y / h,
+        50 + 20 * np.sin(x / 97.0),
+    ], axis=-1)
+    image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, w, max(1, w // 40)):
+        draw.line([(i, 0), (i + h // 3, h)], fill=(90, 170, 80), width=max(1, w // 800))
+    for _ in range(60):
+        cx, cy = rng.integers(0, w), rng.integers(0, h)
+        r = int(rng.integers(w // 200 + 1, w // 40 + 2))
+        draw.ellipse([cx - r, cy - r // 2, cx + r, cy + r // 2], fill=(130, 90, 40), outline=(80, 50, 20))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    noisy = np.asarray(image, dtype=np.int16) + rng.normal(0, 6, (h, w, 3)).astype(np.int16)
+    image = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, quality=90)
+    return buf.getvalue()
+
+
+def compare(contents, content_type, maintain_aspect_ratio=True, enhance_features=True):
+    """Return drift and timing between the scaled and full decode paths for one image."""
+    results = {}
+    for scaled in (False, True):
+        processor = ImageProcessor(scaled_decode=scaled)
+        start = time.perf_counter()
+        array, _ = processor.process_image_bytes(
+            contents,
+            content_type=content_type,
+            maintain_aspect_ratio=maintain_aspect_ratio,
+            enhance_features=enhance_features
+        )
+        results[scaled] = (array, time.perf_counter() - start)
+    diff = np.abs(to_float_input(results[True][0]) - to_float_input(results[False][0]))
+    return {
+        "mean_abs_diff": float(diff.mean()),
+        "max_abs_diff": float(diff.max()),
+        "full_decode_ms": results[False][1] * 1000,
+        "scaled_decode_ms": results[True][1] * 1000,
+    }
+
+
+def main(paths):
+    if paths:
+        samples = [(p, open(p, "rb").read(), mimetypes.guess_type(p)[0] or "image/jpeg") for p in paths]
+    else:
+        samples = [
+            ("synthetic 4000x3000 JPEG", synthetic_leaf((4000, 3000), 0, "JPEG"), "image/jpeg"),
+            ("synthetic 3000x4000 JPEG", synthetic_leaf((3000, 4000), 1, "JPEG"), "image/jpeg"),
+            ("synthetic 2000x1500 PNG", synthetic_leaf((2000, 1500), 2, "PNG"), "image/png"),
+        ]
+    worst = 0.0
+    for name, contents, content_type in samples:
+        for aspect in (True, False):
+            r = compare(contents, content_type, maintain_aspect_ratio=aspect)
+            worst = max(worst, r["mean_abs_diff"])
+            print(
+                f"{name:28s} aspect={str(aspect):5s} "
+                f"mean|d|={r['mean_abs_diff']:.4f} max|d|={r['max_abs_diff']:.4f} "
+                f"full={r['full_decode_ms']:7.1f}ms scaled={r['scaled_decode_ms']:7.1f}ms "
+                f"speedup={r['full_decode_ms'] / r['scaled_decode_ms']:.1f}x"
+            )
+    status = "OK" if worst <= MEAN_ABS_TOLERANCE else "EXCEEDS TOLERANCE"
+    print(f"worst mean drift {worst:.4f} (tolerance {MEAN_ABS_TOLERANCE}): {status}")
+    return 0 if worst <= MEAN_ABS_TOLERANCE else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,60 @@
+"""
+Import or export the knowledge base between the JSON files and a backend.
+
+    python tools/knowledge_base_io.py import [--db knowledge_base.sqlite3]
+        Load disease_info.json and disease_medicines.json into the SQLite
+        database, replacing whatever it holds.
+
+    python tools/knowledge_base_io.py export [--db knowledge_base.sqlite3]
+        Write the database contents back to the two JSON files (e.g. to commit
+        edits made through the CRUD endpoints).
+
+--disease-info / --medicines override the JSON file paths.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import (  # noqa: E402
+    DISEASE_INFO_FILE,
+    DISEASE_MEDICINES_FILE,
+    KNOWLEDGE_BASE_PATH,
+    JsonKnowledgeBase,
+    SQLiteKnowledgeBase,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("--db", default=KNOWLEDGE_BASE_PATH)
+    parser.add_argument("--disease-info", default=DISEASE_INFO_FILE)
+    parser.add_argument("--medicines", default=DISEASE_MEDICINES_FILE)
+    args = parser.parse_args(argv)
+    if args.command == "export" and not os.path.exists(args.db):
+        parser.error(f"database {args.db} does not exist")
+
+    files = JsonKnowledgeBase(args.disease_info, args.medicines)
+    # Seeding is skipped so an import always reflects the files given here
+    database = SQLiteKnowledgeBase(args.db, seed_disease_info_path=None, seed_medicines_path=None)
+    if args.command == "import":
+        source, target = files, database
+    else:
+        source, target = database, files
+    disease_info, medicines = source.export_documents()
+    target.import_documents(disease_info, medicines)
+    print(json.dumps({
+        "command": args.command,
+        "database": args.db,
+        "diseases": len(disease_info),
+        "medicine_categories": len(medicines),
+        "medicines": sum(len(items) for items in medicines.values()),
+    }))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import os
+from typing import BinaryIO, Callable, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+# Upper bound for any request body that does not have a more specific limit
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "50"))
+# Slack for multipart boundaries, headers and form fields around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware enforcing a per-request body size limit as bytes arrive.
+
+    Requests whose Content-Length already exceeds the limit are rejected with
+    413 before any of the body is read. Otherwise the body is counted while
+    the multipart parser consumes it (which spools file parts to disk past
+    1 MB), and the request fails with 413 as soon as the limit is crossed, so
+    an oversized or chunked upload is never buffered in full.
+    """
+
+    def __init__(self, app, limit_for: Callable[[dict], Optional[int]]):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+                break
+        if content_length is not None and content_length > limit:
+            response = JSONResponse(
+                status_code=413,
+                content={"detail": f"Request body of {content_length} bytes exceeds the {limit} byte limit"}
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds the {limit} byte limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def upload_size(file: UploadFile) -> int:
+    """Size of a received upload, without reading it into memory."""
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(position)
+    return size
+
+
+def enforce_upload_size(file: UploadFile, max_bytes: int) -> int:
+    """Raise 413 if the upload is larger than max_bytes; return its size."""
+    size = upload_size(file)
+    if size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File '{file.filename}' is {size} bytes; the limit is {max_bytes} bytes"
+        )
+    return size
+
+
+def digest_file(source: BinaryIO) -> str:
+    """SHA-256 of a binary file, read in chunks from the start; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+async def digest_upload(file: UploadFile) -> str:
+    """SHA-256 of an upload; the reads and the hashing run on a thread, off the event loop."""
+    return await asyncio.to_thread(digest_file, file.file)